@@ -1,9 +1,8 @@
 const Chunk = require('../models/Chunk');
 const Document = require('../models/Document');
 const Project = require('../models/Project');
-const { embedText } = require('../services/embedding');
 const { chat, chatWithImage } = require('../services/llm');
-const { topKChunks } = require('../utils/similarity');
+const { retrieveTopChunks } = require('../services/vectorSearch');
 
 // Heuristic: does the question look like a "suggest papers / further reading" request?
 function isPaperSuggestionQuery(text) {
@@ -76,11 +75,10 @@ async function chatWithProject(req, res) {
     // Only attempt embedding + similarity search when there are processed chunks
     const chunkQuery = { projectId };
     if (documentId) chunkQuery.documentId = documentId;
-    const chunks = await Chunk.find(chunkQuery).lean();
+    const hasChunks = Boolean(await Chunk.exists(chunkQuery));
 
-    if (chunks.length > 0) {
-      const queryEmbedding = await embedText(embeddingInput);
-      topChunks = topKChunks(queryEmbedding, chunks, 5);
+    if (hasChunks) {
+      topChunks = await retrieveTopChunks({ projectId, documentId, query: embeddingInput, k: 5 });
       ragContext = topChunks
         .map((c, i) => `[Source ${i + 1} - Page ${c.pageNumber}]\n${c.text}`)
         .join('\n\n---\n\n');
@@ -125,7 +123,7 @@ How to respond:
       ? `\n\nThe user is asking about this specific passage from the document:\n"${context}"\n`
       : '';
 
-    const noDocsNote = chunks.length === 0
+    const noDocsNote = !hasChunks
       ? '\n\n[Note: No document chunks are indexed yet for this project. Answer using your general academic knowledge.]\n'
       : '';
 
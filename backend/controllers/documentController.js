@@ -2,17 +2,88 @@ const Document = require('../models/Document');
 const Chunk = require('../models/Chunk');
 const Insight = require('../models/Insight');
 const Project = require('../models/Project');
-const { triggerProcessing } = require('../services/worker');
+const { triggerProcessing, streamProcessing, STREAM_RESULTS, ANNOTATION_MODES } = require('../services/worker');
+
+function toChunkDoc(projectId, documentId, c) {
+  return { projectId, documentId, text: c.text, embedding: c.embedding, pageNumber: c.pageNumber };
+}
+
+function toInsightDoc(projectId, documentId, i) {
+  return { projectId, documentId, pageNumber: i.pageNumber, insightText: i.insightText, highlights: i.highlights };
+}
+
+// Mark the document DONE. The annotated PDF may still be uploading in the worker: its
+// callback can land before this, so only fill in annotatedFileUrl if it hasn't already.
+async function markDone(documentId, result) {
+  await Document.findByIdAndUpdate(documentId, {
+    status: 'DONE',
+    pageCount: result.pageCount,
+    annotationOverlay: result.annotationOverlay,
+  });
+  await Document.updateOne(
+    { _id: documentId, annotatedUploadStatus: { $nin: ['DONE', 'FAILED'] } },
+    {
+      annotatedFileUrl: result.annotatedFileUrl,
+      ...(result.annotatedUploadStatus && { annotatedUploadStatus: result.annotatedUploadStatus }),
+    },
+  );
+}
+
+// Wait for the whole worker result, then store it in one go
+async function processBuffered(document, projectId, fileUrl, annotationMode) {
+  const result = await triggerProcessing({
+    documentId: document._id.toString(),
+    projectId: projectId.toString(),
+    fileUrl,
+    annotationMode,
+  });
+
+  // Store chunks
+  if (result.chunks && result.chunks.length > 0) {
+    await Chunk.insertMany(result.chunks.map((c) => toChunkDoc(projectId, document._id, c)));
+  }
+
+  // Store insights
+  if (result.insights && result.insights.length > 0) {
+    await Insight.insertMany(result.insights.map((i) => toInsightDoc(projectId, document._id, i)));
+  }
+
+  // Update document
+  await markDone(document._id, result);
+}
+
+// Store chunks and insights as the worker streams them, so they show up while processing
+async function processStreaming(document, projectId, fileUrl, annotationMode) {
+  try {
+    const summary = await streamProcessing({
+      documentId: document._id.toString(),
+      projectId: projectId.toString(),
+      fileUrl,
+      annotationMode,
+      onChunks: (chunks) => Chunk.insertMany(chunks.map((c) => toChunkDoc(projectId, document._id, c))),
+      onInsight: (insight) => Insight.create(toInsightDoc(projectId, document._id, insight)),
+    });
+    await markDone(document._id, summary);
+  } catch (err) {
+    // Drop partial results so a reprocess doesn't duplicate them
+    await Chunk.deleteMany({ documentId: document._id });
+    await Insight.deleteMany({ documentId: document._id, type: 'system' });
+    throw err;
+  }
+}
 
 // POST /api/projects/:projectId/upload
 async function uploadDocument(req, res) {
   try {
     const { projectId } = req.params;
-    const { fileUrl, filename } = req.body;
+    const { fileUrl, filename, annotationMode } = req.body;
 
     if (!fileUrl || !filename) {
       return res.status(400).json({ error: 'fileUrl and filename are required' });
     }
+    if (annotationMode && !ANNOTATION_MODES.includes(annotationMode)) {
+      return res.status(400).json({ error: `annotationMode must be one of ${ANNOTATION_MODES.join(', ')}` });
+    }
 
     // Verify project exists
     const project = await Project.findById(projectId);
@@ -27,50 +98,16 @@ async function uploadDocument(req, res) {
     });
 
     // Trigger async processing (fire and forget, handle errors gracefully)
-    triggerProcessing({
-      documentId: document._id.toString(),
-      projectId: projectId.toString(),
-      fileUrl,
-    })
-      .then(async (result) => {
-        // Store chunks
-        if (result.chunks && result.chunks.length > 0) {
-          const chunkDocs = result.chunks.map((c) => ({
-            projectId,
-            documentId: document._id,
-            text: c.text,
-            embedding: c.embedding,
-            pageNumber: c.pageNumber,
-          }));
-          await Chunk.insertMany(chunkDocs);
-        }
-
-        // Store insights
-        if (result.insights && result.insights.length > 0) {
-          const insightDocs = result.insights.map((i) => ({
-            projectId,
-            documentId: document._id,
-            pageNumber: i.pageNumber,
-            insightText: i.insightText,
-            highlights: i.highlights,
-          }));
-          await Insight.insertMany(insightDocs);
-        }
-
-        // Update document
-        await Document.findByIdAndUpdate(document._id, {
-          status: 'DONE',
-          pageCount: result.pageCount,
-          annotatedFileUrl: result.annotatedFileUrl,
-        });
-      })
-      .catch(async (err) => {
-        console.error('Processing failed:', err.message);
-        await Document.findByIdAndUpdate(document._id, {
-          status: 'ERROR',
-          errorMessage: err.message,
-        });
+    const processing = STREAM_RESULTS
+      ? processStreaming(document, projectId, fileUrl, annotationMode)
+      : processBuffered(document, projectId, fileUrl, annotationMode);
+    processing.catch(async (err) => {
+      console.error('Processing failed:', err.message);
+      await Document.findByIdAndUpdate(document._id, {
+        status: 'ERROR',
+        errorMessage: err.message,
       });
+    });
 
     res.status(201).json(document);
   } catch (err) {
@@ -147,4 +184,32 @@ async function createInsight(req, res) {
   }
 }
 
-module.exports = { uploadDocument, listDocuments, getDocument, getInsights, createInsight };
+// POST /api/documents/:documentId/annotated
+// Called by the worker once the background upload of the annotated PDF finishes
+async function setAnnotatedFile(req, res) {
+  try {
+    const { documentId } = req.params;
+    const { annotatedFileUrl, error } = req.body;
+    if (!annotatedFileUrl && !error) {
+      return res.status(400).json({ error: 'annotatedFileUrl or error is required' });
+    }
+
+    const document = await Document.findById(documentId);
+    if (!document) return res.status(404).json({ error: 'Document not found' });
+    if (annotatedFileUrl) {
+      document.annotatedFileUrl = annotatedFileUrl;
+      document.annotatedUploadStatus = 'DONE';
+    } else {
+      // Keep pointing at the original file
+      document.annotatedFileUrl = document.annotatedFileUrl || document.fileUrl;
+      document.annotatedUploadStatus = 'FAILED';
+    }
+    await document.save();
+    if (error) console.warn(`Annotated PDF upload failed for document ${documentId}: ${error}`);
+    res.json(document);
+  } catch (err) {
+    res.status(500).json({ error: err.message });
+  }
+}
+
+module.exports = { uploadDocument, listDocuments, getDocument, getInsights, createInsight, setAnnotatedFile };
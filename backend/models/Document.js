@@ -5,6 +5,10 @@ const DocumentSchema = new mongoose.Schema({
   filename: { type: String, required: true },
   fileUrl: { type: String, required: true },
   annotatedFileUrl: { type: String },
+  // Background upload of the annotated PDF; until DONE, annotatedFileUrl is the original file
+  annotatedUploadStatus: { type: String, enum: ['PENDING', 'DONE', 'FAILED'] },
+  // Highlights for the viewer to draw when the worker ran in overlay annotation mode
+  annotationOverlay: { type: mongoose.Schema.Types.Mixed },
   status: {
     type: String,
     enum: ['UPLOADED', 'PROCESSING', 'DONE', 'ERROR'],
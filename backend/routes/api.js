@@ -2,7 +2,7 @@ const express = require('express');
 const router = express.Router();
 
 const { createProject, listProjects, getProject, deleteProject, generateSummary, getProjectSummary } = require('../controllers/projectController');
-const { uploadDocument, listDocuments, getDocument, getInsights, createInsight } = require('../controllers/documentController');
+const { uploadDocument, listDocuments, getDocument, getInsights, createInsight, setAnnotatedFile } = require('../controllers/documentController');
 const { chatWithProject } = require('../controllers/chatController');
 const { getProjectKnowledgeGraph } = require('../controllers/graphController');
 
@@ -21,6 +21,7 @@ router.get('/projects/:projectId/documents', listDocuments);
 router.get('/projects/:projectId/documents/:documentId/insights', getInsights);
 router.post('/projects/:projectId/documents/:documentId/insights', createInsight);
 router.get('/documents/:documentId', getDocument);
+router.post('/documents/:documentId/annotated', setAnnotatedFile);
 
 // Chat (strictly project-scoped)
 router.post('/projects/:projectId/chat', chatWithProject);
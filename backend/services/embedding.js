@@ -1,4 +1,5 @@
 const axios = require('axios');
+const { WORKER_EMBEDDING_ENCODING, decodeEmbedding } = require('../utils/embeddingCodec');
 
 const WORKER_URL = process.env.WORKER_URL || 'http://localhost:8000';
 
@@ -6,8 +7,11 @@ const WORKER_URL = process.env.WORKER_URL || 'http://localhost:8000';
  * Generate embedding for a single text string via the Python worker's local model.
  */
 async function embedText(text) {
-  const response = await axios.post(`${WORKER_URL}/embed`, { text });
-  return response.data.embedding;
+  const response = await axios.post(`${WORKER_URL}/embed`, {
+    text,
+    embeddingEncoding: WORKER_EMBEDDING_ENCODING,
+  });
+  return decodeEmbedding(response.data, WORKER_EMBEDDING_ENCODING);
 }
 
 module.exports = { embedText };
@@ -0,0 +1,69 @@
+const axios = require('axios');
+const Chunk = require('../models/Chunk');
+const { embedText } = require('./embedding');
+const { topKChunks } = require('../utils/similarity');
+
+const WORKER_URL = process.env.WORKER_URL || 'http://localhost:8000';
+
+/**
+ * Push one document's chunks from Mongo into the worker's in-memory index.
+ * Embeddings travel as base64 float32 to keep the request small.
+ */
+async function indexDocument(projectId, documentId) {
+  const chunks = await Chunk.find({ projectId, documentId }, { text: 1, pageNumber: 1, embedding: 1 }).lean();
+  await axios.put(`${WORKER_URL}/index/${projectId}/documents/${documentId}`, {
+    embeddingEncoding: 'float32',
+    chunks: chunks.map((c) => ({
+      text: c.text,
+      pageNumber: c.pageNumber,
+      embeddingB64: Buffer.from(new Float32Array(c.embedding).buffer).toString('base64'),
+    })),
+  });
+}
+
+async function workerSearch({ projectId, query, k, documentIds }) {
+  const response = await axios.post(`${WORKER_URL}/search`, { projectId, query, k, documentIds });
+  return response.data;
+}
+
+/**
+ * Legacy path: load every chunk and rank them in JS.
+ */
+async function scanTopChunks({ projectId, documentId, query, k }) {
+  const chunkQuery = { projectId };
+  if (documentId) chunkQuery.documentId = documentId;
+  const chunks = await Chunk.find(chunkQuery).lean();
+  if (chunks.length === 0) return [];
+  const queryEmbedding = await embedText(query);
+  return topKChunks(queryEmbedding, chunks, k);
+}
+
+/**
+ * Retrieve the top-k chunks for a query within a project (optionally one document).
+ *
+ * Uses the worker's vector index; documents the worker has not indexed yet
+ * (e.g. after a restart) are pushed to it from Mongo first. Falls back to the
+ * in-process scan if the worker search is unavailable.
+ */
+async function retrieveTopChunks({ projectId, documentId, query, k = 5 }) {
+  const chunkQuery = { projectId };
+  if (documentId) chunkQuery.documentId = documentId;
+  const documentIds = (await Chunk.distinct('documentId', chunkQuery)).map(String);
+  if (documentIds.length === 0) return [];
+
+  try {
+    let data = await workerSearch({ projectId: String(projectId), query, k, documentIds });
+    if (data.missingDocumentIds && data.missingDocumentIds.length > 0) {
+      for (const missingId of data.missingDocumentIds) {
+        await indexDocument(String(projectId), missingId);
+      }
+      data = await workerSearch({ projectId: String(projectId), query, k, documentIds });
+    }
+    return data.results;
+  } catch (err) {
+    console.warn('Worker vector search failed, falling back to in-process scan:', err.message);
+    return scanTopChunks({ projectId, documentId, query, k });
+  }
+}
+
+module.exports = { retrieveTopChunks, indexDocument };
@@ -1,33 +1,58 @@
 const axios = require('axios');
+const { StringDecoder } = require('string_decoder');
+const { WORKER_EMBEDDING_ENCODING, decodeEmbedding, decodeResultEmbeddings } = require('../utils/embeddingCodec');
 
 const WORKER_URL = process.env.WORKER_URL || 'http://localhost:8000';
 const MAX_RETRIES = 5;
 const RETRY_DELAY_MS = 3000;
+const POLL_INTERVAL_MS = parseInt(process.env.WORKER_POLL_INTERVAL_MS || '2000', 10);
+const JOB_TIMEOUT_MS = parseInt(process.env.WORKER_JOB_TIMEOUT_MS || String(60 * 60 * 1000), 10);
+const STREAM_RESULTS = process.env.WORKER_STREAM_RESULTS === 'true';
+const ANNOTATION_MODES = ['full', 'incremental', 'overlay'];
+// Unset = the worker's ANNOTATION_MODE
+const ANNOTATION_MODE = process.env.WORKER_ANNOTATION_MODE || undefined;
 
 function sleep(ms) {
   return new Promise((resolve) => setTimeout(resolve, ms));
 }
 
-async function triggerProcessing({ documentId, projectId, fileUrl }) {
+function isRetryable(err) {
+  return (
+    err.code === 'ECONNREFUSED' ||
+    err.code === 'ECONNRESET' ||
+    err.code === 'ETIMEDOUT' ||
+    (err.response && (err.response.status >= 500 || err.response.status === 429))
+  );
+}
+
+function retryDelay(err) {
+  // Honour the worker's Retry-After when it is applying backpressure
+  const retryAfter = err.response && err.response.headers && err.response.headers['retry-after'];
+  const seconds = parseInt(retryAfter, 10);
+  return Number.isFinite(seconds) ? seconds * 1000 : RETRY_DELAY_MS;
+}
+
+/**
+ * Submit a document to the worker's job queue. Returns the job status payload.
+ */
+async function submitJob({ documentId, projectId, fileUrl, annotationMode }) {
   let lastError;
   for (let attempt = 1; attempt <= MAX_RETRIES; attempt++) {
     try {
-      const response = await axios.post(`${WORKER_URL}/process`, {
+      const response = await axios.post(`${WORKER_URL}/jobs`, {
         documentId,
         projectId,
         fileUrl,
+        embeddingEncoding: WORKER_EMBEDDING_ENCODING,
+        annotationMode: annotationMode || ANNOTATION_MODE,
       });
       return response.data;
     } catch (err) {
       lastError = err;
-      const isConnectionError =
-        err.code === 'ECONNREFUSED' ||
-        err.code === 'ECONNRESET' ||
-        err.code === 'ETIMEDOUT' ||
-        (err.response && err.response.status >= 500);
-      if (isConnectionError && attempt < MAX_RETRIES) {
-        console.warn(`Worker attempt ${attempt} failed (${err.code || err.message}), retrying in ${RETRY_DELAY_MS}ms...`);
-        await sleep(RETRY_DELAY_MS);
+      if (isRetryable(err) && attempt < MAX_RETRIES) {
+        const delay = retryDelay(err);
+        console.warn(`Worker submit attempt ${attempt} failed (${err.code || err.message}), retrying in ${delay}ms...`);
+        await sleep(delay);
       } else {
         throw err;
       }
@@ -36,4 +61,105 @@ async function triggerProcessing({ documentId, projectId, fileUrl }) {
   throw lastError;
 }
 
-module.exports = { triggerProcessing };
+/**
+ * Submit a document for processing and poll until the worker finishes.
+ * Resolves with the pipeline result ({ pageCount, chunks, insights, annotatedFileUrl },
+ * plus annotationOverlay in overlay annotation mode).
+ */
+async function triggerProcessing({ documentId, projectId, fileUrl, annotationMode }) {
+  let job = await submitJob({ documentId, projectId, fileUrl, annotationMode });
+  const deadline = Date.now() + JOB_TIMEOUT_MS;
+  let consecutiveErrors = 0;
+
+  while (Date.now() < deadline) {
+    await sleep(POLL_INTERVAL_MS);
+
+    let status;
+    try {
+      status = (await axios.get(`${WORKER_URL}/jobs/${job.jobId}`)).data;
+      consecutiveErrors = 0;
+    } catch (err) {
+      if (err.response && err.response.status === 404) {
+        // Worker restarted and lost the job — submit it again
+        console.warn(`Worker job ${job.jobId} vanished, resubmitting document ${documentId}`);
+        job = await submitJob({ documentId, projectId, fileUrl, annotationMode });
+        continue;
+      }
+      consecutiveErrors += 1;
+      if (!isRetryable(err) || consecutiveErrors >= MAX_RETRIES) throw err;
+      continue;
+    }
+
+    if (status.status === 'DONE') {
+      const response = await axios.get(`${WORKER_URL}/jobs/${job.jobId}/result`, {
+        params: { embeddingEncoding: WORKER_EMBEDDING_ENCODING },
+      });
+      return decodeResultEmbeddings(response.data);
+    }
+    if (status.status === 'ERROR') {
+      throw new Error(status.error || 'Worker processing failed');
+    }
+  }
+
+  throw new Error(`Worker job ${job.jobId} timed out after ${JOB_TIMEOUT_MS}ms`);
+}
+
+/**
+ * Process a document over the worker's NDJSON stream (POST /process/stream).
+ * `onChunks(chunks)` and `onInsight(insight)` are awaited in order as results
+ * arrive, so callers can persist them before the whole document is done.
+ * Resolves with the final summary ({ pageCount, annotatedFileUrl, ... }).
+ */
+async function streamProcessing({ documentId, projectId, fileUrl, annotationMode, onChunks, onInsight }) {
+  const response = await axios.post(
+    `${WORKER_URL}/process/stream`,
+    {
+      documentId,
+      projectId,
+      fileUrl,
+      embeddingEncoding: WORKER_EMBEDDING_ENCODING,
+      annotationMode: annotationMode || ANNOTATION_MODE,
+    },
+    { responseType: 'stream', timeout: JOB_TIMEOUT_MS },
+  );
+
+  const decoder = new StringDecoder('utf8'); // a multi-byte character may span two socket reads
+  let buffered = '';
+  let summary = null;
+
+  const handle = async (line) => {
+    if (!line.trim()) return;
+    const event = JSON.parse(line);
+    if (event.type === 'chunks') {
+      const dtype = event.embeddingEncoding ? event.embeddingEncoding.dtype : 'json';
+      const chunks = event.chunks.map(({ embeddingB64, embeddingScale, embedding, ...chunk }) => ({
+        ...chunk,
+        embedding: decodeEmbedding({ embedding, embeddingB64, embeddingScale }, dtype),
+      }));
+      await onChunks(chunks);
+    } else if (event.type === 'insight') {
+      await onInsight(event.insight);
+    } else if (event.type === 'summary') {
+      summary = event;
+    } else if (event.type === 'error') {
+      throw new Error(event.error || 'Worker processing failed');
+    }
+  };
+
+  // Reading is paused while a line is being persisted, so memory stays bounded
+  for await (const data of response.data) {
+    buffered += decoder.write(data);
+    let newline;
+    while ((newline = buffered.indexOf('\n')) !== -1) {
+      const line = buffered.slice(0, newline);
+      buffered = buffered.slice(newline + 1);
+      await handle(line);
+    }
+  }
+  await handle(buffered + decoder.end());
+
+  if (!summary) throw new Error('Worker stream ended without a summary');
+  return summary;
+}
+
+module.exports = { triggerProcessing, streamProcessing, STREAM_RESULTS, ANNOTATION_MODES };
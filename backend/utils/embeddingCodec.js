@@ -0,0 +1,64 @@
+/**
+ * Decoders for the worker's compact embedding wire format.
+ *
+ * When a request sets `embeddingEncoding` to float32 / float16 / int8, the worker
+ * returns `embeddingB64` (base64 of little-endian values, plus `embeddingScale`
+ * for int8) instead of a JSON `embedding` array.
+ */
+
+const WORKER_EMBEDDING_ENCODING = process.env.WORKER_EMBEDDING_ENCODING || 'float32';
+
+function halfToFloat(h) {
+  const sign = h & 0x8000 ? -1 : 1;
+  const exponent = (h >> 10) & 0x1f;
+  const fraction = h & 0x03ff;
+  if (exponent === 0) return sign * Math.pow(2, -14) * (fraction / 1024);
+  if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+  return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+}
+
+/**
+ * Return a plain number[] for an item carrying either `embedding` or `embeddingB64`.
+ */
+function decodeEmbedding(item, encoding) {
+  if (Array.isArray(item.embedding)) return item.embedding;
+  if (!item.embeddingB64) return [];
+
+  const buf = Buffer.from(item.embeddingB64, 'base64');
+  switch (encoding) {
+    case 'float32': {
+      const out = new Array(buf.length / 4);
+      for (let i = 0; i < out.length; i++) out[i] = buf.readFloatLE(i * 4);
+      return out;
+    }
+    case 'float16': {
+      const out = new Array(buf.length / 2);
+      for (let i = 0; i < out.length; i++) out[i] = halfToFloat(buf.readUInt16LE(i * 2));
+      return out;
+    }
+    case 'int8': {
+      const scale = item.embeddingScale || 1;
+      const out = new Array(buf.length);
+      for (let i = 0; i < out.length; i++) out[i] = buf.readInt8(i) * scale;
+      return out;
+    }
+    default:
+      throw new Error(`Unsupported embedding encoding: ${encoding}`);
+  }
+}
+
+/**
+ * Decode every chunk of a /process (or job result) payload in place.
+ */
+function decodeResultEmbeddings(result) {
+  if (!result || !result.embeddingEncoding || !Array.isArray(result.chunks)) return result;
+  const { dtype } = result.embeddingEncoding;
+  result.chunks = result.chunks.map(({ embeddingB64, embeddingScale, ...chunk }) => ({
+    ...chunk,
+    embedding: decodeEmbedding({ embeddingB64, embeddingScale }, dtype),
+  }));
+  delete result.embeddingEncoding;
+  return result;
+}
+
+module.exports = { WORKER_EMBEDDING_ENCODING, decodeEmbedding, decodeResultEmbeddings };
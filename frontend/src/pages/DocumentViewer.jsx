@@ -12,6 +12,7 @@ import UserMenu from '../components/UserMenu';
 const PDFJS_VERSION = '3.11.174';
 const PDFJS_CDN     = `https://cdnjs.cloudflare.com/ajax/libs/pdf.js/${PDFJS_VERSION}/pdf.min.js`;
 const WORKER_CDN    = `https://cdnjs.cloudflare.com/ajax/libs/pdf.js/${PDFJS_VERSION}/pdf.worker.min.js`;
+const ANNOTATED_UPLOAD_POLL_MS = 5000;
 
 // ─── Text-layer CSS (injected once) ─────────────────────────────────────────
 // Must be present BEFORE renderTextLayer() places <span>s into the DOM.
@@ -96,6 +97,10 @@ if (!document.getElementById('pdfjs-styles')) {
       mix-blend-mode: multiply;
       pointer-events: none;
     }
+    /* Worker highlights drawn from the JSON overlay (overlay annotation mode) */
+    .pdfPage .annotationLayer .overlayHighlight {
+      mix-blend-mode: multiply;
+    }
     /* Transparent hover hotspots placed over highlight regions */
     .pdfPage .annotationLayer .insightHotspot {
       position: absolute;
@@ -193,6 +198,19 @@ export default function DocumentViewer() {
     load();
   }, [documentId, projectId]);
 
+  // The annotated PDF is uploaded after processing; swap it in once it lands
+  const uploadPending = document_?.annotatedUploadStatus === 'PENDING';
+  useEffect(() => {
+    if (!uploadPending) return;
+    const timer = setInterval(async () => {
+      try {
+        const { data } = await getDocument(documentId, projectId);
+        if (data.annotatedUploadStatus !== 'PENDING') setDocument(data);
+      } catch (_) {}
+    }, ANNOTATED_UPLOAD_POLL_MS);
+    return () => clearInterval(timer);
+  }, [uploadPending, documentId, projectId]);
+
   const handleAddInsight = (savedInsight) => setInsights(prev => [...prev, savedInsight]);
   const handleAskAI = (text) => { setChatContext(text); setChatOpen(true); };
   const handleRegionCaptured = (base64Image) => {
@@ -273,6 +291,7 @@ export default function DocumentViewer() {
           ) : (
             <PdfRenderer
               url={document_?.annotatedFileUrl}
+              overlay={document_?.annotationOverlay}
               scale={scale}
               insights={insights}
               projectId={projectId}
@@ -390,13 +409,26 @@ function findMatchingInsight(pageInsights, annot, viewport, textDiv) {
   return bestInsight;
 }
 
+/**
+ * Match a highlight from the worker's JSON overlay to its insight by phrase and box.
+ */
+function findOverlayInsight(pageInsights, hl) {
+  const sameBox = (a, b) => a && b && ['x0', 'y0', 'x1', 'y1'].every(k => Math.abs(a[k] - b[k]) < 0.5);
+  return pageInsights.find(insight =>
+    insight.type !== 'user-created' &&
+    (insight.highlights || []).some(h => h.text === hl.text && sameBox(h.bbox, hl.bbox))
+  ) || null;
+}
+
 // ── PdfRenderer ──────────────────────────────────────────────────────────────
-function PdfRenderer({ url, scale, insights, projectId, documentId, onAddInsight, onAskAI, screenshotMode, onRegionCaptured }) {
+function PdfRenderer({ url, overlay, scale, insights, projectId, documentId, onAddInsight, onAskAI, screenshotMode, onRegionCaptured }) {
   const containerRef = useRef(null);
   const wrapperRef   = useRef(null);
   const overlayRef   = useRef(null);
   const insightsRef  = useRef(insights);
+  const annotationOverlayRef = useRef(overlay);
   useEffect(() => { insightsRef.current = insights; }, [insights]);
+  useEffect(() => { annotationOverlayRef.current = overlay; }, [overlay]);
 
   const [tooltip,          setTooltip]          = useState(null);
   const [selectionToolbar, setSelectionToolbar]  = useState(null);
@@ -657,6 +689,36 @@ function PdfRenderer({ url, scale, insights, projectId, documentId, onAddInsight
             annotLayer.appendChild(hotspot);
           });
 
+          // Overlay annotation mode: the PDF carries no highlights, draw them from JSON
+          // (boxes are PDF points from the page's top-left corner)
+          const overlayData = annotationOverlayRef.current;
+          const overlayPage = (overlayData?.pages || []).find(p => p.pageNumber === pageNum);
+          const [r, g, b] = (overlayData?.color || [1, 0.8, 0]).map(c => Math.round(c * 255));
+          (overlayPage?.highlights || []).forEach((hl) => {
+            const { x0, y0, x1, y1 } = hl.bbox;
+            const mark        = document.createElement('div');
+            mark.className    = 'insightHotspot overlayHighlight';
+            mark.style.left   = `${x0 * scale}px`;
+            mark.style.top    = `${y0 * scale}px`;
+            mark.style.width  = `${(x1 - x0) * scale}px`;
+            mark.style.height = `${(y1 - y0) * scale}px`;
+            mark.style.background = `rgba(${r}, ${g}, ${b}, ${overlayData.opacity ?? 0.4})`;
+
+            mark.addEventListener('mouseenter', () => {
+              const pageInsights = (insightsRef.current || []).filter(ins => ins.pageNumber === pageNum);
+              const matched = findOverlayInsight(pageInsights, hl);
+              if (matched) {
+                const rect = mark.getBoundingClientRect();
+                setTooltip({
+                  insight: matched,
+                  anchorRect: { centerX: rect.left + rect.width / 2, topY: rect.top, bottomY: rect.bottom },
+                });
+              }
+            });
+            mark.addEventListener('mouseleave', () => setTooltip(null));
+            annotLayer.appendChild(mark);
+          });
+
           wrapper.appendChild(annotLayer);
           if (!cancelled) containerRef.current?.appendChild(wrapper);
         }
@@ -0,0 +1,396 @@
+import os
+import json
+import fcntl
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+from functools import cached_property
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from checkpoints import atomic_write, safe_name
+from vector_index import normalize_rows, top_k
+
+logger = logging.getLogger('worker.ann_index')
+
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", os.path.join(tempfile.gettempdir(), "mirage-ann"))
+ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "50000"))    # projects smaller than this stay brute-force
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))                  # lists scanned per query (recall vs latency)
+ANN_LISTS_FACTOR = float(os.getenv("ANN_LISTS_FACTOR", "4"))    # nlist = factor * sqrt(N)
+ANN_KMEANS_ITERS = int(os.getenv("ANN_KMEANS_ITERS", "10"))
+ANN_DELTA_MAX_FRACTION = float(os.getenv("ANN_DELTA_MAX_FRACTION", "0.1"))  # compact beyond this
+
+CURRENT = "CURRENT"
+DELTA = "delta"
+LOCK = ".lock"
+
+# A document's contents as (vectors, texts, pages)
+DocumentData = Tuple[np.ndarray, List[str], np.ndarray]
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, batch: int = 16384) -> np.ndarray:
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch):
+        out[start:start + batch] = np.argmax(vectors[start:start + batch] @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iters: int = ANN_KMEANS_ITERS, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on (a sample of) normalised vectors."""
+    rng = np.random.default_rng(seed)
+    nlist = max(1, min(nlist, len(vectors)))
+    sample_size = min(len(vectors), nlist * 256)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iters):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        # Re-seed empty lists from random sample points
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class _Segment:
+    """One immutable, memory-mapped IVF version."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        load = lambda name: np.load(os.path.join(directory, name), mmap_mode="r")  # noqa: E731
+        self.centroids = np.load(os.path.join(directory, "centroids.npy"))
+        self.vectors = load("vectors.npy")
+        self.offsets = np.load(os.path.join(directory, "list_offsets.npy"))
+        self.doc_idx = load("doc_idx.npy")
+        self.pages = load("pages.npy")
+        self.text_offsets = load("text_offsets.npy")
+        text_path = os.path.join(directory, "texts.bin")
+        self.texts = (
+            np.memmap(text_path, dtype=np.uint8, mode="r")
+            if os.path.getsize(text_path) else np.empty(0, dtype=np.uint8)
+        )
+        with open(os.path.join(directory, "documents.json")) as f:
+            self.documents: List[str] = json.load(f)
+
+    def text(self, row: int) -> str:
+        start, end = int(self.text_offsets[row]), int(self.text_offsets[row + 1])
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+    @cached_property
+    def document_sizes(self) -> np.ndarray:
+        """Rows per entry of `documents`."""
+        return np.bincount(np.asarray(self.doc_idx), minlength=len(self.documents))
+
+    def document_rows(self) -> Dict[str, np.ndarray]:
+        rows: Dict[str, List[int]] = {}
+        for row, d in enumerate(np.asarray(self.doc_idx)):
+            rows.setdefault(self.documents[d], []).append(row)
+        return {doc: np.asarray(r, dtype=np.int64) for doc, r in rows.items()}
+
+
+def _write_segment(directory: str, docs: Dict[str, DocumentData], centroids: Optional[np.ndarray]):
+    """Cluster `docs` into a new IVF segment laid out list-by-list on disk."""
+    os.makedirs(directory, exist_ok=True)
+    documents = list(docs.keys())
+    dim = next((v.shape[1] for v, _, _ in docs.values() if len(v)), 0)
+    vectors = np.concatenate([v for v, _, _ in docs.values()]) if docs else np.empty((0, dim), np.float32)
+    doc_idx = np.concatenate([np.full(len(v), i, np.int32) for i, (v, _, _) in enumerate(docs.values())]) \
+        if docs else np.empty(0, np.int32)
+    pages = np.concatenate([p for _, _, p in docs.values()]) if docs else np.empty(0, np.int32)
+    texts = [t for _, ts, _ in docs.values() for t in ts]
+
+    if centroids is None:
+        nlist = int(ANN_LISTS_FACTOR * np.sqrt(max(1, len(vectors))))
+        centroids = train_centroids(vectors, nlist) if len(vectors) else np.empty((0, dim), np.float32)
+
+    labels = _assign(vectors, centroids) if len(vectors) else np.empty(0, np.int32)
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=len(centroids))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    encoded = [texts[i].encode("utf-8") for i in order]
+    text_offsets = np.concatenate([[0], np.cumsum([len(b) for b in encoded])]).astype(np.int64)
+
+    np.save(os.path.join(directory, "centroids.npy"), centroids.astype(np.float32))
+    np.save(os.path.join(directory, "vectors.npy"), vectors[order].astype(np.float32))
+    np.save(os.path.join(directory, "list_offsets.npy"), offsets)
+    np.save(os.path.join(directory, "doc_idx.npy"), doc_idx[order])
+    np.save(os.path.join(directory, "pages.npy"), pages[order].astype(np.int32))
+    np.save(os.path.join(directory, "text_offsets.npy"), text_offsets)
+    with open(os.path.join(directory, "texts.bin"), "wb") as f:
+        for b in encoded:
+            f.write(b)
+    with open(os.path.join(directory, "documents.json"), "w") as f:
+        json.dump(documents, f)
+
+
+class AnnIndex:
+    """
+    IVF (inverted file) index for one project, persisted under `directory`.
+
+    Layout:
+      CURRENT            -> name of the live segment directory
+      v<N>/              -> immutable segment: centroids + list-ordered vectors,
+                            doc/page/text arrays, all opened with mmap so several
+                            worker processes share one copy via the page cache
+      delta/<seq>.json   -> incremental inserts/removals since the segment
+      delta/<seq>.npy       (vectors), brute-force scanned until compaction
+
+    Writers serialise on a flock; readers just notice CURRENT/delta changes.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._segment: Optional[_Segment] = None
+        self._segment_name: Optional[str] = None
+        self._delta_names: Tuple[str, ...] = ()
+        self._delta: Dict[str, Optional[DocumentData]] = {}
+
+    # ── Construction ──────────────────────────────────────────────────────
+
+    @classmethod
+    def for_project(cls, project_id: str, root: str = ANN_INDEX_DIR) -> "AnnIndex":
+        return cls(os.path.join(root, safe_name(project_id)))
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.directory, CURRENT))
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def build(self, docs: Dict[str, DocumentData]):
+        """Replace the index with a freshly clustered segment of `docs`."""
+        docs = {doc: (normalize_rows(vectors), texts, pages) for doc, (vectors, texts, pages) in docs.items()}
+        with self._write_lock():
+            self._publish(docs, centroids=None, drop_deltas=self._list_deltas())
+
+    # ── Mutation ──────────────────────────────────────────────────────────
+
+    def insert(self, document_id: str, vectors: np.ndarray, texts: List[str], pages: np.ndarray):
+        """Add (or replace) a document via the delta log; compacts when the log grows large."""
+        with self._write_lock():
+            seq = self._next_seq()
+            base = os.path.join(self.directory, DELTA, f"{seq:010d}")
+            np.save(base + ".npy", normalize_rows(vectors))
+            # The .json is written last; it is what marks the delta entry as committed
+            atomic_write(base + ".json", json.dumps({
+                "documentId": document_id,
+                "pages": [int(p) for p in pages],
+                "texts": texts,
+            }).encode("utf-8"))
+            self._maybe_compact()
+
+    def remove(self, document_id: str):
+        with self._write_lock():
+            seq = self._next_seq()
+            path = os.path.join(self.directory, DELTA, f"{seq:010d}.json")
+            atomic_write(path, json.dumps({"documentId": document_id, "removed": True}).encode("utf-8"))
+
+    def compact(self):
+        with self._write_lock():
+            self._compact()
+
+    # ── Queries ───────────────────────────────────────────────────────────
+
+    def document_ids(self) -> List[str]:
+        self._refresh()
+        live = set(self._segment.documents) if self._segment else set()
+        for doc, data in self._delta.items():
+            if data is None:
+                live.discard(doc)
+            else:
+                live.add(doc)
+        return sorted(live)
+
+    def size(self) -> int:
+        """Live vectors: segment rows of documents the delta log replaced or removed don't count."""
+        self._refresh()
+        seg = self._segment
+        base = 0
+        if seg is not None:
+            base = sum(int(n) for d, n in zip(seg.documents, seg.document_sizes) if d not in self._delta)
+        return base + sum(len(d[1]) for d in self._delta.values() if d is not None)
+
+    def search(self, query: np.ndarray, k: int, document_ids: Optional[Iterable[str]] = None,
+               nprobe: Optional[int] = None) -> List[Dict]:
+        self._refresh()
+        q = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        allowed = set(document_ids) if document_ids is not None else None
+        candidates: List[Tuple[float, Dict]] = []
+
+        seg = self._segment
+        if seg is not None and len(seg.vectors):
+            # Base documents superseded or removed by the delta log are masked out
+            live = np.array([
+                d not in self._delta and (allowed is None or d in allowed)
+                for d in seg.documents
+            ], dtype=bool)
+            if live.any():
+                # Segments below ANN_MIN_VECTORS (see VECTOR_INDEX_SHARED) are scanned whole
+                if len(seg.vectors) < ANN_MIN_VECTORS:
+                    nprobe = len(seg.centroids)
+                probe = top_k(seg.centroids @ q, nprobe or ANN_NPROBE)
+                rows = np.concatenate([
+                    np.arange(seg.offsets[l], seg.offsets[l + 1]) for l in probe
+                ]) if len(probe) else np.empty(0, np.int64)
+                rows = rows[live[np.asarray(seg.doc_idx[rows])]] if len(rows) else rows
+                if len(rows):
+                    scores = np.asarray(seg.vectors[rows]) @ q
+                    for i in top_k(scores, k):
+                        row = int(rows[i])
+                        candidates.append((float(scores[i]), {
+                            "documentId": seg.documents[int(seg.doc_idx[row])],
+                            "pageNumber": int(seg.pages[row]),
+                            "text": seg.text(row),
+                            "score": float(scores[i]),
+                        }))
+
+        for doc, data in self._delta.items():
+            if data is None or (allowed is not None and doc not in allowed):
+                continue
+            vectors, texts, pages = data
+            scores = vectors @ q
+            for i in top_k(scores, k):
+                candidates.append((float(scores[i]), {
+                    "documentId": doc,
+                    "pageNumber": int(pages[i]),
+                    "text": texts[i],
+                    "score": float(scores[i]),
+                }))
+
+        candidates.sort(key=lambda c: -c[0])
+        return [result for _, result in candidates[:k]]
+
+    # ── Internals ─────────────────────────────────────────────────────────
+
+    def _list_deltas(self) -> List[str]:
+        directory = os.path.join(self.directory, DELTA)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(n[:-5] for n in os.listdir(directory) if n.endswith(".json"))
+
+    def _next_seq(self) -> int:
+        os.makedirs(os.path.join(self.directory, DELTA), exist_ok=True)
+        names = self._list_deltas()
+        current = self._read_current()
+        last_base = int(current[1:]) if current else 0
+        return max([last_base] + [int(n) for n in names]) + 1
+
+    def _read_current(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.directory, CURRENT)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self, attempts: int = 5):
+        """
+        Reopen the segment / reload the delta log if another process changed them.
+
+        A writer switches CURRENT before deleting the deltas it folded in and
+        keeps the previous segment until its next publish. So the delta log is
+        listed before CURRENT is read, and the state is retried if CURRENT moved
+        while loading (the deltas read may then be gone) or a segment vanished.
+        """
+        for attempt in range(attempts):
+            names = tuple(self._list_deltas())
+            name = self._read_current()
+            if name == self._segment_name and names == self._delta_names:
+                return
+            try:
+                segment = self._segment
+                if name != self._segment_name:
+                    segment = _Segment(os.path.join(self.directory, name)) if name else None
+                delta = self._load_deltas(names)
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+                continue
+            if self._read_current() != name and attempt < attempts - 1:
+                continue
+            self._segment, self._segment_name = segment, name
+            self._delta, self._delta_names = delta, names
+            return
+
+    def _load_deltas(self, names: Iterable[str]) -> Dict[str, Optional[DocumentData]]:
+        state: Dict[str, Optional[DocumentData]] = {}
+        for name in names:  # sorted by seq: later entries win
+            base = os.path.join(self.directory, DELTA, name)
+            try:
+                with open(base + ".json") as f:
+                    meta = json.load(f)
+                if meta.get("removed"):
+                    state[meta["documentId"]] = None
+                    continue
+                vectors = np.load(base + ".npy")
+            except (OSError, ValueError):
+                continue
+            state[meta["documentId"]] = (
+                vectors, meta["texts"], np.asarray(meta["pages"], dtype=np.int32)
+            )
+        return state
+
+    def _maybe_compact(self):
+        self._refresh()
+        base = len(self._segment.vectors) if self._segment else 0
+        pending = sum(len(d[1]) for d in self._delta.values() if d is not None)
+        if base == 0 or pending > ANN_DELTA_MAX_FRACTION * base:
+            self._compact()
+
+    def _compact(self):
+        """Fold the delta log into a new segment (caller holds the write lock)."""
+        self._refresh()
+        names = list(self._delta_names)
+        docs: Dict[str, DocumentData] = {}
+        seg = self._segment
+        if seg is not None:
+            for doc, rows in seg.document_rows().items():
+                if doc in self._delta:
+                    continue
+                docs[doc] = (
+                    np.asarray(seg.vectors[rows]),
+                    [seg.text(int(r)) for r in rows],
+                    np.asarray(seg.pages[rows]),
+                )
+        for doc, data in self._delta.items():
+            if data is not None:
+                docs[doc] = data
+
+        # Keep the trained lists unless the index has more than doubled
+        total = sum(len(v) for v, _, _ in docs.values())
+        reuse = seg is not None and len(seg.centroids) and total <= 2 * max(1, len(seg.vectors))
+        self._publish(docs, centroids=seg.centroids if reuse else None, drop_deltas=names)
+
+    def _publish(self, docs: Dict[str, DocumentData], centroids: Optional[np.ndarray], drop_deltas: List[str]):
+        previous = self._read_current()
+        seq = self._next_seq()
+        name = f"v{seq:010d}"
+        staging = os.path.join(self.directory, f".{name}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        _write_segment(staging, docs, centroids)
+        os.replace(staging, os.path.join(self.directory, name))
+        atomic_write(os.path.join(self.directory, CURRENT), name.encode("utf-8"))
+
+        for delta in drop_deltas:
+            for ext in (".json", ".npy"):
+                try:
+                    os.remove(os.path.join(self.directory, DELTA, delta + ext))
+                except FileNotFoundError:
+                    pass
+        # The previous segment stays for readers that read CURRENT just before
+        # the switch; older ones are removed (mapped files live until unmapped)
+        for entry in os.listdir(self.directory):
+            if entry.startswith("v") and entry[1:].isdigit() and entry not in (name, previous):
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+        logger.info('published ANN segment %s (%d documents)', name, len(docs))
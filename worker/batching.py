@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger('worker.batching')
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-item requests into one call of a blocking
+    batch function.
+
+    The first waiting item opens a batch; the batch closes once it holds
+    `max_batch_size` items or `max_wait_ms` has passed, then `batch_fn` runs
+    in a thread and each caller gets its own result back. Items arriving
+    while a batch is encoding pile up and go out together in the next one,
+    so batches grow with load without adding latency when the worker is idle.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int, max_wait_ms: float):
+        self._batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: "asyncio.Queue[Tuple[Any, asyncio.Future]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.items = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def submit(self, item: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avgBatchSize": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "maxBatchSize": self.max_batch_size,
+            "maxWaitMs": self.max_wait * 1000,
+        }
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self):
+        while True:
+            batch = await self._collect()
+            # Callers that gave up (client disconnected) don't need encoding
+            batch = [(item, fut) for item, fut in batch if not fut.done()]
+            if not batch:
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = await asyncio.to_thread(self._batch_fn, [item for item, _ in batch])
+            except Exception as e:
+                logger.warning('batch of %d failed: %s', len(batch), e)
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+
+def length_buckets(lengths: List[int], max_items: int, max_tokens: int = 0) -> List[List[int]]:
+    """
+    Group item indices into encoder batches of similar length.
+
+    Items are sorted by length so each batch pads to a near-uniform width; a
+    batch closes at `max_items` or once its padded size (items x longest)
+    would exceed `max_tokens`, so short items travel in larger batches. The
+    caller scatters results back by index to restore the original order.
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    buckets, current = [], []
+    for i in order:
+        # Ascending order: lengths[i] is the padded width if i joins the batch
+        full = len(current) >= max(1, max_items)
+        too_wide = max_tokens > 0 and (len(current) + 1) * lengths[i] > max_tokens
+        if current and (full or too_wide):
+            buckets.append(current)
+            current = []
+        current.append(i)
+    if current:
+        buckets.append(current)
+    return buckets
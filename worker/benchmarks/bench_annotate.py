@@ -0,0 +1,98 @@
+"""
+Compare the annotation modes on one PDF: full rewrite (garbage=4, deflate),
+incremental append, and the JSON overlay (no PDF written).
+
+    python benchmarks/bench_annotate.py [file.pdf] [--pages 200] [--per-page 2] [--repeat 3]
+
+Without a file, a synthetic document is generated with one noisy image per
+page so it behaves like a scanned PDF (large, image-heavy streams).
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz  # noqa: E402
+
+from document_session import DocumentSession  # noqa: E402
+from pdf_processor import annotate_pdf, annotation_overlay  # noqa: E402
+
+
+def synthetic_pdf(pages: int) -> bytes:
+    rng = np.random.default_rng(0)
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        samples = rng.integers(0, 256, size=(600, 450), dtype=np.uint8)
+        pix = fitz.Pixmap(fitz.csGRAY, 450, 600, samples.tobytes(), False)
+        page.insert_image(page.rect, pixmap=pix)
+        page.insert_text((72, 72), f"Page {n + 1}: the quick brown fox jumps over the lazy dog.")
+    data = doc.tobytes(deflate=True)
+    doc.close()
+    return data
+
+
+def synthetic_insights(data: bytes, per_page: int):
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        insights = []
+        for n, page in enumerate(doc):
+            width, height = page.rect.width, page.rect.height
+            for k in range(per_page):
+                y = 72 + k * 40
+                insights.append({
+                    "pageNumber": n + 1,
+                    "highlights": [{"text": "quick brown", "bbox": {
+                        "x0": 72.0, "y0": y - 12, "x1": min(width, 300.0), "y1": min(height, y + 4),
+                    }}],
+                })
+        return insights
+
+
+def run(mode: str, data: bytes, insights, workdir: str) -> dict:
+    output = os.path.join(workdir, f"{mode}.pdf")
+    started = time.perf_counter()
+    with DocumentSession(data) as session:
+        if mode == "overlay":
+            size = len(json.dumps(annotation_overlay(session, insights)))
+        else:
+            annotate_pdf(session, insights, output, incremental=(mode == "incremental"))
+            size = os.path.getsize(output)
+    return {"seconds": time.perf_counter() - started, "bytes": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pdf", nargs="?")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--per-page", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_pdf(args.pages)
+    insights = synthetic_insights(data, args.per_page)
+    highlights = sum(len(i["highlights"]) for i in insights)
+    print(f"input: {len(data) / 1e6:.1f} MB, {highlights} highlights")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        baseline = None
+        for mode in ("full", "incremental", "overlay"):
+            runs = [run(mode, data, insights, workdir) for _ in range(args.repeat)]
+            seconds = statistics.median(r["seconds"] for r in runs)
+            baseline = baseline or seconds
+            print(f"{mode:12s} {1000 * seconds:9.1f} ms  {runs[0]['bytes'] / 1e6:8.2f} MB  "
+                  f"{baseline / seconds:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Compare embedding backends (torch, onnx, onnx-int8) on throughput and memory.
+
+    python benchmarks/bench_embeddings.py [file.pdf] [--backends torch,onnx,onnx-int8] [--texts 512] [--repeat 3]
+
+Each backend runs in its own process, so the reported peak RSS is that
+backend alone (model + runtime + one encode pass). Without a file the
+corpus is synthetic chunk-sized text of mixed lengths; with one, it is the
+PDF's chunks as the pipeline would cut them.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+WORDS = (
+    "the model results method data analysis approach performance training network "
+    "we show that our proposed significantly improves over baseline across tasks "
+    "experiments evaluate accuracy latency memory attention layer representation "
+    "learning objective loss gradient optimization sample distribution estimate "
+    "in this paper a novel framework for retrieval of documents with high recall "
+    "figure table section appendix related work conclusion future limitations"
+).split()
+
+
+def synthetic_corpus(count: int, seed: int = 0):
+    """Chunk-like texts whose lengths span short captions to full 250-token chunks."""
+    rng = np.random.default_rng(seed)
+    texts = []
+    for _ in range(count):
+        sentences = []
+        for _ in range(int(rng.integers(1, 12))):
+            words = rng.choice(WORDS, size=int(rng.integers(5, 25)))
+            sentences.append(" ".join(words).capitalize() + ".")
+        texts.append(" ".join(sentences))
+    return texts
+
+
+def pdf_corpus(path: str):
+    from pdf_processor import chunk_pages, extract_page_data
+
+    return [chunk["text"] for chunk in chunk_pages(extract_page_data(path))]
+
+
+def load_corpus(pdf, count: int):
+    texts = pdf_corpus(pdf) if pdf else synthetic_corpus(count)
+    return texts[:count] if count else texts
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(name: str, texts, repeat: int) -> dict:
+    from embedding_backends import load_backend
+
+    baseline_rss = _peak_rss_mb()
+    started = time.perf_counter()
+    backend = load_backend(name)
+    load_seconds = time.perf_counter() - started
+    loaded_rss = _peak_rss_mb()
+
+    tokens = sum(len(backend.tokenizer.tokenize(t)) for t in texts)
+    backend.encode(texts[:32])  # warm-up
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        backend.encode(texts)
+        runs.append(time.perf_counter() - started)
+    seconds = statistics.median(runs)
+    return {
+        "backend": name,
+        "loadSeconds": load_seconds,
+        "textsPerSecond": len(texts) / seconds,
+        "tokensPerSecond": tokens / seconds,
+        "loadedRssMb": loaded_rss - baseline_rss,
+        "peakRssMb": _peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pdf", nargs="?")
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        texts = load_corpus(args.pdf, args.texts)
+        print(json.dumps(run_backend(args.child, texts, args.repeat)))
+        return
+
+    print(f"corpus: {len(load_corpus(args.pdf, args.texts))} texts")
+    print(f"{'backend':12s} {'load s':>7s} {'texts/s':>9s} {'tokens/s':>10s} {'model MB':>9s} {'peak MB':>8s} {'speedup':>8s}")
+    baseline = None
+    for name in args.backends.split(","):
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", name,
+               "--texts", str(args.texts), "--repeat", str(args.repeat)]
+        if args.pdf:
+            cmd.append(args.pdf)
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{name:12s} failed: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        baseline = baseline or r["textsPerSecond"]
+        print(f"{name:12s} {r['loadSeconds']:7.1f} {r['textsPerSecond']:9.1f} {r['tokensPerSecond']:10.0f} "
+              f"{r['loadedRssMb']:9.0f} {r['peakRssMb']:8.0f} {r['textsPerSecond'] / baseline:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Measure how /embed throughput scales with the number of worker processes.
+
+    python benchmarks/bench_processes.py [--processes 1,2,4] [--concurrency 16] [--duration 20]
+
+For each count the worker is started with `serve.py --processes N` on one
+host (embedding and LLM caches disabled, so every request is encoded),
+driven by `--concurrency` clients posting chunk-sized texts for
+`--duration` seconds, then stopped. Reported per run: requests/s,
+p50/p95 latency, and the proportional memory (PSS) of the whole process
+tree, which shows how much of the preloaded model the workers share.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WORKER_DIR)
+
+from bench_embeddings import synthetic_corpus  # noqa: E402
+
+
+def _tree(pid: int):
+    pids, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        pids.append(p)
+        try:
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                stack.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def tree_pss_mb(pid: int) -> float:
+    """Proportional set size of a process and its descendants (Linux; 0 elsewhere)."""
+    total = 0
+    for p in _tree(pid):
+        try:
+            with open(f"/proc/{p}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total / 1024
+
+
+async def wait_ready(url: str, processes: int, timeout: float = 300):
+    """Until /ready has answered 200 several times in a row (requests spread over the processes)."""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    async with httpx.AsyncClient(timeout=5) as client:
+        while time.monotonic() < deadline:
+            try:
+                ok = (await client.get(f"{url}/ready")).status_code == 200
+            except httpx.TransportError:
+                ok = False
+            streak = streak + 1 if ok else 0
+            if streak >= 3 * processes:
+                return
+            await asyncio.sleep(0.2)
+    raise TimeoutError("worker did not become ready")
+
+
+async def drive(url: str, texts, concurrency: int, duration: float) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=0)
+
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        async def client_loop(offset: int):
+            nonlocal errors
+            i = offset
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"{url}/embed", json={"text": texts[i % len(texts)]})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - started)
+                except httpx.HTTPError:
+                    errors += 1
+                i += concurrency
+
+        started = time.monotonic()
+        await asyncio.gather(*(client_loop(k) for k in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "requestsPerSecond": len(latencies) / elapsed,
+        "p50Ms": 1000 * statistics.median(latencies) if latencies else float("nan"),
+        "p95Ms": 1000 * latencies[int(0.95 * (len(latencies) - 1))] if latencies else float("nan"),
+        "errors": errors,
+    }
+
+
+def run(processes: int, port: int, texts, concurrency: int, duration: float) -> dict:
+    env = {
+        **os.environ,
+        "EMBED_CACHE_PATH": "",
+        "LLM_CACHE_PATH": "",
+        "JOB_STATE_DIR": tempfile.mkdtemp(prefix="mirage-bench-jobs-"),
+        "WORKER_LOG_LEVEL": "WARNING",
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port), "--processes", str(processes)],
+        cwd=WORKER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        started = time.monotonic()
+        asyncio.run(wait_ready(url, processes))
+        ready_seconds = time.monotonic() - started
+        result = asyncio.run(drive(url, texts, concurrency, duration))
+        result.update(readySeconds=ready_seconds, pssMb=tree_pss_mb(proc.pid))
+        return result
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", default="1,2,4")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8790)
+    args = parser.parse_args()
+
+    texts = synthetic_corpus(args.texts)
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    print(f"{cpus} CPUs, {args.concurrency} concurrent clients, {args.duration:.0f}s per run")
+    print(f"{'processes':>9s} {'ready s':>8s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'PSS MB':>8s} {'errors':>7s} {'speedup':>8s}")
+    baseline = None
+    for n in (int(x) for x in args.processes.split(",")):
+        r = run(n, args.port, texts, args.concurrency, args.duration)
+        baseline = baseline or r["requestsPerSecond"]
+        print(f"{n:9d} {r['readySeconds']:8.1f} {r['requestsPerSecond']:8.1f} {r['p50Ms']:8.1f} {r['p95Ms']:8.1f} "
+              f"{r['pssMb']:8.0f} {r['errors']:7d} {r['requestsPerSecond'] / baseline:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Check that the ONNX backends reproduce the PyTorch embeddings.
+
+    python benchmarks/check_embedding_parity.py [file.pdf] [--backends onnx,onnx-int8] [--texts 512]
+
+For every text the cosine between a backend's vector and the torch vector
+is computed, along with how many of each text's 10 nearest neighbours the
+backend keeps (what retrieval actually sees). Exits non-zero when the
+minimum cosine falls below the backend's bound (--min-cosine overrides).
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_embeddings import load_corpus  # noqa: E402
+from embedding_backends import load_backend  # noqa: E402
+
+# Minimum per-text cosine to the torch output
+MIN_COSINE = {"onnx": 0.9999, "onnx-int8": 0.98}
+NEIGHBOURS = 10
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+def neighbour_overlap(reference: np.ndarray, candidate: np.ndarray, k: int = NEIGHBOURS) -> float:
+    """Mean fraction of each row's top-k neighbours (by cosine) that both embeddings agree on."""
+    k = min(k, len(reference) - 1)
+    if k < 1:
+        return 1.0
+
+    def top_k(vectors):
+        sims = vectors @ vectors.T
+        np.fill_diagonal(sims, -np.inf)
+        return np.argpartition(-sims, k, axis=1)[:, :k]
+
+    ref, cand = top_k(reference), top_k(candidate)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref, cand)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pdf", nargs="?")
+    parser.add_argument("--backends", default="onnx,onnx-int8")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--min-cosine", type=float)
+    args = parser.parse_args()
+
+    texts = load_corpus(args.pdf, args.texts)
+    reference = _normalize(load_backend("torch").encode(texts))
+    print(f"corpus: {len(texts)} texts")
+
+    failed = False
+    for name in args.backends.split(","):
+        vectors = _normalize(load_backend(name).encode(texts))
+        cosines = np.sum(reference * vectors, axis=1)
+        bound = args.min_cosine if args.min_cosine is not None else MIN_COSINE.get(name, 0.99)
+        ok = cosines.min() >= bound
+        failed |= not ok
+        print(f"{name:12s} cosine min {cosines.min():.5f}  mean {cosines.mean():.5f}  "
+              f"p1 {np.percentile(cosines, 1):.5f}  top-{NEIGHBOURS} overlap {neighbour_overlap(reference, vectors):.3f}  "
+              f"(bound {bound}) {'ok' if ok else 'FAIL'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
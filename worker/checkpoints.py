@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import tempfile
+from typing import Any, Optional
+
+logger = logging.getLogger('worker.checkpoints')
+
+CHECKPOINT_DIR = os.getenv(
+    "CHECKPOINT_DIR", os.path.join(tempfile.gettempdir(), "mirage-checkpoints")
+)
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", str(24 * 3600)))  # seconds
+
+# Stage artifact names, in pipeline order
+SOURCE = "source.pdf"
+PAGES = "pages.json"
+CHUNKS = "chunks.json"
+INSIGHTS = "insights.json"      # raw LLM results keyed by page + paragraph hash
+HIGHLIGHTS = "highlights.json"  # insights with highlights mapped to bboxes
+ANNOTATED = "annotated.pdf"
+META = "meta.json"
+
+
+def safe_name(document_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", document_id)[:128] or "_"
+
+
+def atomic_write(path: str, data: bytes):
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class Checkpoint:
+    """
+    Per-document stage artifacts on local disk.
+    Every write is atomic (temp file + rename), so a crash mid-write never
+    leaves a half-written stage that a retry would trust.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def has(self, name: str) -> bool:
+        return os.path.exists(self.path(name))
+
+    def save_bytes(self, name: str, data: bytes):
+        atomic_write(self.path(name), data)
+        self._touch()
+
+    def load_bytes(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self.path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save_json(self, name: str, value: Any):
+        self.save_bytes(name, json.dumps(value).encode("utf-8"))
+
+    def load_json(self, name: str) -> Optional[Any]:
+        data = self.load_bytes(name)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            logger.warning('discarding corrupt checkpoint %s', self.path(name))
+            return None
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _touch(self):
+        # Directory mtime drives TTL cleanup
+        try:
+            os.utime(self.directory)
+        except OSError:
+            pass
+
+
+class CheckpointStore:
+    def __init__(self, root: str = CHECKPOINT_DIR, ttl: float = CHECKPOINT_TTL):
+        self.root = root
+        self.ttl = ttl
+
+    def open(self, document_id: str, file_url: str) -> Checkpoint:
+        """
+        Return the checkpoint for a document, creating it if needed.
+        A checkpoint recorded for a different fileUrl is discarded.
+        """
+        directory = os.path.join(self.root, safe_name(document_id))
+        checkpoint = Checkpoint(directory)
+        meta = checkpoint.load_json(META) if os.path.isdir(directory) else None
+        if meta and meta.get("fileUrl") != file_url:
+            logger.info('[%s] fileUrl changed, discarding checkpoint', document_id)
+            checkpoint.clear()
+            meta = None
+
+        os.makedirs(directory, exist_ok=True)
+        if not meta:
+            checkpoint.save_json(META, {"documentId": document_id, "fileUrl": file_url})
+        return checkpoint
+
+    def cleanup_expired(self) -> int:
+        """Delete checkpoints untouched for longer than the TTL. Returns count removed."""
+        if not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for name in os.listdir(self.root):
+            directory = os.path.join(self.root, name)
+            try:
+                if os.path.isdir(directory) and os.path.getmtime(directory) < cutoff:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            logger.info('removed %d expired checkpoints', removed)
+        return removed
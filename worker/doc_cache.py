@@ -0,0 +1,136 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Optional
+
+from checkpoints import atomic_write
+
+logger = logging.getLogger('worker.doc_cache')
+
+DOC_CACHE_DIR = os.getenv(
+    "DOC_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mirage-doc-cache")
+)
+DOC_CACHE_MAX_MB = float(os.getenv("DOC_CACHE_MAX_MB", "2048"))
+
+# Bump when the shape of cached pipeline output changes
+CACHE_FORMAT_VERSION = "2"
+
+RESULT = "result.json"
+ANNOTATED = "annotated.pdf"
+
+
+def document_key(pdf_bytes: bytes, *versions: str) -> str:
+    """
+    Content address for a PDF: sha256 of the bytes plus every model/prompt
+    version that influences the output, so upgrading either invalidates.
+    """
+    h = hashlib.sha256()
+    h.update(pdf_bytes)
+    for part in (CACHE_FORMAT_VERSION, *versions):
+        h.update(b"\0")
+        h.update(str(part).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _dir_size(directory: str) -> int:
+    total = 0
+    for name in os.listdir(directory):
+        try:
+            total += os.path.getsize(os.path.join(directory, name))
+        except OSError:
+            pass
+    return total
+
+
+class DocumentCache:
+    """
+    Disk-backed, size-bounded cache of full pipeline outputs keyed by
+    document_key(). Entry recency is the directory mtime, refreshed on every
+    hit; put() evicts least-recently-used entries beyond max_bytes.
+    """
+
+    def __init__(self, root: str = DOC_CACHE_DIR, max_bytes: int = int(DOC_CACHE_MAX_MB * 1024 * 1024)):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached result (plus 'annotatedPath') or None."""
+        directory = self._entry(key)
+        try:
+            with open(os.path.join(directory, RESULT), "rb") as f:
+                result = json.loads(f.read())
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(directory)
+        except OSError:
+            pass
+        self.hits += 1
+        annotated = os.path.join(directory, ANNOTATED)
+        result["annotatedPath"] = annotated if os.path.exists(annotated) else None
+        return result
+
+    def put(self, key: str, result: dict, annotated_path: Optional[str] = None):
+        directory = self._entry(key)
+        os.makedirs(directory, exist_ok=True)
+        if annotated_path and os.path.exists(annotated_path):
+            shutil.copyfile(annotated_path, os.path.join(directory, ANNOTATED))
+        # result.json is written last: its presence marks the entry complete
+        atomic_write(os.path.join(directory, RESULT), json.dumps(result).encode("utf-8"))
+        self.evict()
+
+    def set_annotated_url(self, key: str, url: str):
+        directory = self._entry(key)
+        path = os.path.join(directory, RESULT)
+        try:
+            with open(path, "rb") as f:
+                result = json.loads(f.read())
+        except (OSError, ValueError):
+            return
+        result["annotatedFileUrl"] = url
+        atomic_write(path, json.dumps(result).encode("utf-8"))
+
+    def evict(self):
+        """Drop least-recently-used entries until the cache fits max_bytes."""
+        with self._lock:
+            if not os.path.isdir(self.root):
+                return
+            entries = []
+            total = 0
+            for name in os.listdir(self.root):
+                directory = os.path.join(self.root, name)
+                if not os.path.isdir(directory):
+                    continue
+                try:
+                    size = _dir_size(directory)
+                    entries.append((os.path.getmtime(directory), size, directory))
+                except OSError:
+                    continue
+                total += size
+
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, directory = entries.pop(0)
+                shutil.rmtree(directory, ignore_errors=True)
+                total -= size
+                logger.info('evicted document cache entry %s', os.path.basename(directory))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,130 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import fitz  # PyMuPDF
+
+from checkpoints import atomic_write
+
+# Loaded pages and parsed text pages kept per open document (each an LRU);
+# a text page holds every character box of its page
+TEXTPAGE_CACHE_PAGES = int(os.getenv("TEXTPAGE_CACHE_PAGES", "64"))
+
+
+class DocumentSession:
+    """
+    One open PDF per job, parsed from the downloaded bytes and shared by
+    extraction, highlight mapping and annotation instead of each stage
+    re-opening the file.
+
+    Loaded pages and their text pages are LRU-cached; every access goes through
+    `lock` because a fitz document must not be used from two threads at
+    once. The bytes are only written to disk when something needs a path
+    (the extraction/OCR process pools), and `close()` releases the document
+    deterministically; use the session as a context manager.
+    """
+
+    def __init__(self, data: bytes, spill_path: Optional[str] = None):
+        self.data = data
+        self.spill_path = spill_path
+        self.lock = threading.RLock()
+        self.doc = fitz.open(stream=data, filetype="pdf")
+        self.page_count = len(self.doc)
+        self._pages: "OrderedDict[int, fitz.Page]" = OrderedDict()
+        self._text_pages: "OrderedDict[int, fitz.TextPage]" = OrderedDict()
+        self._path: Optional[str] = None
+        self._owns_spill = False
+        self.text_page_hits = 0
+        self.text_page_misses = 0
+
+    @classmethod
+    def from_path(cls, path: str) -> "DocumentSession":
+        with open(path, "rb") as f:
+            session = cls(f.read())
+        session._path = path
+        return session
+
+    def __enter__(self) -> "DocumentSession":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.doc is None
+
+    def page(self, index: int) -> fitz.Page:
+        """0-based page; the most recently used TEXTPAGE_CACHE_PAGES stay loaded."""
+        with self.lock:
+            if self.doc is None:
+                raise ValueError("document session is closed")
+            page = self._pages.get(index)
+            if page is not None:
+                self._pages.move_to_end(index)
+                return page
+            page = self._pages[index] = self.doc[index]
+            while len(self._pages) > max(TEXTPAGE_CACHE_PAGES, 1):
+                self._pages.popitem(last=False)
+            return page
+
+    def text_page(self, index: int) -> fitz.TextPage:
+        """
+        The page's parsed text, shared by every get_text() call on it
+        (blocks and words use the same extraction flags).
+        """
+        with self.lock:
+            text_page = self._text_pages.get(index)
+            if text_page is not None:
+                self.text_page_hits += 1
+                self._text_pages.move_to_end(index)
+                return text_page
+            self.text_page_misses += 1
+            text_page = self.page(index).get_textpage(flags=fitz.TEXTFLAGS_WORDS)
+            self._text_pages[index] = text_page
+            while len(self._text_pages) > max(TEXTPAGE_CACHE_PAGES, 1):
+                self._text_pages.popitem(last=False)
+            return text_page
+
+    def path(self) -> str:
+        """
+        A file holding the document, for code that runs in another process.
+        Spilled to `spill_path` (or a temp file) on first use only.
+        """
+        with self.lock:
+            if self._path is None and self.spill_path is not None:
+                if not os.path.exists(self.spill_path):
+                    atomic_write(self.spill_path, self.data)
+                self._path = self.spill_path
+            elif self._path is None:
+                fd, path = tempfile.mkstemp(prefix="mirage-", suffix=".pdf")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(self.data)
+                self._path = path
+                self._owns_spill = True
+            return self._path
+
+    def close(self):
+        with self.lock:
+            if self.doc is None:
+                return
+            self._text_pages.clear()
+            self._pages.clear()
+            self.doc.close()
+            self.doc = None
+            if self._owns_spill:
+                try:
+                    os.remove(self._path)
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        return {
+            "pageCount": self.page_count,
+            "spilled": self._path is not None,
+            "textPageHits": self.text_page_hits,
+            "textPageMisses": self.text_page_misses,
+        }
+
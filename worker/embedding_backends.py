@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import inspect
+import logging
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger('worker.embedding_backends')
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# "torch" (sentence-transformers, fp32), "onnx" (ONNX Runtime, fp32) or
+# "onnx-int8" (ONNX Runtime, dynamically quantized weights)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+# Exported ONNX graphs + tokenizer; created on first use if missing (needs torch)
+ONNX_MODEL_DIR = os.getenv(
+    "ONNX_MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "onnx", MODEL_NAME),
+)
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # intra-op threads; 0 = ONNX Runtime default
+ENCODE_BATCH_SIZE = 32
+
+_FP32_FILE = "model.onnx"
+_INT8_FILE = "model-int8.onnx"
+_META_FILE = "mirage-embedding.json"
+
+
+def model_id(backend: str, model_name: str = MODEL_NAME) -> str:
+    """Identifies the vectors a backend produces (embedding cache / document cache keys)."""
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+class EmbeddingBackend(ABC):
+    """
+    Sentence encoder behind embeddings.py. Backends share the interface the
+    rest of the worker uses: `encode(texts)` returns one float32 row per
+    text (pooled and normalized exactly like the sentence-transformers
+    model), `tokenizer` is the model's own HF tokenizer and
+    `max_seq_length` its input limit in wordpieces.
+    """
+
+    name = ""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.tokenizer = None
+        self.max_seq_length = 0
+        self.load_seconds = 0.0
+        self.texts_encoded = 0
+        self.encode_seconds = 0.0
+
+    @property
+    def model_id(self) -> str:
+        return model_id(self.name, self.model_name)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        started = time.perf_counter()
+        vectors = self._encode(texts)
+        self.encode_seconds += time.perf_counter() - started
+        self.texts_encoded += len(texts)
+        return vectors
+
+    @abstractmethod
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        ...
+
+    @abstractmethod
+    def set_threads(self, threads: int):
+        """Intra-op threads used by encode() in this process."""
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "model": self.model_name,
+            "maxSeqLength": self.max_seq_length,
+            "loadSeconds": round(self.load_seconds, 2),
+            "textsEncoded": self.texts_encoded,
+            "textsPerSecond": round(self.texts_encoded / self.encode_seconds, 1) if self.encode_seconds else None,
+        }
+
+
+class TorchBackend(EmbeddingBackend):
+    """The sentence-transformers model in fp32 PyTorch (the reference output)."""
+
+    name = "torch"
+
+    def __init__(self, model_name: str = MODEL_NAME, threads: int = 0):
+        super().__init__(model_name)
+        from sentence_transformers import SentenceTransformer
+
+        if threads > 0:
+            self.set_threads(threads)
+        started = time.perf_counter()
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.load_seconds = time.perf_counter() - started
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True,
+                                 show_progress_bar=False)
+
+    def set_threads(self, threads: int):
+        import torch
+
+        torch.set_num_threads(threads)
+
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    The same transformer exported to ONNX and run by ONNX Runtime on CPU,
+    with sentence-transformers' pooling and normalization done in NumPy.
+    quantized=True loads the int8 graph (dynamic quantization: int8
+    weights, activations quantized per batch at run time).
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, quantized: bool = False,
+                 model_dir: str = ONNX_MODEL_DIR, threads: int = ONNX_THREADS):
+        super().__init__(model_name)
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.name = "onnx-int8" if quantized else "onnx"
+        started = time.perf_counter()
+        path = os.path.join(model_dir, _INT8_FILE if quantized else _FP32_FILE)
+        if not os.path.exists(path) or not os.path.exists(os.path.join(model_dir, _META_FILE)):
+            logger.info('no exported ONNX model in %s, exporting %s', model_dir, model_name)
+            export_onnx(model_name, model_dir)
+        with open(os.path.join(model_dir, _META_FILE)) as f:
+            meta = json.load(f)
+        if meta["model"] != model_name:
+            raise ValueError(f"{model_dir} holds an export of {meta['model']}, not {model_name}")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = meta["max_seq_length"]
+        self.pooling = meta["pooling"]
+        self.normalize = meta["normalize"]
+        self.load_seconds = time.perf_counter() - started
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        # Like sentence-transformers: batch by length so padding stays small
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        out = [None] * len(texts)
+        for start in range(0, len(order), ENCODE_BATCH_SIZE):
+            idx = order[start:start + ENCODE_BATCH_SIZE]
+            encoded = self.tokenizer(
+                [texts[i] for i in idx], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np",
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            pooled = _pool(hidden, encoded["attention_mask"], self.pooling)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, row in zip(idx, pooled):
+                out[i] = row
+        return np.stack(out).astype(np.float32, copy=False)
+
+    def set_threads(self, threads: int):
+        # ONNX Runtime sizes its thread pool when the session is created
+        if threads != self.threads:
+            logger.warning('ONNX Runtime threads are fixed at load (%d); load with threads=%d instead',
+                           self.threads, threads)
+
+
+def _pool(hidden: np.ndarray, attention_mask: np.ndarray, mode: str) -> np.ndarray:
+    if mode == "cls":
+        return hidden[:, 0].copy()
+    mask = attention_mask[..., None].astype(np.float32)
+    return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+def export_onnx(model_name: str = MODEL_NAME, model_dir: str = ONNX_MODEL_DIR, quantize: bool = True):
+    """
+    Export the sentence-transformers model's transformer to ONNX (fp32, plus
+    an int8 dynamically quantized copy) with its tokenizer and pooling
+    settings, so OnnxBackend can run without PyTorch.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    st = SentenceTransformer(model_name, device="cpu")
+    pooling = next(m for m in st if isinstance(m, Pooling)).get_config_dict()
+    pooling_mode = pooling.get("pooling_mode")  # newer releases; older ones have one flag per mode
+    if pooling_mode is None:
+        pooling_mode = "mean" if pooling.get("pooling_mode_mean_tokens") else \
+            "cls" if pooling.get("pooling_mode_cls_token") else None
+    if pooling_mode not in ("mean", "cls"):
+        raise ValueError(f"{model_name}: only mean or CLS pooling can be exported")
+
+    transformer = st[0]
+    tokenizer = transformer.tokenizer
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            return self.model(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids,
+            ).last_hidden_state
+
+    sample = tokenizer(["an example sentence", "another, somewhat longer example sentence"],
+                       padding=True, return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    axes = {n: {0: "batch", 1: "sequence"} for n in input_names + ["last_hidden_state"]}
+
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, _FP32_FILE)
+    tmp = fp32_path + ".tmp"
+    # The TorchScript exporter; newer torch defaults to the dynamo one, which needs onnxscript
+    legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHiddenState(transformer.auto_model.eval()),
+            tuple(sample[n] for n in input_names),
+            tmp,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=axes,
+            opset_version=14,
+            **legacy,
+        )
+    os.replace(tmp, fp32_path)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(model_dir, _INT8_FILE)
+        quantize_dynamic(fp32_path, int8_path + ".tmp", weight_type=QuantType.QInt8)
+        os.replace(int8_path + ".tmp", int8_path)
+
+    tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, _META_FILE), "w") as f:
+        json.dump({
+            "model": model_name,
+            "max_seq_length": st.max_seq_length,
+            "pooling": pooling_mode,
+            "normalize": any(isinstance(m, Normalize) for m in st),
+            "dimension": st.get_sentence_embedding_dimension(),
+        }, f, indent=2)
+    logger.info('exported %s to %s', model_name, model_dir)
+
+
+def load_backend(name: str = EMBEDDING_BACKEND, model_name: str = MODEL_NAME,
+                 model_dir: Optional[str] = None, threads: int = 0) -> EmbeddingBackend:
+    """`threads` > 0 sets the intra-op thread count (otherwise the library / ONNX_THREADS default)."""
+    if name == "torch":
+        return TorchBackend(model_name, threads=threads)
+    if name in ("onnx", "onnx-int8"):
+        return OnnxBackend(model_name, quantized=(name == "onnx-int8"), model_dir=model_dir or ONNX_MODEL_DIR,
+                           threads=threads or ONNX_THREADS)
+    raise ValueError(f"unknown EMBEDDING_BACKEND {name!r} (expected one of {', '.join(EMBEDDING_BACKENDS)})")
+
+
+if __name__ == "__main__":
+    # python embedding_backends.py [model_dir]  -- export the ONNX graphs ahead of time (e.g. at image build)
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    export_onnx(MODEL_NAME, sys.argv[1] if len(sys.argv) > 1 else ONNX_MODEL_DIR)
@@ -0,0 +1,53 @@
+import os
+import time
+import hashlib
+import tempfile
+from typing import Iterable, Tuple
+
+import numpy as np
+
+from sqlite_cache import SQLiteCache
+
+EMBED_CACHE_PATH = os.getenv(
+    "EMBED_CACHE_PATH", os.path.join(tempfile.gettempdir(), "mirage-embeddings.sqlite3")
+)
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "500000"))
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha1(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(SQLiteCache):
+    """Persistent float32 vector cache, keyed by cache_key()."""
+
+    TABLE = "embeddings"
+    VALUE_COLUMN = "vec"
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS embeddings ("
+        " key TEXT PRIMARY KEY, vec BLOB NOT NULL, last_used REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)",
+    )
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        super().__init__(path, max_entries)
+
+    def _decode(self, blob: bytes) -> np.ndarray:
+        return np.frombuffer(blob, dtype=np.float32)
+
+    def put_many(self, items: Iterable[Tuple[str, np.ndarray]]):
+        now = time.time()
+        rows = [(key, np.asarray(vec, dtype=np.float32).tobytes(), now) for key, vec in items]
+        if not rows:
+            return
+        with self._write() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vec, last_used) VALUES (?, ?, ?)", rows
+            )
+            added = conn.total_changes - before
+        self._added(added)
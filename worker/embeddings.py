@@ -1,16 +1,112 @@
-from typing import List
-from sentence_transformers import SentenceTransformer
+import os
+import logging
+import threading
+from functools import lru_cache
+from typing import List, Optional
 
-# Load model once at module level (downloaded on first run, cached after)
-print("Loading embedding model (all-MiniLM-L6-v2)...")
-model = SentenceTransformer("all-MiniLM-L6-v2")
-print("✅ Embedding model loaded")
+from embedding_backends import EMBEDDING_BACKEND, MODEL_NAME, EmbeddingBackend, load_backend, model_id
+from embedding_cache import EmbeddingCache, EMBED_CACHE_PATH, cache_key
+
+logger = logging.getLogger('worker.embeddings')
+
+# Vectors from different backends are close but not identical, so caches keep them apart
+MODEL_ID = model_id(EMBEDDING_BACKEND, MODEL_NAME)
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "65536"))
+
+embedding_cache = EmbeddingCache() if EMBED_CACHE_PATH else None
+
+# The model is loaded on first use, not at import, so the server can bind
+# first and load it in the background (main.py) or before forking workers
+_backend: Optional[EmbeddingBackend] = None
+_backend_lock = threading.Lock()
+_threads = 0  # intra-op threads; 0 = library default (set per process by serve.py)
+
+WARM_UP_TEXTS = [
+    "warm-up",
+    " ".join(["The encoder runs once at full input length before real traffic arrives."] * 24),
+]
+
+
+def get_backend() -> EmbeddingBackend:
+    """The configured backend, loading it (once, thread-safe) if needed."""
+    global _backend
+    if _backend is not None:
+        return _backend
+    with _backend_lock:
+        if _backend is None:
+            logger.info('loading embedding model (%s, %s backend)', MODEL_NAME, EMBEDDING_BACKEND)
+            _backend = load_backend(EMBEDDING_BACKEND, MODEL_NAME, threads=_threads)
+    return _backend
+
+
+def preloadable() -> bool:
+    """
+    Whether the model can be loaded before forking worker processes. Torch
+    weights are then shared copy-on-write; an ONNX Runtime session owns
+    thread pools that don't survive fork, so each process loads its own.
+    """
+    return EMBEDDING_BACKEND == "torch"
+
+
+def set_threads(threads: int):
+    """Intra-op thread count for this process's encoder, before or after loading."""
+    global _threads
+    _threads = threads
+    if _backend is not None:
+        _backend.set_threads(threads)
+
+
+def warm_up():
+    """
+    One short and one full-length encode, bypassing the cache, so the first
+    request doesn't pay for lazy kernel selection and buffer allocation.
+    """
+    get_backend().encode(WARM_UP_TEXTS)
+
+
+def max_input_tokens() -> int:
+    """Wordpieces the encoder sees per text ([CLS]/[SEP] excluded); anything longer is truncated."""
+    return get_backend().max_seq_length - 2
+
+
+def backend_stats() -> Optional[dict]:
+    return _backend.stats() if _backend is not None else None
 
 
 def embed_texts(texts: List[str]) -> List[List[float]]:
-    """Embed a list of texts using local sentence-transformers model."""
-    embeddings = model.encode(texts, convert_to_numpy=True)
-    return embeddings.tolist()
+    """
+    Embed a list of texts with the configured local backend.
+    Previously seen texts are served from the persistent embedding cache;
+    only misses (deduplicated) are sent to the encoder.
+    """
+    if not texts:
+        return []
+    if embedding_cache is None:
+        return get_backend().encode(texts).tolist()
+
+    keys = [cache_key(MODEL_ID, t) for t in texts]
+    vectors = embedding_cache.get_many(list(dict.fromkeys(keys)))
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in vectors and key not in missing:
+            missing[key] = text
+    if missing:
+        encoded = get_backend().encode(list(missing.values()))
+        fresh = list(zip(missing.keys(), encoded))
+        embedding_cache.put_many(fresh)
+        vectors.update(fresh)
+
+    return [vectors[key].tolist() for key in keys]
+
+
+@lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)
+def count_tokens(text: str) -> int:
+    """
+    Length of `text` in the model's own wordpieces (no special tokens).
+    Memoized, since chunking and paragraph selection count the same sentences.
+    """
+    return len(get_backend().tokenizer.tokenize(text))
 
 
 def embed_single(text: str) -> List[float]:
@@ -1,4 +1,7 @@
+import os
 import re
+import bisect
+from difflib import SequenceMatcher
 from typing import List, Dict, Optional, Tuple
 
 try:
@@ -116,10 +119,152 @@ def _search_phrase_on_page(phrase: str, page) -> List[Dict]:
     return []
 
 
-def map_highlights_to_bboxes(highlights: List[str], page_blocks: List[Dict], page=None) -> List[Dict]:
+# ── In-memory page text index ────────────────────────────────────────────────
+
+HIGHLIGHT_FUZZY = os.getenv("HIGHLIGHT_FUZZY", "0") == "1"
+HIGHLIGHT_FUZZY_MIN_RATIO = float(os.getenv("HIGHLIGHT_FUZZY_MIN_RATIO", "0.85"))
+
+
+class PageTextIndex:
+    """
+    Searchable text of one page, built once from the word boxes recorded at
+    extraction ([x0, y0, x1, y1, text, block_no, line_no]).
+
+    Words are joined into one lowercase string with single spaces (words
+    hyphenated across a line break are joined, like TEXT_DEHYPHENATE), and
+    each character offset maps back to its word, so a phrase lookup is a
+    str.find plus a bisect instead of a fresh page.search_for() parse.
+    Hits come back as one rect per text line, like search_for.
+    """
+
+    def __init__(self, words: List[list]):
+        self.words = words
+        parts, starts, owners = [], [], []
+        offset = 0
+        i = 0
+        while i < len(words):
+            text = words[i][4]
+            members = [i]
+            # Dehyphenate: "exam-" at the end of a line followed by "ple" on the next
+            while (text.endswith("-") and members[-1] + 1 < len(words)
+                   and self._line(members[-1]) != self._line(members[-1] + 1)):
+                members.append(members[-1] + 1)
+                text = text[:-1] + words[members[-1]][4]
+            starts.append(offset)
+            owners.append(members)
+            parts.append(text.lower())
+            offset += len(text) + 1
+            i = members[-1] + 1
+        self.text = " ".join(parts)
+        self._starts = starts
+        self._owners = owners
+        self._tokens = parts
+
+    def _line(self, i: int) -> Tuple[int, int]:
+        return self.words[i][5], self.words[i][6]
+
+    def _token_at(self, offset: int) -> int:
+        return bisect.bisect_right(self._starts, offset) - 1
+
+    def _rects(self, start: int, end: int) -> List[Tuple[float, float, float, float]]:
+        """Line rects covering text[start:end], trimmed inside the first and last word."""
+        first, last = self._token_at(start), self._token_at(end - 1)
+        lines: Dict[Tuple[int, int], List[float]] = {}
+        for t in range(first, last + 1):
+            members = self._owners[t]
+            token_len = max(1, len(self._tokens[t]))
+            lo = (start - self._starts[t]) / token_len if t == first else 0.0
+            hi = (end - self._starts[t]) / token_len if t == last else 1.0
+            for n, w in enumerate(members):
+                x0, y0, x1, y1 = self.words[w][:4]
+                if len(members) == 1:
+                    # Proportional trim for matches that start/end mid-word
+                    x0, x1 = x0 + (x1 - x0) * max(0.0, lo), x0 + (x1 - x0) * min(1.0, hi)
+                key = self._line(w)
+                if key in lines:
+                    box = lines[key]
+                    box[0], box[1] = min(box[0], x0), min(box[1], y0)
+                    box[2], box[3] = max(box[2], x1), max(box[3], y1)
+                else:
+                    lines[key] = [x0, y0, x1, y1]
+        return [tuple(box) for box in lines.values()]
+
+    def find(self, phrase: str) -> List[Tuple[float, float, float, float]]:
+        """Rects of every case-insensitive occurrence of `phrase`."""
+        needle = normalize_whitespace(phrase).lower()
+        if not needle:
+            return []
+        rects = []
+        pos = self.text.find(needle)
+        while pos != -1:
+            rects.extend(self._rects(pos, pos + len(needle)))
+            pos = self.text.find(needle, pos + 1)
+        return rects
+
+    def find_fuzzy(self, phrase: str, min_ratio: float = HIGHLIGHT_FUZZY_MIN_RATIO) -> List[Tuple[float, float, float, float]]:
+        """
+        Rects of the best window of page words resembling `phrase` (e.g. the
+        LLM changed punctuation or a word), if its similarity is >= min_ratio.
+        """
+        needle = normalize_whitespace(phrase).lower()
+        size = len(needle.split())
+        if not size or not self._tokens:
+            return []
+        best, best_ratio = None, min_ratio
+        matcher = SequenceMatcher(autojunk=False)
+        matcher.set_seq2(needle)
+        for first in range(max(1, len(self._tokens) - size + 1)):
+            last = min(len(self._tokens), first + size) - 1
+            start = self._starts[first]
+            end = self._starts[last] + len(self._tokens[last])
+            matcher.set_seq1(self.text[start:end])
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = (start, end), ratio
+        return self._rects(*best) if best else []
+
+
+def _hits(text: str, rects) -> List[Dict]:
+    return [
+        {"text": text, "bbox": {"x0": r[0], "y0": r[1], "x1": r[2], "y1": r[3]}}
+        for r in rects
+    ]
+
+
+def _search_phrase_in_index(phrase: str, index: PageTextIndex) -> List[Dict]:
+    """Same lookup order as _search_phrase_on_page, answered from the in-memory index."""
+    normalized = normalize_whitespace(phrase)
+    candidates = [normalized]
+    if len(normalized) > 140:
+        candidates.append(normalized[:140])
+
+    for candidate in candidates:
+        rects = index.find(candidate)
+        if rects:
+            return _hits(phrase, rects)
+
+    if HIGHLIGHT_FUZZY:
+        rects = index.find_fuzzy(normalized)
+        if rects:
+            return _hits(phrase, rects)
+
+    # Keyword fallback: still precise, but narrower than paragraph-level boxes.
+    for keyword in _keyword_fallback(normalized):
+        rects = index.find(keyword)
+        if rects:
+            return _hits(keyword, rects[:2])
+
+    return []
+
+
+def map_highlights_to_bboxes(highlights: List[str], page_blocks: List[Dict], page=None,
+                             page_index: Optional[PageTextIndex] = None) -> List[Dict]:
     """
     For each highlight phrase, find its bounding box in the page blocks.
-    Returns list of {text, bbox} dicts.
+    With a PageTextIndex the lookups run in memory; a fitz page falls back
+    to page.search_for(). Returns list of {text, bbox} dicts.
     """
     results = []
     for phrase in highlights:
@@ -127,7 +272,13 @@ def map_highlights_to_bboxes(highlights: List[str], page_blocks: List[Dict], pag
         if not phrase:
             continue
 
-        # Preferred path: exact in-page text search for sentence/keyword precision.
+        if page_index is not None:
+            precise_hits = _search_phrase_in_index(phrase, page_index)
+            if precise_hits:
+                results.extend(precise_hits)
+            continue
+
+        # Exact in-page text search for sentence/keyword precision.
         if page is not None:
             precise_hits = _search_phrase_on_page(phrase, page)
             if precise_hits:
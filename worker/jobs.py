@@ -0,0 +1,503 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import asyncio
+import logging
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from checkpoints import atomic_write, safe_name
+from startup import process_start_ticks
+from wire_format import dumps
+
+logger = logging.getLogger('worker.jobs')
+
+# Shared directory for job records in multi-process mode (see serve.py); empty = in-memory only
+JOB_STATE_DIR = os.getenv("JOB_STATE_DIR", "")
+
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+DONE = "DONE"
+ERROR = "ERROR"
+
+
+# Error of jobs whose process died (or the worker restarted) before they finished
+ORPHANED = "worker process exited before the job finished"
+
+
+class QueueFullError(Exception):
+    """Raised when the scheduler cannot accept another job (backpressure)."""
+
+
+@dataclass
+class Job:
+    id: str
+    key: str
+    payload: Any
+    status: str = QUEUED
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    subscribers: List[asyncio.Queue] = field(default_factory=list, repr=False)
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Receive the events the runner emits from now on, ending with None.
+        Only complete for jobs that have not started yet.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+
+    def publish(self, event: Optional[dict]):
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def to_status(self) -> dict:
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "error": self.error,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+        }
+
+
+def _read_boot_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+BOOT_ID = _read_boot_id()
+
+
+def _owner() -> dict:
+    """This process, as recorded on the jobs it runs."""
+    return {"pid": os.getpid(), "bootId": BOOT_ID, "started": process_start_ticks()}
+
+
+def _owner_alive(owner: Optional[dict]) -> bool:
+    if not owner or owner.get("bootId") != BOOT_ID:
+        return False  # written before the host rebooted
+    started = process_start_ticks(owner["pid"])
+    if started is not None or owner.get("started") is not None:
+        # A recycled pid has another start time
+        return started == owner.get("started")
+    try:  # no /proc
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """
+    Job records in a directory every worker process can read, so a poll for
+    a job that another process accepted (multi-process mode) still finds
+    it. Each job has a small status file, rewritten on every transition,
+    and a separate result file written once, so status polls never read
+    the result. Payloads are pydantic models (`payload_type`).
+
+    A job's key is claimed by a file under claims/ while the job is queued
+    or running, so processes sharing the directory never run two pipelines
+    for the same document (they share its checkpoint directory).
+
+    The annotated-PDF upload state of each document (uploads.py) is kept
+    under uploads/ too, since the upload outlives the job.
+
+    Records carry the pid, start time and boot id of the process running
+    the job. A queued or running job whose process is gone (it crashed, or
+    the worker restarted) can never finish, so it is reported and saved as
+    an ERROR when loaded or pruned; call prune() at startup to fail the
+    ones a previous run left behind.
+    """
+
+    def __init__(self, directory: str, payload_type, prune_interval: float = 60.0):
+        self.directory = directory
+        self.payload_type = payload_type
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        self._claims = os.path.join(directory, "claims")
+        self._uploads = os.path.join(directory, "uploads")
+        os.makedirs(self._claims, exist_ok=True)
+        os.makedirs(self._uploads, exist_ok=True)
+
+    def _path(self, job_id: str, suffix: str = "") -> str:
+        return os.path.join(self.directory, f"{job_id}{suffix}.json")
+
+    # ── Claims ────────────────────────────────────────────────────────────
+
+    @contextmanager
+    def _claims_lock(self):
+        # Held to remove a claim, so a stale claim is never removed after
+        # another process has replaced it; creating one needs no lock
+        with open(os.path.join(self.directory, ".claims.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _claim_path(self, key: str) -> str:
+        return os.path.join(self._claims, safe_name(key))
+
+    def _claim_holder(self, key: str) -> Optional[str]:
+        try:
+            with open(self._claim_path(key)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _claim(self, key: str, job_id: str, attempts: int = 5) -> Optional["Job"]:
+        path = self._claim_path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self._claims, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(job_id)
+            for _ in range(attempts):
+                try:
+                    # Exclusive create (like O_EXCL) of a file that already holds the id
+                    os.link(tmp_path, path)
+                    return None
+                except FileExistsError:
+                    pass
+                with self._claims_lock():
+                    holder_id = self._claim_holder(key)
+                    holder = self.load(holder_id) if holder_id else None
+                    if holder is not None and not holder.finished_at:
+                        return holder
+                    # Finished, pruned or orphaned: free the key and retry
+                    if holder_id is not None and self._claim_holder(key) == holder_id:
+                        os.remove(path)
+        finally:
+            os.remove(tmp_path)
+        raise OSError(f"could not claim job key {key}")
+
+    def create(self, job: "Job") -> Optional["Job"]:
+        """
+        Save a new job and claim its key. If a queued or running job of any
+        process already holds the key, ours is dropped and that job returned.
+        """
+        self.save(job)
+        try:
+            holder = self._claim(job.key, job.id)
+        except Exception:
+            self._remove(job.id)
+            raise
+        if holder is not None:
+            self._remove(job.id)
+        return holder
+
+    def release(self, job: "Job"):
+        """Free the job's key once it finished (saved)."""
+        with self._claims_lock():
+            if self._claim_holder(job.key) == job.id:
+                os.remove(self._claim_path(job.key))
+
+    # ── Uploads ───────────────────────────────────────────────────────────
+
+    def _upload_path(self, document_id: str) -> str:
+        return os.path.join(self._uploads, f"{safe_name(document_id)}.json")
+
+    def save_upload(self, document_id: str, status: dict):
+        """Record a document's upload state, unless a newer upload already did."""
+        current = self.load_upload(document_id)
+        if current is not None and current["createdAt"] > status["createdAt"]:
+            return
+        atomic_write(self._upload_path(document_id), dumps(status))
+
+    def load_upload(self, document_id: str) -> Optional[dict]:
+        try:
+            with open(self._upload_path(document_id), "rb") as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    # ── Records ───────────────────────────────────────────────────────────
+
+    def _remove(self, job_id: str):
+        for suffix in ("", ".result"):
+            try:
+                os.remove(self._path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def save(self, job: "Job"):
+        if job.result is not None:
+            atomic_write(self._path(job.id, ".result"), dumps(job.result))
+        record = {**job.to_status(), "key": job.key, "payload": job.payload.model_dump(), "owner": _owner()}
+        atomic_write(self._path(job.id), dumps(record))
+
+    def _fail_if_orphaned(self, job_id: str, record: dict) -> dict:
+        if record["status"] in (QUEUED, RUNNING) and not _owner_alive(record.get("owner")):
+            logger.warning('[%s] job %s was left %s by a process that exited; marking it failed',
+                           record["key"], job_id, record["status"])
+            record = {**record, "status": ERROR, "error": ORPHANED, "finishedAt": time.time()}
+            atomic_write(self._path(job_id), dumps(record))
+        return record
+
+    def load(self, job_id: str, with_result: bool = False) -> Optional["Job"]:
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id), "rb") as f:
+                record = self._fail_if_orphaned(job_id, json.loads(f.read()))
+            result = None
+            if with_result and record["status"] == DONE:
+                with open(self._path(job_id, ".result"), "rb") as f:
+                    result = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        job = Job(
+            id=job_id,
+            key=record["key"],
+            payload=self.payload_type.model_validate(record["payload"]),
+            status=record["status"],
+            result=result,
+            error=record["error"],
+            created_at=record["createdAt"],
+            started_at=record["startedAt"],
+            finished_at=record["finishedAt"],
+        )
+        if job.finished_at:
+            job.done.set()
+        return job
+
+    def prune_due(self) -> bool:
+        """True at most once per prune_interval."""
+        now = time.time()
+        if now - self._last_prune < self.prune_interval:
+            return False
+        self._last_prune = now
+        return True
+
+    def prune(self, ttl: float):
+        """Drop records of jobs finished more than `ttl` seconds ago; fail orphaned ones."""
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name.endswith(".result.json"):
+                continue
+            job_id = name[:-len(".json")]
+            try:
+                with open(self._path(job_id), "rb") as f:
+                    record = self._fail_if_orphaned(job_id, json.loads(f.read()))
+                finished_at = record.get("finishedAt")
+                if finished_at and now - finished_at > ttl:
+                    self._remove(job_id)
+            except (OSError, ValueError, KeyError):
+                pass
+        for name in os.listdir(self._uploads):
+            path = os.path.join(self._uploads, name)
+            try:
+                with open(path, "rb") as f:
+                    finished_at = json.loads(f.read()).get("finishedAt")
+                if finished_at and now - finished_at > ttl:
+                    os.remove(path)
+            except (OSError, ValueError):
+                pass
+
+
+class JobScheduler:
+    """
+    Bounded in-process job scheduler.
+
+    At most `max_concurrent` pipelines run at once and at most `max_queued`
+    jobs wait behind them; submit() raises QueueFullError beyond that so the
+    HTTP layer can answer 429 instead of piling work onto the thread pool.
+    Finished jobs are kept for `result_ttl` seconds so callers can poll them.
+    The runner gets the payload and an emit callback that publishes progress
+    events to the job's subscribers. With a JobStore, job records are also
+    written to disk, get() falls back to it for jobs of other processes, and
+    deduplication by key spans every process sharing the store.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Any, Callable[[dict], None]], Awaitable[dict]],
+        max_concurrent: int,
+        max_queued: int,
+        result_ttl: float,
+        store: Optional[JobStore] = None,
+    ):
+        self._runner = runner
+        self._store = store
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max(0, max_queued)
+        self.result_ttl = result_ttl
+        self._queue: "asyncio.Queue[Job]" = asyncio.Queue()
+        self._jobs: Dict[str, Job] = {}
+        self._active_by_key: Dict[str, str] = {}
+        self._workers = []
+
+    # ── Lifecycle ─────────────────────────────────────────────────────────
+
+    def start(self):
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker_loop(i))
+            for i in range(self.max_concurrent)
+        ]
+        logger.info('job scheduler started (concurrency=%d, queue=%d)',
+                    self.max_concurrent, self.max_queued)
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    async def submit(self, key: str, payload: Any) -> Job:
+        """
+        Enqueue a job. Jobs sharing `key` (the documentId) are deduplicated
+        while one is still queued or running, so client retries attach to the
+        existing job instead of starting a second pipeline. With a store the
+        existing job may belong to another process (see owns() and wait()).
+        """
+        await self._prune()
+
+        active_id = self._active_by_key.get(key)
+        if active_id and active_id in self._jobs:
+            return self._jobs[active_id]
+
+        if self._queue.qsize() >= self.max_queued + self._idle_workers():
+            raise QueueFullError(
+                f"job queue is full ({self._queue.qsize()} queued, "
+                f"{self.running_count()} running)"
+            )
+
+        job = Job(id=uuid.uuid4().hex, key=key, payload=payload)
+        if self._store is not None:
+            try:
+                holder = await asyncio.to_thread(self._store.create, job)
+            except Exception as e:
+                logger.warning('[%s] could not store job %s: %s', key, job.id, e)
+            else:
+                if holder is not None:
+                    logger.info('[%s] attached to job %s of another process', key, holder.id)
+                    return self._jobs.get(holder.id, holder)
+        self._jobs[job.id] = job
+        self._active_by_key[key] = job.id
+        self._queue.put_nowait(job)
+        logger.info('[%s] job %s queued (depth=%d)', key, job.id, self._queue.qsize())
+        return job
+
+    async def get(self, job_id: str, with_result: bool = False) -> Optional[Job]:
+        """
+        A job by id; jobs accepted by another process are read from the
+        store (their result only when `with_result`).
+        """
+        await self._prune()
+        job = self._jobs.get(job_id)
+        if job is None and self._store is not None:
+            job = await asyncio.to_thread(self._store.load, job_id, with_result)
+        return job
+
+    def owns(self, job: Job) -> bool:
+        """Whether this process runs `job` (its events and done flag are live)."""
+        return self._jobs.get(job.id) is job
+
+    async def wait(self, job: Job, poll_interval: float = 1.0) -> Job:
+        """
+        `job` once finished, with its result. Jobs of another process are
+        polled from the store every `poll_interval` seconds.
+        """
+        while not self.owns(job) and not job.finished_at:
+            await asyncio.sleep(poll_interval)
+            latest = await self.get(job.id, with_result=True)
+            if latest is None:  # pruned
+                job.status, job.error, job.finished_at = ERROR, "job record was lost", time.time()
+                job.done.set()
+            else:
+                job = latest
+        await job.done.wait()
+        return job
+
+    def running_count(self) -> int:
+        return sum(1 for j in self._jobs.values() if j.status == RUNNING)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "running": self.running_count(),
+            "maxConcurrent": self.max_concurrent,
+            "maxQueued": self.max_queued,
+        }
+
+    # ── Internals ─────────────────────────────────────────────────────────
+
+    def _idle_workers(self) -> int:
+        return max(0, self.max_concurrent - self.running_count())
+
+    async def _prune(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at and now - job.finished_at > self.result_ttl
+        ]
+        for job_id in expired:
+            self._jobs.pop(job_id, None)
+        if self._store is not None and self._store.prune_due():
+            await asyncio.to_thread(self._store.prune, self.result_ttl)
+
+    async def _save(self, job: Job):
+        if self._store is None:
+            return
+        try:
+            await asyncio.to_thread(self._store.save, job)
+        except Exception as e:
+            logger.warning('[%s] could not store job %s: %s', job.key, job.id, e)
+
+    async def _release(self, job: Job):
+        if self._store is None:
+            return
+        try:
+            await asyncio.to_thread(self._store.release, job)
+        except Exception as e:
+            logger.warning('[%s] could not release job %s: %s', job.key, job.id, e)
+
+    async def _worker_loop(self, index: int):
+        while True:
+            job = await self._queue.get()
+            job.status = RUNNING
+            job.started_at = time.time()
+            await self._save(job)
+            try:
+                job.result = await self._runner(job.payload, job.publish)
+                job.status = DONE
+            except asyncio.CancelledError:
+                job.status = ERROR
+                job.error = "cancelled"
+                raise
+            except Exception as e:
+                logger.exception('[%s] job %s failed: %s', job.key, job.id, e)
+                job.status = ERROR
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                if self._active_by_key.get(job.key) == job.id:
+                    self._active_by_key.pop(job.key, None)
+                await self._save(job)
+                await self._release(job)
+                job.publish(None)
+                job.done.set()
+                self._queue.task_done()
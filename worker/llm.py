@@ -1,14 +1,31 @@
 import os
 import json
-import requests
-from typing import Optional
+import logging
+import asyncio
+from typing import Dict, List, Optional
+
+from llm_cache import LLMCache, LLM_CACHE_PATH, cache_key
+from llm_client import AdaptiveLimiter, PooledClient
 
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 MODEL = "arcee-ai/trinity-large-preview:free"
+FALLBACK_INSIGHT = "Could not generate insight."
+PROMPT_VERSION = "2"  # bump whenever the insight prompt or output schema changes
+
+# Paragraphs packed into one request, bounded by an approximate token budget
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "6"))
+LLM_BATCH_MAX_TOKENS = int(os.getenv("LLM_BATCH_MAX_TOKENS", "3000"))
+
+logger = logging.getLogger('worker.llm')
 
+llm_cache = LLMCache() if LLM_CACHE_PATH else None
+# Shared by every document in this process so the limit reflects the provider's real capacity
+llm_limiter = AdaptiveLimiter()
+llm_client = PooledClient(llm_limiter)
 
-def chat_completion(system_prompt: str, user_message: str) -> str:
+
+async def chat_completion(system_prompt: str, user_message: str) -> str:
     """Call OpenRouter for a chat completion."""
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
@@ -24,36 +41,148 @@ def chat_completion(system_prompt: str, user_message: str) -> str:
         ],
         "temperature": 0.2,
     }
-    response = requests.post(OPENROUTER_URL, json=payload, headers=headers, timeout=60)
-    response.raise_for_status()
-    return response.json()["choices"][0]["message"]["content"]
+    data = await llm_client.post_json(OPENROUTER_URL, payload, headers)
+    return data["choices"][0]["message"]["content"]
+
 
+INSIGHT_RULES = (
+    "1. 'insight': A 2-3 sentence analysis of the paragraph's key finding or contribution.\n"
+    "2. 'highlights': An array of 1-3 exact verbatim phrases from the paragraph that are most important.\n"
+    "CRITICAL: The phrases in 'highlights' must be EXACT substrings of the input paragraph.\n"
+    "Return ONLY valid JSON, no markdown, no extra text."
+)
 
-def generate_insight_and_highlights(paragraph: str) -> dict:
+
+def _parse_json(raw: str):
+    # Strip markdown if present
+    raw = raw.strip()
+    if raw.startswith("```"):
+        raw = raw.split("```")[1]
+        if raw.startswith("json"):
+            raw = raw[4:]
+    return json.loads(raw.strip())
+
+
+def _validate_insight(item) -> Optional[dict]:
+    """Return {"insight", "highlights"} if the item has the expected shape, else None."""
+    if not isinstance(item, dict):
+        return None
+    insight = item.get("insight")
+    highlights = item.get("highlights", [])
+    if not isinstance(insight, str) or not insight.strip() or not isinstance(highlights, list):
+        return None
+    return {
+        "insight": insight.strip(),
+        "highlights": [h for h in highlights if isinstance(h, str) and h.strip()],
+    }
+
+
+async def generate_insight_and_highlights(paragraph: str) -> dict:
     """
     Given a paragraph, generate an insight and highlight phrases.
     Returns: {"insight": "...", "highlights": ["phrase1", "phrase2"]}
     """
     system = (
         "You are a research analyst. Given a paragraph from a research document, "
-        "you must return a JSON object with two fields:\n"
-        "1. 'insight': A 2-3 sentence analysis of the paragraph's key finding or contribution.\n"
-        "2. 'highlights': An array of 1-3 exact verbatim phrases from the paragraph that are most important.\n"
-        "CRITICAL: The phrases in 'highlights' must be EXACT substrings of the input paragraph.\n"
-        "Return ONLY valid JSON, no markdown, no extra text."
+        "you must return a JSON object with two fields:\n" + INSIGHT_RULES
     )
     user = f"Paragraph:\n{paragraph}"
 
     try:
-        raw = chat_completion(system, user)
-        # Strip markdown if present
-        raw = raw.strip()
-        if raw.startswith("```"):
-            raw = raw.split("```")[1]
-            if raw.startswith("json"):
-                raw = raw[4:]
-        result = json.loads(raw.strip())
+        result = _validate_insight(_parse_json(await chat_completion(system, user)))
+        if result is None:
+            raise ValueError("response is missing 'insight' or 'highlights'")
         return result
     except Exception as e:
-        print(f"LLM insight error: {e}")
-        return {"insight": "Could not generate insight.", "highlights": []}
+        logger.warning('insight call failed: %s', e)
+        return {"insight": FALLBACK_INSIGHT, "highlights": []}
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def plan_batches(paragraphs: List[str], max_items: int = LLM_BATCH_SIZE,
+                 max_tokens: int = LLM_BATCH_MAX_TOKENS) -> List[List[int]]:
+    """
+    Group paragraph indices into batches of at most max_items whose combined
+    size stays under max_tokens. An oversized paragraph gets a batch of its own.
+    """
+    batches, current, current_tokens = [], [], 0
+    for i, paragraph in enumerate(paragraphs):
+        tokens = _estimate_tokens(paragraph)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def generate_insights_batch(paragraphs: List[str]) -> List[dict]:
+    """
+    Generate insights for several paragraphs, serving repeats from llm_cache.
+    Only paragraphs without a cached response reach the model, and only
+    successful parses (never FALLBACK_INSIGHT) are written back.
+    """
+    if llm_cache is None:
+        return await _generate_insights_uncached(paragraphs)
+
+    keys = [cache_key(MODEL, PROMPT_VERSION, text) for text in paragraphs]
+    cached = await asyncio.to_thread(llm_cache.get_many, list(dict.fromkeys(keys)))
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    if missing:
+        fresh = await _generate_insights_uncached([paragraphs[i] for i in missing])
+        await asyncio.to_thread(llm_cache.put_many, [
+            (keys[i], result) for i, result in zip(missing, fresh)
+            if result.get("insight") and result["insight"] != FALLBACK_INSIGHT
+        ])
+        for i, result in zip(missing, fresh):
+            cached.setdefault(keys[i], result)
+    return [cached[key] for key in keys]
+
+
+async def _generate_insights_uncached(paragraphs: List[str]) -> List[dict]:
+    """
+    Generate insights for several paragraphs in one request.
+    The model answers with a JSON array keyed by paragraph id; each item is
+    validated on its own and only the missing or malformed ones are re-run
+    through generate_insight_and_highlights. Returns results in input order.
+    """
+    if len(paragraphs) == 1:
+        return [await generate_insight_and_highlights(paragraphs[0])]
+
+    system = (
+        "You are a research analyst. You will receive several paragraphs from a research "
+        "document, each with an 'id'. Return a JSON array with one object per paragraph, "
+        "each with the paragraph's 'id' and two fields:\n" + INSIGHT_RULES
+    )
+    user = "Paragraphs:\n" + json.dumps(
+        [{"id": f"p{i}", "paragraph": text} for i, text in enumerate(paragraphs)],
+        ensure_ascii=False,
+    )
+
+    by_id: Dict[str, dict] = {}
+    try:
+        items = _parse_json(await chat_completion(system, user))
+        if isinstance(items, dict):
+            # Some models wrap the array, e.g. {"results": [...]}
+            items = next((v for v in items.values() if isinstance(v, list)), [])
+        for item in items if isinstance(items, list) else []:
+            result = _validate_insight(item)
+            if result is not None and isinstance(item.get("id"), str):
+                by_id[item["id"]] = result
+    except Exception as e:
+        logger.warning('batched insight call failed for %d paragraphs: %s', len(paragraphs), e)
+
+    retried = await asyncio.gather(*(
+        generate_insight_and_highlights(text)
+        for i, text in enumerate(paragraphs) if f"p{i}" not in by_id
+    ))
+    retried = iter(retried)
+    results = [by_id.get(f"p{i}") or next(retried) for i in range(len(paragraphs))]
+    if len(by_id) < len(paragraphs):
+        logger.info('batched insights: %d/%d valid, rest re-run individually', len(by_id), len(paragraphs))
+    return results
@@ -0,0 +1,59 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from typing import Dict, Iterable, List, Tuple
+
+from sqlite_cache import SQLiteCache
+
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH", os.path.join(tempfile.gettempdir(), "mirage-llm.sqlite3")
+)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "200000"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 86400)))  # seconds
+
+
+def cache_key(model: str, prompt_version: str, paragraph: str) -> str:
+    normalized = " ".join(paragraph.split())
+    return hashlib.sha1(f"{model}\0{prompt_version}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class LLMCache(SQLiteCache):
+    """
+    Persistent cache of parsed insight responses, keyed by cache_key().
+    Entries older than ttl are treated as misses and purged on the next write.
+    Callers must only store successful parses.
+    """
+
+    TABLE = "responses"
+    VALUE_COLUMN = "result"
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS responses ("
+        " key TEXT PRIMARY KEY, result TEXT NOT NULL,"
+        " created REAL NOT NULL, last_used REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)",
+    )
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 ttl: int = LLM_CACHE_TTL):
+        self.ttl = ttl
+        super().__init__(path, max_entries)
+
+    def _decode(self, result: str) -> dict:
+        return json.loads(result)
+
+    def _valid(self, now: float) -> Tuple[str, List[float]]:
+        return " AND created > ?", [now - self.ttl]
+
+    def put_many(self, items: Iterable[Tuple[str, dict]]):
+        now = time.time()
+        rows = [(key, json.dumps(result, ensure_ascii=False), now, now) for key, result in items]
+        if not rows:
+            return
+        with self._write() as conn:
+            conn.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO responses (key, result, created, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+        self._added(len(rows))
@@ -0,0 +1,175 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger('worker.llm_client')
+
+# Starting point only; the limiter adapts between the min and max at runtime
+LLM_CONCURRENCY_INITIAL = int(os.getenv("INSIGHT_CONCURRENCY", "4"))
+LLM_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "1"))
+LLM_CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", "32"))
+LLM_LATENCY_SPIKE_FACTOR = float(os.getenv("LLM_LATENCY_SPIKE_FACTOR", "3"))  # x baseline latency
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter shared by every in-flight document.
+
+    Each success under normal latency grows the limit by 1/limit (about +1
+    per round of calls); a 429 or 5xx halves it, and a latency spike relative
+    to the EWMA baseline shrinks it by a tenth. A Retry-After from the
+    provider pauses new calls until it has passed.
+    """
+
+    def __init__(self, initial: int = LLM_CONCURRENCY_INITIAL, minimum: int = LLM_CONCURRENCY_MIN,
+                 maximum: int = LLM_CONCURRENCY_MAX, spike_factor: float = LLM_LATENCY_SPIKE_FACTOR):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.spike_factor = spike_factor
+        self.in_flight = 0
+        self.baseline_latency: Optional[float] = None
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond: Optional[asyncio.Condition] = None
+        self._cond_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.successes = 0
+        self.overloads = 0
+        self.spikes = 0
+
+    def _condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._cond is None or self._cond_loop is not loop:
+            self._cond = asyncio.Condition()
+            self._cond_loop = loop
+        return self._cond
+
+    @asynccontextmanager
+    async def slot(self):
+        cond = self._condition()
+        async with cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    cond.release()
+                    try:
+                        await asyncio.sleep(pause)
+                    finally:
+                        await cond.acquire()
+                    continue
+                if self.in_flight < int(self.limit):
+                    break
+                await cond.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with cond:
+                self.in_flight -= 1
+                cond.notify_all()
+
+    def _decrease(self, factor: float):
+        # Calls that were already in flight report the same overload; cut once per round trip
+        now = time.monotonic()
+        if now - self._last_decrease < (self.baseline_latency or 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+
+    def on_success(self, latency: float):
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        if latency > self.spike_factor * self.baseline_latency:
+            self.spikes += 1
+            self._decrease(0.9)
+        else:
+            self.successes += 1
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.baseline_latency = 0.9 * self.baseline_latency + 0.1 * latency
+
+    def on_overload(self, retry_after: Optional[float] = None):
+        self.overloads += 1
+        self._decrease(0.5)
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        logger.info('LLM provider overloaded, concurrency limit now %.1f', self.limit)
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "inFlight": self.in_flight,
+            "baselineLatencyMs": round(1000 * self.baseline_latency, 1) if self.baseline_latency else None,
+            "successes": self.successes,
+            "overloads": self.overloads,
+            "latencySpikes": self.spikes,
+        }
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
+
+class PooledClient:
+    """
+    One keep-alive httpx.AsyncClient per event loop, with requests admitted
+    through a shared AdaptiveLimiter and retried on 429/5xx/transport errors.
+    """
+
+    def __init__(self, limiter: AdaptiveLimiter):
+        self.limiter = limiter
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=LLM_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=self.limiter.maximum,
+                    max_keepalive_connections=self.limiter.maximum,
+                ),
+            )
+            self._loop = loop
+        return self._client
+
+    async def post_json(self, url: str, payload: dict, headers: dict) -> dict:
+        client = self._get_client()
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            last_attempt = attempt == LLM_MAX_RETRIES
+            async with self.limiter.slot():
+                started = time.monotonic()
+                try:
+                    response = await client.post(url, json=payload, headers=headers)
+                except httpx.TransportError as e:
+                    if last_attempt:
+                        raise
+                    logger.warning('LLM request failed (%s), retrying', e)
+                    response = None
+                if response is not None:
+                    if response.status_code == 429 or response.status_code >= 500:
+                        # Retry-After (or exponential backoff) pauses every caller, not just this one
+                        self.limiter.on_overload(_retry_after(response) or 2 ** attempt)
+                        if last_attempt:
+                            response.raise_for_status()
+                        continue
+                    response.raise_for_status()
+                    self.limiter.on_success(time.monotonic() - started)
+                    return response.json()
+            await asyncio.sleep(2 ** attempt)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
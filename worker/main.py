@@ -190,23 +190,32 @@
 
 import os
 import asyncio
-import tempfile
-import requests
 import logging
-import fitz
+import importlib
+import numpy as np
+from typing import AsyncIterator, List, Literal, Optional
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from pdf_processor import (
-    extract_page_data,
-    chunk_pages,
-    select_important_paragraphs,
-    annotate_pdf,
+import embeddings
+from embeddings import embed_texts, embedding_cache
+from llm import llm_cache, llm_client, llm_limiter
+from jobs import JobScheduler, JobStore, QueueFullError, JOB_STATE_DIR, QUEUED, DONE, ERROR
+from batching import MicroBatcher
+from schemas import EmbeddingEncoding, ProcessRequest
+from startup import StartupTracker, ComponentFailed
+from wire_format import (
+    FastJSONResponse,
+    compact_result,
+    decode_embedding,
+    encode_embedding,
+    encode_event,
+    encode_result,
+    format_event,
+    result_events,
 )
-from embeddings import embed_texts
-from llm import generate_insight_and_highlights
-from highlight_mapper import map_highlights_to_bboxes
 
 # Configure logging
 logging.basicConfig(
@@ -215,7 +224,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger('worker')
 
-app = FastAPI(title="Mirage Worker")
+app = FastAPI(title="Mirage Worker", default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -224,201 +233,314 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOADTHING_SECRET = os.getenv("UPLOADTHING_SECRET", "")
-TEMP_DIR = tempfile.gettempdir()
-INSIGHT_CONCURRENCY = int(os.getenv("INSIGHT_CONCURRENCY", "10"))  # tune per LLM rate limit
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))   # pipelines running at once
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "20"))          # waiting behind them before 429
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))        # seconds finished jobs stay pollable
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "64"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
 
+# PDF/OCR libraries, the pipeline and the embedding model load in the
+# background once the server is up; /ready reports when they are done
+startup = StartupTracker(("pipeline", "embeddingModel", "warmup"))
+pipeline = None  # the pipeline module, once imported
+
+
+async def _loaded_pipeline():
+    """The pipeline module, waiting for the background import if needed (503 if it failed)."""
+    try:
+        await startup.wait("pipeline")
+    except ComponentFailed as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return pipeline
+
+
+async def _run_pipeline(req: ProcessRequest, emit=None) -> dict:
+    # Jobs accepted during startup wait in the queue until the pipeline and
+    # the model are loaded (the pipeline would otherwise block the event loop
+    # on the model's load lock)
+    module = await _loaded_pipeline()
+    await startup.wait("embeddingModel")
+    # Finished jobs are retained for JOB_RESULT_TTL: keep their embeddings packed
+    return compact_result(await module.run_pipeline(req, emit))
+
+
+# Multi-process mode (serve.py): any process can answer polls for any job
+job_store = JobStore(JOB_STATE_DIR, ProcessRequest) if JOB_STATE_DIR else None
+
+scheduler = JobScheduler(
+    _run_pipeline,
+    max_concurrent=MAX_CONCURRENT_JOBS,
+    max_queued=MAX_QUEUED_JOBS,
+    result_ttl=JOB_RESULT_TTL,
+    store=job_store,
+)
+
+# Concurrent /embed requests share one model.encode call
+embed_batcher = MicroBatcher(
+    embed_texts,
+    max_batch_size=EMBED_BATCH_MAX_SIZE,
+    max_wait_ms=EMBED_BATCH_MAX_WAIT_MS,
+)
 
-class ProcessRequest(BaseModel):
-    documentId: str
-    projectId: str
-    fileUrl: str
 
+async def _load_components():
+    global pipeline
+    if job_store is not None:
+        # Fail the jobs a previous run left queued or running, so polls for them end
+        try:
+            await asyncio.to_thread(job_store.prune, JOB_RESULT_TTL)
+        except OSError as e:
+            logger.warning('could not sweep job records: %s', e)
+    try:
+        with startup.phase("pipeline"):
+            pipeline = await asyncio.to_thread(importlib.import_module, "pipeline")
+        with startup.phase("embeddingModel"):
+            await asyncio.to_thread(embeddings.get_backend)
+        with startup.phase("warmup"):
+            await asyncio.to_thread(embeddings.warm_up)
+    except Exception:
+        return  # recorded by the tracker and reported by /ready
+    timeline = startup.status()["timeline"]
+    logger.info('worker ready %.2fs after process start (%s)', timeline["warmup"],
+                ', '.join(f'{point} at {t:.2f}s' for point, t in timeline.items()))
+
+
+@app.on_event("startup")
+async def _start_background_workers():
+    startup.mark("serving")
+    scheduler.start()
+    embed_batcher.start()
+    app.state.loader = asyncio.create_task(_load_components())
+
+
+@app.on_event("shutdown")
+async def _stop_background_workers():
+    await embed_batcher.stop()
+    await scheduler.stop()
+    if pipeline is not None:
+        await pipeline.uploader.aclose()
+    await llm_client.aclose()
+
+
+async def _submit_or_429(req: ProcessRequest):
+    try:
+        return await scheduler.submit(req.documentId, req)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
 
-# ── File Upload (via Node.js backend) ─────────────────────────────────────────
 
-BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:5000")
+# ── Job API ───────────────────────────────────────────────────────────────────
 
+@app.post("/jobs", status_code=202)
+async def submit_job(req: ProcessRequest):
+    """Queue a document for processing and return its job id immediately."""
+    job = await _submit_or_429(req)
+    return job.to_status()
 
-def upload_to_uploadthing(file_path: str, filename: str) -> str:
-    with open(file_path, "rb") as f:
-        files = {"file": (filename, f, "application/pdf")}
-        resp = requests.post(
-            f"{BACKEND_URL}/api/uploadthing-upload",
-            files=files,
-            timeout=120,
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        return data["fileUrl"]
 
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Job state, plus the background upload of its annotated PDF once one started."""
+    job = await scheduler.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    upload = await pipeline.uploader.status(job.key) if pipeline is not None else None
+    return {**job.to_status(), "annotatedUpload": upload}
 
-# ── Concurrent insight generation ────────────────────────────────────────────
 
-async def _generate_insight_for_para(para: dict, semaphore: asyncio.Semaphore) -> dict:
-    """
-    Run one LLM call inside a semaphore slot so we don't overwhelm the LLM.
-    generate_insight_and_highlights is a blocking function, so we offload it
-    to a thread via asyncio.to_thread() — keeps the event loop free.
-    """
-    async with semaphore:
-        logger.info('generating insight for page=%s', para.get('pageNumber'))
-        try:
-            llm_result = await asyncio.to_thread(
-                generate_insight_and_highlights, para["text"]
-            )
-        except Exception as e:
-            logger.warning('LLM failed for page=%s: %s', para.get('pageNumber'), e)
-            llm_result = {"insight": "", "highlights": []}
-
-        return {
-            "pageNumber": para["pageNumber"],
-            "insightText": llm_result.get("insight", ""),
-            "rawHighlights": llm_result.get("highlights", []),
-        }
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str, embeddingEncoding: Optional[EmbeddingEncoding] = None):
+    job = await scheduler.get(job_id, with_result=True)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == ERROR:
+        raise HTTPException(status_code=500, detail=job.error or "Processing failed")
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return encode_result(job.result, embeddingEncoding or job.payload.embeddingEncoding)
 
 
-# ── Main Processing Pipeline ──────────────────────────────────────────────────
+@app.get("/documents/{document_id}/annotated")
+async def annotated_upload_status(document_id: str):
+    """Background upload state for a document's annotated PDF (also reported by callback)."""
+    status = await (await _loaded_pipeline()).uploader.status(document_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="No annotated upload for this document")
+    return status
+
+
+# ── Synchronous processing (legacy) ───────────────────────────────────────────
 
 @app.post("/process")
 async def process_document(req: ProcessRequest):
-    """Full document processing pipeline."""
-    logger.info('[%s] process start', req.documentId)
-    tmp_input = os.path.join(TEMP_DIR, f"{req.documentId}_original.pdf")
-    tmp_output = os.path.join(TEMP_DIR, f"{req.documentId}_annotated.pdf")
+    """
+    Full document processing pipeline, answered on the same connection.
+    Runs through the same bounded scheduler as /jobs.
+    """
+    job = await scheduler.wait(await _submit_or_429(req))
+    if job.status != DONE:
+        raise HTTPException(status_code=500, detail=job.error or "Processing failed")
+    return encode_result(job.result, req.embeddingEncoding)
 
-    try:
-        # ── Step 1: Download PDF ──────────────────────────────────────────
-        logger.info('[%s] Downloading PDF...', req.documentId)
-        pdf_response = requests.get(req.fileUrl, timeout=60)
-        pdf_response.raise_for_status()
-        with open(tmp_input, "wb") as f:
-            f.write(pdf_response.content)
-
-        # ── Step 2: Extract text + bounding boxes ────────────────────────
-        logger.info('[%s] Extracting text...', req.documentId)
-        pages = await asyncio.to_thread(extract_page_data, tmp_input)
-        page_count = len(pages)
-
-        # ── Step 3: Chunk ─────────────────────────────────────────────────
-        logger.info('[%s] Chunking...', req.documentId)
-        raw_chunks = chunk_pages(pages)
-
-        # ── Step 4: Embed chunks ──────────────────────────────────────────
-        logger.info('[%s] Embedding %d chunks...', req.documentId, len(raw_chunks))
-        chunk_texts = [c["text"] for c in raw_chunks]
-
-        # Batch embed in groups of 32, offloaded to thread
-        embeddings = []
-        for i in range(0, len(chunk_texts), 32):
-            batch = chunk_texts[i:i + 32]
-            batch_embeddings = await asyncio.to_thread(embed_texts, batch)
-            embeddings.extend(batch_embeddings)
-
-        chunks = [
-            {
-                "text": chunk["text"],
-                "embedding": embeddings[i],
-                "pageNumber": chunk["pageNumber"],
-            }
-            for i, chunk in enumerate(raw_chunks)
-            if i < len(embeddings)
-        ]
-
-        # ── Step 5: Select important paragraphs ──────────────────────────
-        logger.info('[%s] Selecting key paragraphs...', req.documentId)
-        important_paragraphs = select_important_paragraphs(pages)
-        logger.info('[%s] selected %d paragraphs for insight', req.documentId, len(important_paragraphs))
-
-        # ── Steps 6 & 7: Generate insights concurrently ──────────────────
-        logger.info('[%s] Generating %d insights concurrently (concurrency=%d)...',
-                    req.documentId, len(important_paragraphs), INSIGHT_CONCURRENCY)
-
-        page_blocks_map = {p["pageNumber"]: p["blocks"] for p in pages}
-        semaphore = asyncio.Semaphore(INSIGHT_CONCURRENCY)
-
-        # Fire all LLM calls at once, capped by semaphore
-        insight_tasks = [
-            _generate_insight_for_para(para, semaphore)
-            for para in important_paragraphs
-        ]
-        insights_unordered = await asyncio.gather(*insight_tasks)
-
-        # Re-sort by page number to maintain document order
-        insights = sorted(insights_unordered, key=lambda x: x["pageNumber"])
-
-        # Map raw highlight phrases to precise bbox coordinates using PDF text search
-        with fitz.open(tmp_input) as pdf_doc:
-            for insight in insights:
-                page_number = insight.get("pageNumber", 0)
-                raw_highlights = insight.pop("rawHighlights", [])
-
-                if page_number < 1 or page_number > len(pdf_doc):
-                    insight["highlights"] = []
-                    continue
-
-                page = pdf_doc[page_number - 1]
-                page_blocks = page_blocks_map.get(page_number, [])
-                insight["highlights"] = map_highlights_to_bboxes(
-                    raw_highlights,
-                    page_blocks,
-                    page=page,
-                )
-
-        # ── Step 8: Annotate PDF ──────────────────────────────────────────
-        logger.info('[%s] Annotating PDF...', req.documentId)
-        await asyncio.to_thread(annotate_pdf, tmp_input, insights, tmp_output)
-
-        # ── Upload annotated PDF ──────────────────────────────────────────
-        logger.info('[%s] Uploading annotated PDF...', req.documentId)
-        annotated_filename = f"annotated_{req.documentId}.pdf"
+
+# ── Streaming processing ──────────────────────────────────────────────────────
+
+async def _job_events(job, queue: Optional[asyncio.Queue]) -> AsyncIterator[dict]:
+    """
+    Events for one job: live from `queue` if we subscribed before it started,
+    otherwise replayed from its result once it finishes. Ends with a summary
+    or an error event.
+    """
+    if queue is not None:
         try:
-            annotated_url = await asyncio.to_thread(
-                upload_to_uploadthing, tmp_output, annotated_filename
-            )
-        except Exception as e:
-            logger.warning('[%s] UploadThing failed, using original URL: %s', req.documentId, e)
-            annotated_url = req.fileUrl
-
-        # ── Step 9: Return results ────────────────────────────────────────
-        logger.info('[%s] processing complete pageCount=%s chunks=%s insights=%s',
-                    req.documentId, page_count, len(chunks), len(insights))
-
-        return {
-            "pageCount": page_count,
-            "chunks": chunks,
-            "insights": insights,
-            "annotatedFileUrl": annotated_url,
-        }
+            while (event := await queue.get()) is not None:
+                yield event
+        finally:
+            job.unsubscribe(queue)
+    else:
+        job = await scheduler.wait(job)
+        if job.status == DONE:
+            for event in result_events(job.result):
+                yield event
+    if job.status == ERROR:
+        yield {"type": "error", "error": job.error or "Processing failed"}
+
+
+@app.post("/process/stream")
+async def process_document_stream(req: ProcessRequest, format: Literal["ndjson", "sse"] = "ndjson"):
+    """
+    Same pipeline as /process, streamed as it runs: "chunks" events per page
+    batch, one "insight" event per paragraph, then a "summary" event with
+    pageCount and annotatedFileUrl (or an "error" event). NDJSON by default,
+    Server-Sent Events with ?format=sse.
+    """
+    job = await _submit_or_429(req)
+    # Subscribe now: the body generator only starts once the job may already be running.
+    # A job of another process (same documentId) is replayed once it finishes.
+    queue = job.subscribe() if scheduler.owns(job) and job.status == QUEUED else None
+    encoding = req.embeddingEncoding
 
-    except Exception as e:
-        logger.exception('[%s] ERROR: %s', req.documentId, e)
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        for path in [tmp_input, tmp_output]:
-            try:
-                if os.path.exists(path):
-                    os.remove(path)
-            except Exception:
-                pass
+    async def body():
+        async for event in _job_events(job, queue):
+            yield format_event(encode_event(event, encoding), format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache"})
 
 
 # ── Embed endpoint ────────────────────────────────────────────────────────────
 
 class EmbedRequest(BaseModel):
     text: str
+    embeddingEncoding: EmbeddingEncoding = "json"
 
 
 @app.post("/embed")
 async def embed_text(req: EmbedRequest):
     """Generate embedding for a single text using local model."""
     try:
-        embedding = (await asyncio.to_thread(embed_texts, [req.text]))[0]
-        return {"embedding": embedding}
+        embedding = await embed_batcher.submit(req.text)
+        return encode_embedding(embedding, req.embeddingEncoding)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ── Vector search ─────────────────────────────────────────────────────────────
+
+class SearchRequest(BaseModel):
+    projectId: str
+    query: str
+    k: int = 5
+    # Restrict to these documents and report which of them are not indexed yet
+    documentIds: Optional[List[str]] = None
+    # IVF lists to scan for ANN-indexed projects (higher = better recall, slower)
+    nprobe: Optional[int] = None
+
+
+class IndexChunk(BaseModel):
+    text: str
+    pageNumber: int
+    embedding: Optional[List[float]] = None
+    embeddingB64: Optional[str] = None
+    embeddingScale: Optional[float] = None
+
+
+class IndexDocumentRequest(BaseModel):
+    chunks: List[IndexChunk]
+    embeddingEncoding: EmbeddingEncoding = "json"
+
+
+@app.post("/search")
+async def search(req: SearchRequest):
+    """Embed the query and return the project's top-k chunks by cosine similarity."""
+    vector_index = (await _loaded_pipeline()).vector_index
+
+    def run(query: np.ndarray):
+        # Both take the index lock, which an upsert or ANN build may hold for long
+        indexed = set(vector_index.document_ids(req.projectId))
+        missing = [d for d in (req.documentIds or []) if d not in indexed]
+        return vector_index.search(req.projectId, query, req.k, req.documentIds, req.nprobe), missing
+
+    try:
+        query = np.asarray(await embed_batcher.submit(req.query), dtype=np.float32)
+        results, missing = await asyncio.to_thread(run, query)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"results": results, "missingDocumentIds": missing}
+
+
+@app.put("/index/{project_id}/documents/{document_id}")
+async def index_document(project_id: str, document_id: str, req: IndexDocumentRequest):
+    """(Re)load one document's chunks into the project index, e.g. after a worker restart."""
+    vector_index = (await _loaded_pipeline()).vector_index
+    chunks = [
+        {
+            "text": c.text,
+            "pageNumber": c.pageNumber,
+            "embedding": decode_embedding(c.model_dump(), req.embeddingEncoding),
+        }
+        for c in req.chunks
+    ]
+    await asyncio.to_thread(vector_index.upsert, project_id, document_id, chunks)
+    return {"indexed": len(chunks)}
+
+
+@app.delete("/index/{project_id}/documents/{document_id}")
+async def unindex_document(project_id: str, document_id: str):
+    vector_index = (await _loaded_pipeline()).vector_index
+    await asyncio.to_thread(vector_index.remove, project_id, document_id)
+    return {"status": "ok"}
+
+
+@app.delete("/index/{project_id}")
+async def unindex_project(project_id: str):
+    vector_index = (await _loaded_pipeline()).vector_index
+    await asyncio.to_thread(vector_index.remove, project_id)
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready():
+    """200 once every background component has loaded, 503 (with per-component status) until then."""
+    status = startup.status()
+    return FastJSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    """Liveness and stats; answers while components are still loading (see /ready)."""
+    loaded = pipeline is not None
+    return {
+        "status": "ok",
+        "ready": startup.is_ready(),
+        "startup": startup.status(),
+        "jobs": scheduler.stats(),
+        "docCache": pipeline.doc_cache.stats() if loaded else None,
+        "embeddingBackend": embeddings.backend_stats(),
+        "embeddingCache": embedding_cache.stats() if embedding_cache else None,
+        "llmCache": llm_cache.stats() if llm_cache else None,
+        "llmConcurrency": llm_limiter.stats(),
+        "embedBatching": embed_batcher.stats(),
+        "vectorIndex": pipeline.vector_index.stats() if loaded else None,
+        "uploads": pipeline.uploader.stats() if loaded else None,
+    }
@@ -1,183 +1,699 @@
 import fitz  # PyMuPDF
 import pytesseract
 from PIL import Image
-import io
 import os
+import json
+import shutil
+import hashlib
 import math
+import logging
 import tempfile
-from typing import List, Dict, Tuple
-from collections import Counter
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterator, List, Dict, Optional, Tuple, Union
 import re
 
+import numpy as np
+
+from document_session import DocumentSession
+from startup import available_cpus
+from term_index import TermIndex
+from vector_index import normalize_rows
+
+logger = logging.getLogger('worker.pdf_processor')
+
 MIN_TEXT_DENSITY = 50  # chars per page minimum before OCR fallback
-CHUNK_TOKEN_TARGET = 600
 
 
 # ── Text Extraction ──────────────────────────────────────────────────────────
 
-def extract_page_data(pdf_path: str) -> List[Dict]:
+PARALLEL_EXTRACT_MIN_PAGES = int(os.getenv("PARALLEL_EXTRACT_MIN_PAGES", "40"))
+PAGES_PER_SHARD_MIN = int(os.getenv("PAGES_PER_SHARD_MIN", "16"))
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0"))  # 0 = one per available core
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+
+def _extract_workers() -> int:
+    return EXTRACT_WORKERS if EXTRACT_WORKERS > 0 else len(available_cpus())
+
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    """
+    Lazily start the shared extraction pool. Workers are spawned rather than
+    forked so they never inherit the embedding model or the parent's threads.
+    """
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=_extract_workers(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _extract_pool
+
+
+def _reset_extract_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        _extract_pool = None
+
+
+def _shard_ranges(page_count: int, shards: int) -> List[Tuple[int, int]]:
+    """Split [0, page_count) into `shards` contiguous, near-equal ranges."""
+    size, extra = divmod(page_count, shards)
+    ranges = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _shard_count(page_count: int) -> int:
+    if page_count < PARALLEL_EXTRACT_MIN_PAGES:
+        return 1
+    workers = _extract_workers()
+    if workers < 2:
+        return 1
+    # Oversplit 2x so one slow (image-heavy) shard doesn't leave other cores idle
+    return max(1, min(workers * 2, math.ceil(page_count / PAGES_PER_SHARD_MIN)))
+
+
+def _extract_page(page: fitz.Page, page_num: int,
+                  textpage: Optional[fitz.TextPage] = None) -> Tuple[Dict, bool]:
+    """Return the page's text blocks and whether it is too sparse (needs OCR)."""
+    # Blocks and words share one text page parse (same extraction flags)
+    if textpage is None:
+        textpage = page.get_textpage(flags=fitz.TEXTFLAGS_WORDS)
+    blocks_raw = page.get_text("blocks", textpage=textpage)  # (x0, y0, x1, y1, text, block_no, block_type)
+    text_blocks = [
+        {"text": b[4].strip(), "bbox": (b[0], b[1], b[2], b[3])}
+        for b in blocks_raw
+        if b[6] == 0 and b[4].strip()  # type 0 = text
+    ]
+
+    # Word boxes for the in-memory highlight index: [x0, y0, x1, y1, text, block_no, line_no]
+    words = [
+        [round(w[0], 2), round(w[1], 2), round(w[2], 2), round(w[3], 2), w[4], w[5], w[6]]
+        for w in page.get_text("words", textpage=textpage)
+    ]
+
+    page_text = " ".join(b["text"] for b in text_blocks)
+    return {"pageNumber": page_num, "blocks": text_blocks, "words": words}, len(page_text) < MIN_TEXT_DENSITY
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> Tuple[List[Dict], List[int]]:
+    """
+    Extract pages [start, end) with a private fitz document (safe in a subprocess).
+    Returns the pages and the 0-based indices of sparse pages still needing OCR.
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        pages, sparse = [], []
+        for i in range(start, min(end, len(doc))):
+            page_data, needs_ocr = _extract_page(doc[i], i + 1)
+            pages.append(page_data)
+            if needs_ocr:
+                sparse.append(i)
+        return pages, sparse
+    finally:
+        doc.close()
+
+
+def _extract_session_range(session: DocumentSession, start: int, end: int) -> Tuple[List[Dict], List[int]]:
+    """In-process counterpart of _extract_page_range, reading the session's open document."""
+    pages, sparse = [], []
+    for i in range(start, min(end, session.page_count)):
+        with session.lock:
+            page_data, needs_ocr = _extract_page(session.page(i), i + 1, session.text_page(i))
+        pages.append(page_data)
+        if needs_ocr:
+            sparse.append(i)
+    return pages, sparse
+
+
+def iter_page_batches(source: Union[str, DocumentSession],
+                      parallel: Optional[bool] = None) -> Iterator[List[Dict]]:
+    """
+    Extract the document as a stream of page batches, in page order, so later
+    stages can start on the first pages while the rest are still being read.
+    Each batch is a shard (large documents go through the process pool, with
+    every shard in flight at once) and has its sparse pages OCR'd already.
+    Pass parallel=False to force a single-process walk.
+
+    `source` is a file path or an open DocumentSession; a session is read in
+    place and only spilled to disk if the process pools need a path.
+    """
+    if isinstance(source, DocumentSession):
+        session, owned = source, False
+    else:
+        session, owned = DocumentSession.from_path(source), True
+    try:
+        yield from _iter_session_batches(session, parallel)
+    finally:
+        if owned:
+            session.close()
+
+
+def _iter_session_batches(session: DocumentSession, parallel: Optional[bool]) -> Iterator[List[Dict]]:
+    page_count = session.page_count
+
+    shards = _shard_count(page_count) if parallel is not False else 1
+    ranges = _shard_ranges(page_count, shards) if shards >= 2 else [
+        (start, min(start + PAGES_PER_SHARD_MIN, page_count))
+        for start in range(0, page_count, PAGES_PER_SHARD_MIN)
+    ]
+
+    futures = None
+    if shards >= 2:
+        try:
+            pool = _get_extract_pool()
+            pdf_path = session.path()
+            futures = [pool.submit(_extract_page_range, pdf_path, start, end) for start, end in ranges]
+        except BrokenProcessPool as e:
+            logger.warning('parallel extraction failed, falling back to serial: %s', e)
+            _reset_extract_pool()
+
+    for n, (start, end) in enumerate(ranges):
+        shard_pages = None
+        if futures is not None:
+            try:
+                shard_pages, shard_sparse = futures[n].result()  # submission order == page order
+            except BrokenProcessPool as e:
+                logger.warning('parallel extraction failed, falling back to serial: %s', e)
+                _reset_extract_pool()
+                futures = None
+        if shard_pages is None:
+            shard_pages, shard_sparse = _extract_session_range(session, start, end)
+
+        # OCR fallback for sparse pages
+        if shard_sparse:
+            ocr_results = _ocr_pages(session, shard_sparse, parallel=parallel is not False)
+            for index, ocr_blocks in ocr_results.items():
+                if ocr_blocks:
+                    shard_pages[index - start]["blocks"] = ocr_blocks
+                    # OCR blocks are single words; give each its own line so boxes aren't merged
+                    shard_pages[index - start]["words"] = [
+                        [*b["bbox"], b["text"], -1, i] for i, b in enumerate(ocr_blocks)
+                    ]
+
+        yield shard_pages
+
+
+def extract_page_data(source: Union[str, DocumentSession], parallel: Optional[bool] = None) -> List[Dict]:
     """
     Extract text blocks with bounding boxes from each page.
     Falls back to Tesseract OCR for low-density pages.
+    Large documents are sharded into page ranges across a process pool;
+    pass parallel=False to force a single-process walk.
     Returns: [{pageNumber, blocks: [{text, bbox}]}]
     """
-    doc = fitz.open(pdf_path)
-    pages = []
+    return [page for batch in iter_page_batches(source, parallel) for page in batch]
 
-    for page_num, page in enumerate(doc, start=1):
-        blocks_raw = page.get_text("blocks")  # (x0, y0, x1, y1, text, block_no, block_type)
-        text_blocks = [
-            {"text": b[4].strip(), "bbox": (b[0], b[1], b[2], b[3])}
-            for b in blocks_raw
-            if b[6] == 0 and b[4].strip()  # type 0 = text
-        ]
 
-        page_text = " ".join(b["text"] for b in text_blocks)
+# ── OCR ──────────────────────────────────────────────────────────────────────
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0"))  # 0 = one per available core
+OCR_ZOOM = 2  # 2x zoom for better OCR quality
+OCR_MIN_CONFIDENCE = 30
+OCR_CACHE_DIR = os.getenv(
+    "OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mirage-ocr-cache")
+)  # set to an empty string to disable
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+
+def _get_ocr_pool() -> ProcessPoolExecutor:
+    """Dedicated pool so OCR never queues behind (or starves) text extraction."""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS if OCR_WORKERS > 0 else len(available_cpus()),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _ocr_pool
 
-        # OCR fallback for sparse pages
-        if len(page_text) < MIN_TEXT_DENSITY:
-            ocr_blocks = _ocr_page(page)
-            if ocr_blocks:
-                text_blocks = ocr_blocks
 
-        pages.append({"pageNumber": page_num, "blocks": text_blocks})
+def _reset_ocr_pool():
+    global _ocr_pool
+    with _ocr_pool_lock:
+        _ocr_pool = None
 
-    doc.close()
-    return pages
+
+def _ocr_cache_path(pix: fitz.Pixmap) -> Optional[str]:
+    if not OCR_CACHE_DIR:
+        return None
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{pix.width}x{pix.height}x{pix.n}:{OCR_ZOOM}:{OCR_MIN_CONFIDENCE}".encode())
+    h.update(pix.samples_mv)
+    key = h.hexdigest()
+    return os.path.join(OCR_CACHE_DIR, key[:2], f"{key}.json")
 
 
 def _ocr_page(page: fitz.Page) -> List[Dict]:
-    """Render page to image and run Tesseract OCR."""
+    """
+    Render page to image and run Tesseract OCR.
+    The grayscale pixmap is handed to PIL straight from its sample buffer
+    (no PNG encode/decode), and results are cached by a hash of those pixels.
+    """
     try:
-        mat = fitz.Matrix(2, 2)  # 2x zoom for better OCR quality
-        pix = page.get_pixmap(matrix=mat)
-        img_data = pix.tobytes("png")
-        img = Image.open(io.BytesIO(img_data))
+        mat = fitz.Matrix(OCR_ZOOM, OCR_ZOOM)
+        pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False)
+
+        cache_path = _ocr_cache_path(pix)
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r") as f:
+                    return [{"text": b["text"], "bbox": tuple(b["bbox"])} for b in json.load(f)]
+            except (OSError, ValueError):
+                pass
+
+        img = Image.frombuffer(
+            "L", (pix.width, pix.height), pix.samples_mv, "raw", "L", pix.stride, 1
+        )
 
         ocr_data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
         blocks = []
         for i, text in enumerate(ocr_data["text"]):
             text = text.strip()
-            if text and ocr_data["conf"][i] > 30:
-                x = ocr_data["left"][i] / 2
-                y = ocr_data["top"][i] / 2
-                w = ocr_data["width"][i] / 2
-                h = ocr_data["height"][i] / 2
+            if text and float(ocr_data["conf"][i]) > OCR_MIN_CONFIDENCE:
+                x = ocr_data["left"][i] / OCR_ZOOM
+                y = ocr_data["top"][i] / OCR_ZOOM
+                w = ocr_data["width"][i] / OCR_ZOOM
+                h = ocr_data["height"][i] / OCR_ZOOM
                 blocks.append({"text": text, "bbox": (x, y, x + w, y + h)})
+
+        if cache_path:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(blocks, f)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logger.warning('OCR cache write failed: %s', e)
         return blocks
     except Exception as e:
         print(f"OCR error: {e}")
         return []
 
 
+def _ocr_page_batch(pdf_path: str, indices: List[int]) -> Dict[int, List[Dict]]:
+    """OCR several pages of one document; runs inside the OCR pool."""
+    with fitz.open(pdf_path) as doc:
+        return {i: _ocr_page(doc[i]) for i in indices}
+
+
+def _ocr_pages(session: DocumentSession, indices: List[int], parallel: bool = True) -> Dict[int, List[Dict]]:
+    """OCR the given 0-based page indices, fanning out across the OCR pool."""
+    if not parallel or len(indices) < 2:
+        return _ocr_session_pages(session, indices)
+
+    workers = OCR_WORKERS if OCR_WORKERS > 0 else len(available_cpus())
+    batch_size = max(1, math.ceil(len(indices) / (workers * 2)))
+    batches = [indices[i:i + batch_size] for i in range(0, len(indices), batch_size)]
+    try:
+        pool = _get_ocr_pool()
+        pdf_path = session.path()
+        results = {}
+        for future in [pool.submit(_ocr_page_batch, pdf_path, b) for b in batches]:
+            results.update(future.result())
+        return results
+    except BrokenProcessPool as e:
+        logger.warning('parallel OCR failed, falling back to serial: %s', e)
+        _reset_ocr_pool()
+        return _ocr_session_pages(session, indices)
+
+
+def _ocr_session_pages(session: DocumentSession, indices: List[int]) -> Dict[int, List[Dict]]:
+    results = {}
+    for i in indices:
+        with session.lock:
+            results[i] = _ocr_page(session.page(i))
+    return results
+
+
 # ── Chunking ─────────────────────────────────────────────────────────────────
 
+# Chunks are measured with the embedding model's tokenizer (count_tokens) and
+# capped at its input limit, so nothing is truncated away at encode time
+CHUNK_TOKEN_TARGET = int(os.getenv("CHUNK_TOKEN_TARGET", "0"))  # 0 = the model's input limit
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))  # whole sentences repeated from the previous chunk
+DEFAULT_CHUNK_TOKENS = 256  # when neither a target nor a model limit is given
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+(?=\S)')
+
+
 def _estimate_tokens(text: str) -> int:
     return len(text.split())
 
 
-def chunk_pages(pages: List[Dict]) -> List[Dict]:
+def chunk_token_limit(max_tokens: Optional[int] = None) -> int:
+    """Token budget per chunk: CHUNK_TOKEN_TARGET, never above the model's `max_tokens`."""
+    limits = [n for n in (CHUNK_TOKEN_TARGET, max_tokens) if n and n > 0]
+    return min(limits) if limits else DEFAULT_CHUNK_TOKENS
+
+
+def _split_oversized(text: str, tokens: int, limit: int,
+                     count_tokens: Callable[[str], int]) -> List[Tuple[str, int]]:
+    """Cut a sentence longer than `limit` into word windows that fit."""
+    words = text.split()
+    pieces = []
+    start = 0
+    while start < len(words):
+        size = max(1, len(words) * limit // max(tokens, 1))
+        piece = " ".join(words[start:start + size])
+        piece_tokens = count_tokens(piece)
+        while piece_tokens > limit and size > 1:
+            size = max(1, min(size - 1, size * limit // piece_tokens))
+            piece = " ".join(words[start:start + size])
+            piece_tokens = count_tokens(piece)
+        pieces.append((piece, piece_tokens))
+        start += size
+    return pieces
+
+
+def _chunk_spans(pages: List[Dict], count_tokens: Optional[Callable[[str], int]] = None,
+                 max_tokens: Optional[int] = None) -> List[Tuple[int, List[int], str, int]]:
     """
-    Chunk page blocks into ~500-800 token chunks preserving page numbers.
-    Returns: [{text, pageNumber}]
+    Pack each page's sentences into chunks of at most chunk_token_limit()
+    tokens, carrying up to CHUNK_OVERLAP_TOKENS of trailing whole sentences
+    into the next chunk. Chunks never span pages; a sentence that alone is
+    over the limit is split on words.
+    Returns [(pageNumber, [block index within the page, ...], text, tokens)]
+    in document order.
     """
-    chunks = []
-    for page in pages:
-        page_num = page["pageNumber"]
-        current_chunk = []
-        current_tokens = 0
-
-        for block in page["blocks"]:
-            text = block["text"]
-            tokens = _estimate_tokens(text)
-
-            if current_tokens + tokens > CHUNK_TOKEN_TARGET and current_chunk:
-                chunks.append({"text": " ".join(current_chunk), "pageNumber": page_num})
-                current_chunk = []
-                current_tokens = 0
+    count_tokens = count_tokens or _estimate_tokens
+    limit = chunk_token_limit(max_tokens)
+    overlap = min(max(CHUNK_OVERLAP_TOKENS, 0), limit // 2)
 
-            current_chunk.append(text)
-            current_tokens += tokens
-
-        if current_chunk:
-            chunks.append({"text": " ".join(current_chunk), "pageNumber": page_num})
-
-    return chunks
+    spans = []
+    for page in pages:
+        # (block index, sentence, tokens) in reading order
+        units = []
+        for i, block in enumerate(page["blocks"]):
+            for sentence in _SENTENCE_END.split(block["text"].strip()):
+                if not sentence:
+                    continue
+                tokens = count_tokens(sentence)
+                if tokens > limit:
+                    units.extend((i, piece, n) for piece, n in _split_oversized(sentence, tokens, limit, count_tokens))
+                else:
+                    units.append((i, sentence, tokens))
+
+        groups = []
+        current, current_tokens = [], 0
+        for unit in units:
+            if current and current_tokens + unit[2] > limit:
+                groups.append(current)
+                carry, carried = [], 0
+                for prev in reversed(current):
+                    if carried + prev[2] > overlap or carried + prev[2] + unit[2] > limit:
+                        break
+                    carry.insert(0, prev)
+                    carried += prev[2]
+                current, current_tokens = carry, carried
+            current.append(unit)
+            current_tokens += unit[2]
+        if current:
+            groups.append(current)
+
+        for group in groups:
+            spans.append((
+                page["pageNumber"],
+                sorted({i for i, _, _ in group}),
+                " ".join(text for _, text, _ in group),
+                sum(n for _, _, n in group),
+            ))
+
+    return spans
+
+
+def chunk_pages(pages: List[Dict], count_tokens: Optional[Callable[[str], int]] = None,
+                max_tokens: Optional[int] = None) -> List[Dict]:
+    """
+    Chunk page text on sentence boundaries, sized by `count_tokens` (the
+    embedding model's tokenizer; whitespace words when omitted) to fit
+    `max_tokens`, preserving page numbers.
+    Returns: [{text, pageNumber, tokens, blockIds}], blockIds indexing the page's blocks
+    """
+    return [
+        {"text": text, "pageNumber": page_num, "tokens": tokens, "blockIds": block_ids}
+        for page_num, block_ids, text, tokens in _chunk_spans(pages, count_tokens, max_tokens)
+    ]
 
 
 # ── Important Paragraph Selection ────────────────────────────────────────────
 
-def _tfidf_score(text: str, all_texts: List[str]) -> float:
-    """Simple TF-IDF score for a text against a corpus."""
-    words = re.findall(r'\w+', text.lower())
-    if not words:
-        return 0.0
-    tf = Counter(words)
-    N = len(all_texts)
-    score = 0.0
-    for word, count in tf.items():
-        tf_val = count / len(words)
-        df = sum(1 for t in all_texts if word in t.lower())
-        idf = math.log((N + 1) / (df + 1)) + 1
-        score += tf_val * idf
-    return score
+# "embedding" ranks chunks by centrality/MMR over their existing embeddings
+# under a per-document budget; "tfidf" keeps the top-2-per-page heuristic.
+PARAGRAPH_SELECTION = os.getenv("PARAGRAPH_SELECTION", "embedding")
+INSIGHTS_PER_PAGE = float(os.getenv("INSIGHTS_PER_PAGE", "0.5"))
+INSIGHT_BUDGET_MIN = int(os.getenv("INSIGHT_BUDGET_MIN", "5"))
+INSIGHT_BUDGET_MAX = int(os.getenv("INSIGHT_BUDGET_MAX", "60"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))  # 1 = pure centrality, 0 = pure diversity
+MIN_PARAGRAPH_WORDS = 15
 
 
-def select_important_paragraphs(pages: List[Dict]) -> List[Dict]:
+def select_important_paragraphs(pages: List[Dict], term_index: Optional[TermIndex] = None) -> List[Dict]:
     """
     Select top paragraphs per page for insight generation.
-    Returns: [{pageNumber, text, blocks}]
+    Blocks are ranked by TF-IDF from a TermIndex built once over the whole
+    document (pass one in to reuse it). Returns: [{pageNumber, text, blocks}]
     """
     page_count = len(pages)
-    all_texts = [b["text"] for p in pages for b in p["blocks"]]
+    if term_index is None:
+        term_index = TermIndex.from_pages(pages)
+    scores = term_index.tfidf_scores() if page_count >= 10 else None
     selected = []
 
+    block_offset = 0
     for page in pages:
-        blocks = [b for b in page["blocks"] if len(b["text"].split()) > 15]
-        if not blocks:
-            blocks = page["blocks"][:2]  # fallback
+        page_blocks = page["blocks"]
+        ids = [i for i, b in enumerate(page_blocks) if len(b["text"].split()) > MIN_PARAGRAPH_WORDS]
+        if not ids:
+            ids = list(range(min(2, len(page_blocks))))  # fallback
 
-        if page_count < 10:
+        if scores is None:
             # Analyze all blocks
-            candidates = blocks
+            candidates = ids
         else:
             # Top 2 by TF-IDF
-            scored = sorted(
-                blocks,
-                key=lambda b: _tfidf_score(b["text"], all_texts),
-                reverse=True,
-            )
-            candidates = scored[:2]
+            candidates = sorted(ids, key=lambda i: scores[block_offset + i], reverse=True)[:2]
 
-        for block in candidates:
+        for i in candidates:
             selected.append({
                 "pageNumber": page["pageNumber"],
-                "text": block["text"],
-                "blocks": page["blocks"],
+                "text": page_blocks[i]["text"],
+                "blocks": page_blocks,
             })
+        block_offset += len(page_blocks)
 
     return selected
 
 
+def insight_budget(page_count: int) -> int:
+    """Number of paragraphs a document of this length gets insights for."""
+    budget = round(INSIGHTS_PER_PAGE * page_count)
+    return max(INSIGHT_BUDGET_MIN, min(INSIGHT_BUDGET_MAX, budget))
+
+
+def _mmr_order(vectors: np.ndarray, budget: int, lam: float, centroid: Optional[np.ndarray] = None,
+               chosen: Optional[np.ndarray] = None) -> List[int]:
+    """
+    Greedy maximal marginal relevance over L2-normalised rows: relevance is
+    similarity to `centroid` (default: the mean row), redundancy is the max
+    similarity to anything already picked, starting with the `chosen` rows.
+    O(budget * n).
+    """
+    if centroid is None:
+        centroid = vectors.mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    relevance = vectors @ (centroid / norm) if norm > 0 else np.zeros(len(vectors))
+    redundancy = np.full(len(vectors), -1.0)
+    if chosen is not None and len(chosen):
+        redundancy = (vectors @ chosen.T).max(axis=1)
+    available = np.ones(len(vectors), dtype=bool)
+    picked = []
+    for _ in range(min(budget, len(vectors))):
+        scores = np.where(available, lam * relevance - (1 - lam) * np.maximum(redundancy, 0), -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return picked
+
+
+class EmbeddingParagraphSelector:
+    """
+    Embedding-based paragraph selection over chunks that arrive in page
+    batches, so insight generation can start before the whole document is
+    embedded. Uses the chunk embeddings already computed for RAG (no extra
+    encoding); each candidate chunk contributes its highest TF-IDF block.
+
+    Each add() picks the batch's share of the document budget (pro rata to
+    the pages read so far) by MMR: relevance to the centroid of the
+    candidates seen so far, redundancy against everything already picked.
+    finish() picks whatever budget is left. Chunks must carry the blockIds
+    chunk_pages() gave them; without them (e.g. an old checkpoint) finish()
+    falls back to select_important_paragraphs().
+    """
+
+    def __init__(self, pages: List[Dict], term_index: Optional[TermIndex] = None,
+                 budget: Optional[int] = None):
+        self.pages = pages
+        self.term_index = term_index if term_index is not None else TermIndex.from_pages(pages)
+        self.budget = budget if budget is not None else insight_budget(len(pages))
+        self._pages_by_number = {page["pageNumber"]: page for page in pages}
+        self._block_offsets, offset = {}, 0
+        for page in pages:
+            self._block_offsets[page["pageNumber"]] = offset
+            offset += len(page["blocks"])
+        self._block_scores = self.term_index.tfidf_scores()
+        self._vectors: List[np.ndarray] = []
+        self._blocks: List[Tuple[int, int]] = []  # (pageNumber, block) per candidate
+        self._seen: set = set()
+        self._picked: List[int] = []
+        self._last_page = 0
+        self._fallback = False
+
+    def add(self, chunks: List[Dict], last: bool = False) -> List[Dict]:
+        """Newly picked paragraphs ([{pageNumber, text, blocks}], reading order) for a batch of chunks."""
+        if self._fallback or any(chunk.get("blockIds") is None for chunk in chunks):
+            self._fallback = True
+            return []
+        for chunk in chunks:
+            page_num = chunk["pageNumber"]
+            self._last_page = max(self._last_page, page_num)
+            page_blocks = self._pages_by_number[page_num]["blocks"]
+            eligible = [i for i in chunk["blockIds"] if len(page_blocks[i]["text"].split()) > MIN_PARAGRAPH_WORDS]
+            if not eligible:
+                continue  # no substantial block: not a candidate
+            base = self._block_offsets[page_num]
+            best = max(eligible, key=lambda i: self._block_scores[base + i])
+            if (page_num, best) in self._seen:
+                continue  # overlapping chunks that yield the same block count once
+            self._seen.add((page_num, best))
+            self._vectors.append(normalize_rows(np.asarray(chunk["embedding"], dtype=np.float32)))
+            self._blocks.append((page_num, best))
+        share = self.budget if last else round(self.budget * self._last_page / max(1, len(self.pages)))
+        return self._pick(min(share, self.budget) - len(self._picked))
+
+    def finish(self) -> List[Dict]:
+        """The rest of the budget once every chunk was added."""
+        if not self._picked and (self._fallback or not self._vectors):
+            return select_important_paragraphs(self.pages, self.term_index)
+        if self._fallback:
+            return []
+        return self._pick(self.budget - len(self._picked))
+
+    def _pick(self, count: int) -> List[Dict]:
+        if count <= 0 or len(self._picked) == len(self._vectors):
+            return []
+        vectors = np.stack(self._vectors)
+        available = np.ones(len(vectors), dtype=bool)
+        available[self._picked] = False
+        rows = np.flatnonzero(available)
+        chosen = vectors[self._picked] if self._picked else None
+        order = _mmr_order(vectors[rows], count, MMR_LAMBDA, centroid=vectors.mean(axis=0), chosen=chosen)
+        picked = sorted(int(rows[j]) for j in order)
+        self._picked.extend(picked)
+
+        selected = []
+        for j in picked:
+            page_num, block = self._blocks[j]
+            page_blocks = self._pages_by_number[page_num]["blocks"]
+            selected.append({"pageNumber": page_num, "text": page_blocks[block]["text"], "blocks": page_blocks})
+        return selected
+
+
+def select_paragraphs_by_embedding(pages: List[Dict], chunks: List[Dict],
+                                   term_index: Optional[TermIndex] = None,
+                                   budget: Optional[int] = None) -> List[Dict]:
+    """
+    Pick up to `budget` paragraphs for the whole document at once with an
+    EmbeddingParagraphSelector. Returns: [{pageNumber, text, blocks}] in reading order.
+    """
+    selector = EmbeddingParagraphSelector(pages, term_index, budget)
+    return selector.add(chunks, last=True) + selector.finish()
+
+
 # ── PDF Annotation ────────────────────────────────────────────────────────────
 
-def annotate_pdf(original_path: str, insights: List[Dict], output_path: str):
+# "full" rewrites the whole file, "incremental" appends the annotations to the
+# original bytes, "overlay" skips the PDF and returns the highlights as JSON
+ANNOTATION_MODE = os.getenv("ANNOTATION_MODE", "full")
+HIGHLIGHT_COLOR = [1, 0.8, 0]  # RGB yellow
+HIGHLIGHT_OPACITY = 0.4
+
+
+def annotate_pdf(source: Union[str, DocumentSession], insights: List[Dict], output_path: str,
+                 incremental: bool = False):
     """
     Add highlight annotations to PDF for each insight's bboxes.
     insights: [{pageNumber, highlights: [{text, bbox: {x0,y0,x1,y1}}]}]
+    `source` is a file path or the job's open DocumentSession (annotated in place).
     
     IMPORTANT: Uses page.add_highlight_annot() to add annotations as metadata 
     objects that sit 'over' the text without flattening. Saves with clean=False 
     to preserve the original searchable text layer.
+
+    With incremental=True the original bytes are copied to output_path and
+    only the new annotation objects are appended (no rewrite/recompression);
+    files MuPDF had to repair can't be appended to and get a full save instead.
     """
-    doc = fitz.open(original_path)
+    if incremental:
+        try:
+            _annotate_incremental(source, insights, output_path)
+            return
+        except Exception as e:
+            logger.warning('incremental annotation failed, doing a full save: %s', e)
+
+    if isinstance(source, DocumentSession):
+        with source.lock:
+            _add_highlights(source.doc, insights, page=source.page)
+            _save_full(source.doc, output_path)
+        return
+    doc = fitz.open(source)
+    try:
+        _add_highlights(doc, insights, page=lambda i: doc[i])
+        _save_full(doc, output_path)
+    finally:
+        doc.close()
+
+
+def _annotate_incremental(source: Union[str, DocumentSession], insights: List[Dict], output_path: str):
+    # MuPDF only appends to a document opened from the file being written
+    if isinstance(source, DocumentSession):
+        with open(output_path, "wb") as f:
+            f.write(source.data)
+    else:
+        shutil.copyfile(source, output_path)
+    doc = fitz.open(output_path)
+    try:
+        if not doc.can_save_incrementally():
+            raise ValueError("document was repaired on open")
+        _add_highlights(doc, insights, page=lambda i: doc[i])
+        doc.saveIncr()
+    finally:
+        doc.close()
+
 
+def _add_highlights(doc: fitz.Document, insights: List[Dict], page):
     for insight in insights:
         page_num = insight["pageNumber"] - 1  # 0-indexed
         if page_num < 0 or page_num >= len(doc):
             continue
 
-        page = doc[page_num]
+        pdf_page = page(page_num)
         for hl in insight.get("highlights", []):
             bbox = hl.get("bbox")
             if not bbox:
@@ -187,19 +703,21 @@ def annotate_pdf(original_path: str, insights: List[Dict], output_path: str):
                 rect = fitz.Rect(bbox["x0"], bbox["y0"], bbox["x1"], bbox["y1"])
                 
                 # Add highlight annotation (sits above text as metadata)
-                highlight = page.add_highlight_annot(rect)
+                highlight = pdf_page.add_highlight_annot(rect)
                 
                 # Set yellow color with some transparency
-                highlight.set_colors(stroke=[1, 0.8, 0])  # RGB yellow
+                highlight.set_colors(stroke=HIGHLIGHT_COLOR)
                 
                 # Optional: set opacity for better visibility
-                highlight.set_opacity(0.4)
+                highlight.set_opacity(HIGHLIGHT_OPACITY)
                 
                 # Update the annotation to apply changes
                 highlight.update()
             except Exception as e:
                 print(f"Annotation error on page {page_num + 1}: {e}")
 
+
+def _save_full(doc: fitz.Document, output_path: str):
     # Save with options that preserve text layer and don't flatten
     # clean=False: Don't remove unused objects (preserves structure)
     # deflate=True: Compress streams for smaller file size
@@ -213,4 +731,34 @@ def annotate_pdf(original_path: str, insights: List[Dict], output_path: str):
         pretty=False,
         linear=False,
     )
-    doc.close()
+
+
+def annotation_overlay(session: DocumentSession, insights: List[Dict]) -> Dict:
+    """
+    The highlights annotate_pdf would draw, as JSON for the viewer to render
+    over the original PDF. Boxes are in PDF points from the page's top-left
+    corner, like the insight bboxes; `insight` indexes into `insights`.
+    """
+    pages: Dict[int, Dict] = {}
+    for n, insight in enumerate(insights):
+        page_num = insight["pageNumber"] - 1
+        if page_num < 0 or page_num >= session.page_count:
+            continue
+        entry = pages.get(page_num)
+        if entry is None:
+            with session.lock:
+                rect = session.page(page_num).rect
+            entry = pages[page_num] = {
+                "pageNumber": page_num + 1,
+                "width": round(rect.width, 2),
+                "height": round(rect.height, 2),
+                "highlights": [],
+            }
+        for hl in insight.get("highlights", []):
+            if hl.get("bbox"):
+                entry["highlights"].append({"insight": n, "text": hl.get("text", ""), "bbox": hl["bbox"]})
+    return {
+        "color": HIGHLIGHT_COLOR,
+        "opacity": HIGHLIGHT_OPACITY,
+        "pages": [pages[k] for k in sorted(pages) if pages[k]["highlights"]],
+    }
@@ -0,0 +1,545 @@
+import os
+import asyncio
+import hashlib
+import threading
+import requests
+import logging
+from typing import Callable, Dict, List, Optional
+
+from pdf_processor import (
+    iter_page_batches,
+    chunk_pages,
+    select_important_paragraphs,
+    EmbeddingParagraphSelector,
+    annotate_pdf,
+    annotation_overlay,
+    ANNOTATION_MODE,
+    PARAGRAPH_SELECTION,
+    INSIGHTS_PER_PAGE,
+    INSIGHT_BUDGET_MIN,
+    INSIGHT_BUDGET_MAX,
+    MMR_LAMBDA,
+    CHUNK_OVERLAP_TOKENS,
+    chunk_token_limit,
+)
+from embeddings import embed_texts, count_tokens, max_input_tokens, MODEL_ID as EMBEDDING_MODEL
+from llm import (
+    generate_insights_batch,
+    plan_batches,
+    llm_limiter,
+    FALLBACK_INSIGHT,
+    MODEL as LLM_MODEL,
+    PROMPT_VERSION,
+)
+from highlight_mapper import PageTextIndex, map_highlights_to_bboxes
+from checkpoints import (
+    Checkpoint,
+    CheckpointStore,
+    SOURCE as CP_SOURCE,
+    PAGES as CP_PAGES,
+    CHUNKS as CP_CHUNKS,
+    INSIGHTS as CP_INSIGHTS,
+    HIGHLIGHTS as CP_HIGHLIGHTS,
+    ANNOTATED as CP_ANNOTATED,
+)
+from doc_cache import DocumentCache, document_key
+from document_session import DocumentSession
+from vector_index import VectorIndex
+from term_index import TermIndex
+from batching import length_buckets
+from schemas import ProcessRequest
+from jobs import JobStore, JOB_STATE_DIR
+from wire_format import result_events, summary_event
+from uploads import AnnotatedUploader, PENDING as UPLOAD_PENDING, DONE as UPLOAD_DONE
+
+logger = logging.getLogger('worker')
+
+UPLOADTHING_SECRET = os.getenv("UPLOADTHING_SECRET", "")
+# Chunk embedding batches: at most this many chunks, and at most this many
+# padded tokens (chunks x longest chunk), so short chunks go in bigger batches
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "8192"))
+
+
+# ── Concurrent insight generation ────────────────────────────────────────────
+
+def _insight_key(paragraph: dict) -> str:
+    """Checkpoint key of a paragraph's insight (by content: selection order may differ on a retry)."""
+    digest = hashlib.sha1(paragraph["text"].encode("utf-8")).hexdigest()[:16]
+    return f'{paragraph["pageNumber"]}:{digest}'
+
+
+async def _generate_insights_for_batch(
+    indices: List[int],
+    paragraphs: List[dict],
+    done: Dict[str, dict],
+    checkpoint: Checkpoint,
+) -> List[dict]:
+    """
+    Run one batched LLM call. Concurrency across all documents is governed by
+    the shared adaptive limiter in llm.py, not per document. Paragraphs already
+    in the checkpoint are skipped; successful results are checkpointed so a
+    retried job skips them.
+    """
+    keys = {i: _insight_key(paragraphs[i]) for i in indices}
+    pending = [i for i in indices if keys[i] not in done]
+    fresh: Dict[int, dict] = {}
+
+    if pending:
+        pages = [paragraphs[i].get('pageNumber') for i in pending]
+        logger.info('generating %d insights for pages=%s', len(pending), pages)
+        try:
+            llm_results = await generate_insights_batch([paragraphs[i]["text"] for i in pending])
+        except Exception as e:
+            logger.warning('LLM failed for pages=%s: %s', pages, e)
+            llm_results = [{"insight": "", "highlights": []} for _ in pending]
+
+        for i, llm_result in zip(pending, llm_results):
+            result = {
+                "pageNumber": paragraphs[i]["pageNumber"],
+                "insightText": llm_result.get("insight", ""),
+                "rawHighlights": llm_result.get("highlights", []),
+            }
+            fresh[i] = result
+            if result["insightText"] and result["insightText"] != FALLBACK_INSIGHT:
+                done[keys[i]] = result
+        # Snapshot: other batches keep adding to `done` while this one is written
+        await asyncio.to_thread(checkpoint.save_json, CP_INSIGHTS, dict(done))
+
+    return [done[keys[i]] if keys[i] in done else fresh[i] for i in indices]
+
+
+# ── Pipeline stages ──────────────────────────────────────────────────────────
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))  # LLM batches buffered ahead of highlight mapping
+_END = object()
+
+# Receives progress events: {"type": "chunks"|"insight"|"summary", ...}
+Emit = Callable[[dict], None]
+
+
+def _no_emit(event: dict):
+    pass
+
+
+async def _extract_stage(req: ProcessRequest, session: DocumentSession, checkpoint: Checkpoint,
+                         out: asyncio.Queue) -> List[Dict]:
+    """
+    Step 2: extract text + bounding boxes. Page batches are pushed into `out`
+    as soon as each shard is done; returns every page once the document is
+    read. Extraction doesn't wait for the embedding stage: every page is kept
+    for the checkpoint anyway, and paragraph selection needs them all (the
+    TF-IDF index) before it can start feeding the LLM.
+    """
+    pages = await asyncio.to_thread(checkpoint.load_json, CP_PAGES)
+    if pages is not None:
+        logger.info('[%s] Resuming: %d pages already extracted', req.documentId, len(pages))
+        await out.put(pages)
+        await out.put(_END)
+        return pages
+
+    logger.info('[%s] Extracting text...', req.documentId)
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    pages = []
+
+    def produce():
+        for batch in iter_page_batches(session):
+            if stop.is_set():  # the job was cancelled or failed
+                return
+            pages.extend(batch)
+            loop.call_soon_threadsafe(out.put_nowait, batch)
+
+    try:
+        await asyncio.to_thread(produce)
+    finally:
+        stop.set()
+    await asyncio.to_thread(checkpoint.save_json, CP_PAGES, pages)
+    await out.put(_END)
+    return pages
+
+
+def _public_chunks(chunks: List[Dict]) -> List[Dict]:
+    return [{k: v for k, v in chunk.items() if k != "blockIds"} for chunk in chunks]
+
+
+async def _embed_stage(req: ProcessRequest, checkpoint: Checkpoint, pages_in: asyncio.Queue,
+                       chunks_out: asyncio.Queue, emit: Emit) -> List[Dict]:
+    """
+    Steps 3 & 4: chunk and embed each page batch as it arrives, emitting its
+    chunks and passing them on to paragraph selection through `chunks_out`
+    (unbounded: selection first waits for the whole extraction).
+    """
+    chunks = await asyncio.to_thread(checkpoint.load_json, CP_CHUNKS)
+    resumed = chunks is not None
+    if resumed:
+        logger.info('[%s] Resuming: %d chunks already embedded', req.documentId, len(chunks))
+        emit({"type": "chunks", "chunks": _public_chunks(chunks)})
+        chunks_out.put_nowait(chunks)
+    else:
+        chunks = []
+        logger.info('[%s] Chunking + embedding...', req.documentId)
+        # Needs the loaded model; kept off the event loop in case it is still loading
+        token_limit = await asyncio.to_thread(max_input_tokens)
+
+    while True:
+        batch = await pages_in.get()
+        if batch is _END:
+            break
+        if resumed:
+            continue  # drain only
+        raw_chunks = await asyncio.to_thread(chunk_pages, batch, count_tokens, token_limit)
+
+        # Encode in length-sorted buckets (little padding), then put the
+        # vectors back in document order
+        embeddings = [None] * len(raw_chunks)
+        buckets = length_buckets([c["tokens"] for c in raw_chunks], EMBED_BATCH_SIZE, EMBED_BATCH_TOKENS)
+        for bucket in buckets:
+            vectors = await asyncio.to_thread(embed_texts, [raw_chunks[i]["text"] for i in bucket])
+            for i, vector in zip(bucket, vectors):
+                embeddings[i] = vector
+        batch_chunks = [
+            {
+                "text": chunk["text"],
+                "embedding": embedding,
+                "pageNumber": chunk["pageNumber"],
+                "blockIds": chunk["blockIds"],  # for paragraph selection; not returned
+            }
+            for chunk, embedding in zip(raw_chunks, embeddings)
+        ]
+        chunks.extend(batch_chunks)
+        if batch_chunks:
+            emit({"type": "chunks", "chunks": _public_chunks(batch_chunks)})
+            chunks_out.put_nowait(batch_chunks)
+    chunks_out.put_nowait(_END)
+
+    if not resumed:
+        logger.info('[%s] embedded %d chunks', req.documentId, len(chunks))
+        await asyncio.to_thread(checkpoint.save_json, CP_CHUNKS, chunks)
+    return chunks
+
+
+def _map_insight_highlights(insights: List[dict], pages_by_number: Dict[int, dict],
+                            indexes: Dict[int, PageTextIndex], session: DocumentSession):
+    """
+    Map raw highlight phrases to precise bbox coordinates using each page's
+    in-memory text index (built on first use from the extracted word boxes).
+    Pages checkpointed without word boxes are searched on the session's
+    already-open page instead.
+    """
+    for insight in insights:
+        page_number = insight.get("pageNumber", 0)
+        raw_highlights = insight.pop("rawHighlights", [])
+
+        page = pages_by_number.get(page_number)
+        if page is None:
+            insight["highlights"] = []
+            continue
+
+        index = indexes.get(page_number)
+        if index is None and "words" in page:
+            index = indexes[page_number] = PageTextIndex(page["words"])
+        if index is not None:
+            insight["highlights"] = map_highlights_to_bboxes(raw_highlights, page["blocks"], page_index=index)
+            continue
+        with session.lock:
+            insight["highlights"] = map_highlights_to_bboxes(
+                raw_highlights,
+                page["blocks"],
+                page=session.page(page_number - 1),
+            )
+
+
+async def _insight_stage(req: ProcessRequest, session: DocumentSession, checkpoint: Checkpoint,
+                         pages_task: asyncio.Task, chunks_in: asyncio.Queue, emit: Emit) -> List[dict]:
+    """
+    Steps 5-7: select paragraphs, generate insights and map highlights.
+    Selection starts as soon as extraction finishes, overlapping the
+    embedding stage: TF-IDF selection at once, embedding selection per
+    embedded page batch. Paragraphs go to the LLM as they are selected,
+    each LLM batch is handed to highlight mapping the moment it returns,
+    and every mapped insight is emitted right away.
+    """
+    insights = await asyncio.to_thread(checkpoint.load_json, CP_HIGHLIGHTS)
+    if insights is not None:
+        logger.info('[%s] Resuming: %d insights already mapped', req.documentId, len(insights))
+        for insight in insights:
+            emit({"type": "insight", "insight": insight})
+        return insights
+
+    # ── Step 5: Select important paragraphs ──────────────────────────────
+    pages = await pages_task
+    logger.info('[%s] Selecting key paragraphs...', req.documentId)
+    term_index = await asyncio.to_thread(TermIndex.from_pages, pages)
+    done = await asyncio.to_thread(checkpoint.load_json, CP_INSIGHTS) or {}
+    checkpointed = len(done)
+
+    # ── Steps 6 & 7: Generate insights and map highlights concurrently ───
+    important_paragraphs: List[dict] = []
+    pages_by_number = {p["pageNumber"]: p for p in pages}
+    page_indexes: Dict[int, PageTextIndex] = {}
+    generated: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    producers: List[asyncio.Task] = []
+
+    async def generate(batch: List[int]):
+        try:
+            results = await _generate_insights_for_batch(batch, important_paragraphs, done, checkpoint)
+        except Exception as e:
+            await generated.put(e)  # surface it to the mapping loop instead of leaving it waiting
+            return
+        await generated.put(list(zip(batch, (dict(r) for r in results))))
+
+    def dispatch(paragraphs: List[dict]):
+        # Pack paragraphs into batched requests; fire them all at once, the limiter admits them
+        start = len(important_paragraphs)
+        important_paragraphs.extend(paragraphs)
+        for batch in plan_batches([p["text"] for p in paragraphs]):
+            producers.append(asyncio.create_task(generate([start + i for i in batch])))
+
+    async def select():
+        try:
+            if PARAGRAPH_SELECTION == "embedding":
+                selector = await asyncio.to_thread(EmbeddingParagraphSelector, pages, term_index)
+                while (chunks := await chunks_in.get()) is not _END:
+                    dispatch(await asyncio.to_thread(selector.add, chunks))
+                dispatch(await asyncio.to_thread(selector.finish))
+            else:
+                dispatch(await asyncio.to_thread(select_important_paragraphs, pages, term_index))
+        except Exception as e:
+            await generated.put(e)
+            return
+        logger.info('[%s] selected %d paragraphs for insight (limit=%.1f, %d checkpointed)',
+                    req.documentId, len(important_paragraphs), llm_limiter.limit, checkpointed)
+        await generated.put(_END)
+
+    selecting = asyncio.create_task(select())
+    try:
+        mapped, handled, selected = [], 0, False
+        while not selected or handled < len(producers):
+            ready = await generated.get()
+            if ready is _END:
+                selected = True
+                continue
+            if isinstance(ready, Exception):
+                raise ready
+            handled += 1
+            await asyncio.to_thread(
+                _map_insight_highlights,
+                [insight for _, insight in ready], pages_by_number, page_indexes, session,
+            )
+            mapped.extend(ready)
+            for _, insight in ready:
+                emit({"type": "insight", "insight": insight})
+        await asyncio.gather(*producers)
+    finally:
+        selecting.cancel()
+        for task in producers:
+            task.cancel()
+
+    # Re-sort by page number (then selection order) to maintain document order
+    mapped.sort(key=lambda item: (item[1]["pageNumber"], item[0]))
+    insights = [insight for _, insight in mapped]
+    await asyncio.to_thread(checkpoint.save_json, CP_HIGHLIGHTS, insights)
+    return insights
+
+
+# ── Main Processing Pipeline ──────────────────────────────────────────────────
+
+checkpoints = CheckpointStore()
+doc_cache = DocumentCache()
+vector_index = VectorIndex()
+# Upload state is shared with the other worker processes in multi-process mode
+uploader = AnnotatedUploader(store=JobStore(JOB_STATE_DIR, ProcessRequest) if JOB_STATE_DIR else None)
+
+
+def _selection_version() -> str:
+    """Selection settings that change which insights a document gets (part of the cache key)."""
+    if PARAGRAPH_SELECTION != "embedding":
+        return PARAGRAPH_SELECTION
+    # "stream": the budget is picked per page batch (EmbeddingParagraphSelector)
+    return f"embedding-stream:{INSIGHTS_PER_PAGE}:{INSIGHT_BUDGET_MIN}:{INSIGHT_BUDGET_MAX}:{MMR_LAMBDA}"
+
+
+def _chunking_version() -> str:
+    """Chunk sizing settings (part of the cache key: they change the stored chunks)."""
+    return f"tokens:{chunk_token_limit(max_input_tokens())}:{CHUNK_OVERLAP_TOKENS}"
+
+
+def _document_key(pdf_bytes: bytes) -> str:
+    """Document cache key; reads the model's input limit, so call it off the event loop."""
+    return document_key(
+        pdf_bytes, EMBEDDING_MODEL, LLM_MODEL, PROMPT_VERSION, _selection_version(), _chunking_version()
+    )
+
+
+async def _start_upload(req: ProcessRequest, annotated_path: str, cache_key: str, copy: bool = False) -> str:
+    """
+    Hand the annotated PDF to the background uploader; the URL reaches the
+    backend later (job status / callback) and is remembered in the document cache.
+    """
+    logger.info('[%s] Uploading annotated PDF in the background...', req.documentId)
+    await uploader.submit(
+        req.documentId,
+        annotated_path,
+        f"annotated_{req.documentId}.pdf",
+        on_done=lambda url: doc_cache.set_annotated_url(cache_key, url),
+        copy=copy,
+    )
+    return UPLOAD_PENDING
+
+
+async def _annotate(req: ProcessRequest, session: DocumentSession, insights: List[dict],
+                    checkpoint: Checkpoint, mode: str) -> str:
+    """Step 8: write the annotated PDF into the checkpoint; returns its path."""
+    output = checkpoint.path(CP_ANNOTATED)
+    if await asyncio.to_thread(checkpoint.has, CP_ANNOTATED):
+        logger.info('[%s] Resuming: PDF already annotated', req.documentId)
+        return output
+    logger.info('[%s] Annotating PDF (%s)...', req.documentId, mode)
+    partial_output = output + ".partial"
+    await asyncio.to_thread(annotate_pdf, session, insights, partial_output, mode == "incremental")
+    await asyncio.to_thread(os.replace, partial_output, output)
+    return output
+
+
+async def run_pipeline(req: ProcessRequest, emit: Optional[Emit] = None) -> dict:
+    """
+    Full document processing pipeline.
+    Raises on failure; the HTTP layer decides how to surface the error.
+
+    `emit` receives chunk batches and insights as they finish, then a final
+    summary, so callers can stream results instead of waiting for the end.
+
+    Each stage's output is checkpointed under the documentId, so a retry
+    after a late failure resumes from the last completed stage. The
+    checkpoint is removed once the pipeline succeeds.
+
+    In "overlay" annotation mode no PDF is written or uploaded; the result
+    carries `annotationOverlay` and annotatedFileUrl is the original file.
+    Otherwise the annotated PDF is uploaded in the background: the result
+    still points at the original file, with annotatedUploadStatus PENDING,
+    and the uploaded URL is reported through the job status and a callback
+    to the backend.
+    """
+    logger.info('[%s] process start', req.documentId)
+    emit = emit or _no_emit
+    mode = req.annotationMode or ANNOTATION_MODE
+    await asyncio.to_thread(checkpoints.cleanup_expired)
+    checkpoint = await asyncio.to_thread(checkpoints.open, req.documentId, req.fileUrl)
+
+    # ── Step 1: Download PDF ──────────────────────────────────────────────
+    pdf_bytes = await asyncio.to_thread(checkpoint.load_bytes, CP_SOURCE)
+    downloaded = pdf_bytes is None
+    if not downloaded:
+        logger.info('[%s] Resuming: PDF already downloaded', req.documentId)
+    else:
+        logger.info('[%s] Downloading PDF...', req.documentId)
+        pdf_response = await asyncio.to_thread(requests.get, req.fileUrl, timeout=60)
+        pdf_response.raise_for_status()
+        pdf_bytes = pdf_response.content
+
+    # ── Identical PDF already processed? ──────────────────────────────────
+    cache_key = await asyncio.to_thread(_document_key, pdf_bytes)
+    cached = await asyncio.to_thread(doc_cache.get, cache_key)
+    if cached is not None:
+        logger.info('[%s] document cache hit (%s)', req.documentId, cache_key[:12])
+        annotated_url = upload_status = None
+        if mode != "overlay":
+            annotated_url = cached.get("annotatedFileUrl")
+            if annotated_url:
+                upload_status = UPLOAD_DONE
+            elif cached.get("annotatedPath"):
+                upload_status = await _start_upload(req, cached["annotatedPath"], cache_key, copy=True)
+            else:
+                # Cached by an overlay-mode run: the PDF was never written
+                session = await asyncio.to_thread(DocumentSession, pdf_bytes)
+                try:
+                    annotated_path = await _annotate(req, session, cached["insights"], checkpoint, mode)
+                finally:
+                    await asyncio.to_thread(session.close)
+                upload_status = await _start_upload(req, annotated_path, cache_key)
+        await asyncio.to_thread(checkpoint.clear)
+        await asyncio.to_thread(vector_index.upsert, req.projectId, req.documentId, cached["chunks"])
+        result = {
+            "pageCount": cached["pageCount"],
+            "chunks": cached["chunks"],
+            "insights": cached["insights"],
+            "annotatedFileUrl": annotated_url or req.fileUrl,
+        }
+        if upload_status:
+            result["annotatedUploadStatus"] = upload_status
+        if mode == "overlay":
+            result["annotationOverlay"] = cached["annotationOverlay"]
+        for event in result_events(result):
+            emit(event)
+        return result
+
+    # Checkpointed so a retry skips the download (the process pools read this file too)
+    if downloaded:
+        await asyncio.to_thread(checkpoint.save_bytes, CP_SOURCE, pdf_bytes)
+
+    # One parse of the PDF serves extraction, highlight mapping and annotation
+    session = await asyncio.to_thread(DocumentSession, pdf_bytes, checkpoint.path(CP_SOURCE))
+    del pdf_bytes
+    try:
+        # ── Steps 2-7: Overlapped stages ─────────────────────────────────
+        # Extraction streams page batches into chunking/embedding while selection,
+        # LLM calls and highlight mapping run as soon as their inputs exist.
+        page_queue: asyncio.Queue = asyncio.Queue()
+        chunk_queue: asyncio.Queue = asyncio.Queue()
+        stages = [
+            asyncio.create_task(_extract_stage(req, session, checkpoint, page_queue)),
+            asyncio.create_task(_embed_stage(req, checkpoint, page_queue, chunk_queue, emit)),
+        ]
+        stages.append(asyncio.create_task(_insight_stage(
+            req, session, checkpoint, pages_task=stages[0], chunks_in=chunk_queue, emit=emit
+        )))
+        try:
+            pages, chunks, insights = await asyncio.gather(*stages)
+        except BaseException:
+            for task in stages:
+                task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            raise
+        page_count = len(pages)
+
+        # ── Step 8: Annotate PDF ──────────────────────────────────────────
+        # The overlay is cheap and cached either way, so any mode can be served on a hit
+        overlay = await asyncio.to_thread(annotation_overlay, session, insights)
+        annotated_path = None
+        if mode != "overlay":
+            annotated_path = await _annotate(req, session, insights, checkpoint, mode)
+    finally:
+        await asyncio.to_thread(session.close)
+
+    # ── Step 9: Return results ────────────────────────────────────────────
+    logger.info('[%s] processing complete pageCount=%s chunks=%s insights=%s',
+                req.documentId, page_count, len(chunks), len(insights))
+
+    # Until the background upload finishes, the viewer shows the original file
+    result = {
+        "pageCount": page_count,
+        "chunks": _public_chunks(chunks),
+        "insights": insights,
+        "annotatedFileUrl": req.fileUrl,
+    }
+    if mode == "overlay":
+        result["annotationOverlay"] = overlay
+    try:
+        # The upload's URL is added to the entry once it lands
+        await asyncio.to_thread(
+            doc_cache.put, cache_key,
+            {**result, "annotatedFileUrl": None, "annotationOverlay": overlay}, annotated_path
+        )
+    except Exception as e:
+        logger.warning('[%s] could not write document cache: %s', req.documentId, e)
+
+    # ── Upload annotated PDF (background) ─────────────────────────────────
+    # Moves the file out of the checkpoint, so this must precede clear()
+    if annotated_path:
+        result["annotatedUploadStatus"] = await _start_upload(req, annotated_path, cache_key)
+
+    await asyncio.to_thread(checkpoint.clear)
+    await asyncio.to_thread(vector_index.upsert, req.projectId, req.documentId, chunks)
+    emit(summary_event(result))
+    return result
@@ -0,0 +1,18 @@
+from typing import Literal, Optional
+from pydantic import BaseModel
+
+# Request models shared by main.py and pipeline.py. Kept free of heavy
+# imports so the app can define its routes before the pipeline is loaded.
+
+EmbeddingEncoding = Literal["json", "float32", "float16", "int8"]
+AnnotationMode = Literal["full", "incremental", "overlay"]
+
+
+class ProcessRequest(BaseModel):
+    documentId: str
+    projectId: str
+    fileUrl: str
+    # Wire format for chunk embeddings in the response (see wire_format.py)
+    embeddingEncoding: EmbeddingEncoding = "json"
+    # How highlights are delivered (see pdf_processor.annotate_pdf); defaults to ANNOTATION_MODE
+    annotationMode: Optional[AnnotationMode] = None
@@ -0,0 +1,186 @@
+"""
+Run the worker as one or more uvicorn processes on one port.
+
+    python serve.py [--host 0.0.0.0] [--port 8000] [--processes N]
+
+With WORKER_PROCESSES=1 (the default) this is plain `uvicorn main:app`. With
+more, the parent binds the socket, imports the pipeline and loads the
+embedding model once, then forks the workers, which share the listening
+socket and the model weights (copy-on-write). Each worker is pinned to its
+own slice of the CPUs the parent may use and runs that many intra-op
+threads, so N workers don't each start one thread per core. Workers that
+die are re-forked from the preloaded parent; SIGTERM/SIGINT stop them all.
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import importlib
+from typing import Dict, List
+
+from startup import available_cpus
+
+WORKER_HOST = os.getenv("WORKER_HOST", "0.0.0.0")
+WORKER_PORT = int(os.getenv("WORKER_PORT", "8000"))
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0"))  # intra-op threads per process; 0 = its CPU share
+WORKER_CPU_AFFINITY = os.getenv("WORKER_CPU_AFFINITY", "true").lower() not in ("0", "false", "no")
+WORKER_LOG_LEVEL = os.getenv("WORKER_LOG_LEVEL", "INFO")
+
+logger = logging.getLogger('worker.serve')
+
+
+def cpu_slices(cpus: List[int], processes: int) -> List[List[int]]:
+    """Split `cpus` into `processes` contiguous, near-equal slices (shared round-robin if fewer CPUs)."""
+    if processes >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(processes)]
+    base, extra = divmod(len(cpus), processes)
+    slices, start = [], 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        slices.append(cpus[start:start + size])
+        start += size
+    return slices
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _preload():
+    """Import everything heavy in the parent so forked workers share it."""
+    import embeddings
+    import llm
+
+    started = time.perf_counter()
+    main = importlib.import_module("main")
+    importlib.import_module("pipeline")
+    if embeddings.preloadable():
+        embeddings.get_backend()
+    # Keep the collector from touching (and so copying) every preloaded object in each child
+    gc.collect()
+    gc.freeze()
+    logger.info('preloaded pipeline and %s model in %.1fs', embeddings.EMBEDDING_BACKEND,
+                time.perf_counter() - started)
+    return main, embeddings, llm
+
+
+def _run_worker(index: int, sock: socket.socket, cpus: List[int], threads: int, modules):
+    """Body of a forked worker process; never returns."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    import uvicorn
+
+    main, embeddings, llm = modules
+    if WORKER_CPU_AFFINITY and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    embeddings.set_threads(threads)
+    # SQLite connections opened by the parent must not be used across fork
+    for cache in (embeddings.embedding_cache, llm.llm_cache):
+        if cache is not None:
+            cache.reopen()
+    logger.info('worker %d (pid %d) on CPUs %s with %d thread(s)', index, os.getpid(), cpus, threads)
+
+    config = uvicorn.Config(main.app, log_level=WORKER_LOG_LEVEL.lower())
+    code = 0
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    except Exception:
+        logger.exception('worker %d crashed', index)
+        code = 1
+    os._exit(code)
+
+
+def serve_forked(host: str, port: int, processes: int):
+    cpus = available_cpus()
+    slices = cpu_slices(cpus, processes)
+    threads = WORKER_THREADS or max(1, len(cpus) // processes)
+    # Libraries that read these at first use get the per-process count too
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ.setdefault(var, str(threads))
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    sock = _bind(host, port)
+    modules = _preload()
+    logger.info('listening on %s:%d with %d worker processes', host, port, processes)
+
+    children: Dict[int, int] = {}
+    started: Dict[int, float] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(index, sock, slices[index], threads, modules)
+        children[pid] = index
+        started[index] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(processes):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.warning('worker %d (pid %d) exited with status %d, restarting', index, pid, status)
+        if time.monotonic() - started[index] < 5:
+            time.sleep(1)  # don't spin on a worker that dies at startup
+        spawn(index)
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default=WORKER_HOST)
+    parser.add_argument("--port", type=int, default=WORKER_PORT)
+    parser.add_argument("--processes", type=int, default=WORKER_PROCESSES)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=WORKER_LOG_LEVEL,
+        format='[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s',
+    )
+    if args.processes <= 1:
+        import uvicorn
+
+        uvicorn.run("main:app", host=args.host, port=args.port, log_level=WORKER_LOG_LEVEL.lower())
+        return
+
+    # Job records go to disk so whichever process a poll lands on can answer it
+    if not os.getenv("JOB_STATE_DIR"):
+        import tempfile
+
+        os.environ["JOB_STATE_DIR"] = os.path.join(tempfile.gettempdir(), "mirage-jobs")
+    # Likewise the vector index: a search must see documents indexed by any process
+    if os.getenv("ANN_INDEX_DIR") == "":
+        parser.error("ANN_INDEX_DIR must not be empty with more than one process")
+    os.environ["VECTOR_INDEX_SHARED"] = "true"
+    serve_forked(args.host, args.port, args.processes)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
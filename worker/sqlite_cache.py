@@ -0,0 +1,135 @@
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+logger = logging.getLogger('worker.sqlite_cache')
+
+_SQL_BATCH = 500  # stay well below SQLite's host-parameter limit
+# Other worker processes write the same file, so the row count is re-read
+# from the database at least this often (seconds) and before evicting
+_RECOUNT_INTERVAL = 30.0
+
+
+class SQLiteCache:
+    """
+    Key/value cache in an SQLite file (WAL), shared by every worker process.
+
+    Subclasses name their table and value column, give the CREATE statements
+    (the table needs `key TEXT PRIMARY KEY` and a `last_used` column) and
+    decode values; they write through `_write()` and report how many rows
+    they may have added with `_added()`. Lookups are batched and refresh
+    `last_used`; once the table grows past max_entries the least-recently-used
+    tenth is evicted in one statement.
+    """
+
+    TABLE = ""
+    VALUE_COLUMN = ""
+    SCHEMA: Sequence[str] = ()
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connect()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        for statement in self.SCHEMA:
+            self._conn.execute(statement)
+        self._recount()
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # journal_mode=WAL is stored in the file
+
+    def reopen(self):
+        """
+        Replace the connection in a process forked after this cache was
+        created (serve.py); an SQLite connection must not cross a fork.
+        """
+        self._connect()
+
+    # ── Hooks ─────────────────────────────────────────────────────────────
+
+    def _decode(self, value: Any) -> Any:
+        return value
+
+    def _valid(self, now: float) -> Tuple[str, List[Any]]:
+        """Extra WHERE condition (and its parameters) a row must meet to count as a hit."""
+        return "", []
+
+    # ── Reads and writes ──────────────────────────────────────────────────
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        found: Dict[str, Any] = {}
+        if not keys:
+            return found
+        now = time.time()
+        condition, params = self._valid(now)
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, {self.VALUE_COLUMN} FROM {self.TABLE}"
+                    f" WHERE key IN ({placeholders}){condition}",
+                    [*batch, *params],
+                ).fetchall()
+                for key, value in rows:
+                    found[key] = self._decode(value)
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE {self.TABLE} SET last_used = ? WHERE key IN ({placeholders})",
+                        [now, *batch],
+                    )
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    @contextmanager
+    def _write(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        """One transaction under the cache lock, rolled back if the body raises."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                # Left open, the transaction would make every later BEGIN fail
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _added(self, rows: int):
+        """Account for up to `rows` new entries, evicting if the table is over budget."""
+        self._count += rows
+        if self._count > self.max_entries or time.monotonic() - self._counted_at > _RECOUNT_INTERVAL:
+            self._recount(evict=True)
+
+    # ── Size and eviction ─────────────────────────────────────────────────
+
+    def _recount(self, evict: bool = False):
+        # IMMEDIATE takes the write lock, so processes evicting at the same time don't all delete
+        with self._write(immediate=evict) as conn:
+            self._count = conn.execute(f"SELECT COUNT(*) FROM {self.TABLE}").fetchone()[0]
+            if evict and self._count > self.max_entries:
+                excess = self._count - self.max_entries + max(1, self.max_entries // 10)
+                conn.execute(
+                    f"DELETE FROM {self.TABLE} WHERE key IN ("
+                    f" SELECT key FROM {self.TABLE} ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._count = conn.execute(f"SELECT COUNT(*) FROM {self.TABLE}").fetchone()[0]
+                logger.info('evicted %s cache entries, %d remain', self.TABLE, self._count)
+        self._counted_at = time.monotonic()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger('worker.startup')
+
+PENDING = "PENDING"
+LOADING = "LOADING"
+READY = "READY"
+FAILED = "FAILED"
+
+
+class ComponentFailed(RuntimeError):
+    pass
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on (its affinity mask where the platform has one)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def process_start_ticks(pid="self") -> Optional[int]:
+    """When a process started, in clock ticks after boot (Linux); None if unknown or gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Field 22 (starttime); the command name in field 2 may contain spaces
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_age() -> float:
+    """Seconds since this process started (interpreter start, not module import); 0 if unknown."""
+    start_ticks = process_start_ticks()
+    if start_ticks is None:
+        return 0.0
+    try:
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+@dataclass
+class Component:
+    name: str
+    status: str = PENDING
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+
+    def to_status(self) -> dict:
+        return {
+            "status": self.status,
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+            "error": self.error,
+        }
+
+
+class StartupTracker:
+    """
+    Readiness of the parts of the worker that load in the background after
+    the server is up, plus a per-phase startup timeline.
+
+    Each component is loaded inside `phase(name)`, which times it and marks
+    it READY or FAILED; request handlers `await wait(name)` for the parts
+    they need. `mark(name)` records a timeline point that isn't a component
+    (e.g. when the server started accepting connections). Use from the event
+    loop thread, or before the loop starts (e.g. when preloading).
+    """
+
+    def __init__(self, components: Iterable[str]):
+        self.components: Dict[str, Component] = {name: Component(name) for name in components}
+        # Offset so every timestamp is relative to process start
+        self._origin = time.monotonic() - process_age()
+        self.timeline: Dict[str, float] = {"imported": self._elapsed()}
+        self._events: Dict[str, asyncio.Event] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _elapsed(self) -> float:
+        return time.monotonic() - self._origin
+
+    def _event(self, name: str) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._events = {}
+            self._loop = loop
+        if name not in self._events:
+            self._events[name] = asyncio.Event()
+        return self._events[name]
+
+    def mark(self, point: str):
+        self.timeline[point] = self._elapsed()
+
+    @contextmanager
+    def phase(self, name: str):
+        component = self.components[name]
+        component.status = LOADING
+        started = time.monotonic()
+        try:
+            yield component
+        except BaseException as e:
+            component.status = FAILED
+            component.error = str(e) or type(e).__name__
+            logger.exception('startup: %s failed', name)
+            raise
+        else:
+            component.status = READY
+        finally:
+            component.seconds = time.monotonic() - started
+            self.mark(name)
+            event = self._events.get(name) if self._loop is not None else None
+            if event is not None:
+                event.set()
+
+    def is_ready(self, *names: str) -> bool:
+        return all(self.components[n].status == READY for n in (names or self.components))
+
+    async def wait(self, name: str):
+        """Return once `name` is READY; raises ComponentFailed if it failed to load."""
+        component = self.components[name]
+        if component.status not in (READY, FAILED):
+            await self._event(name).wait()
+        if component.status == FAILED:
+            raise ComponentFailed(f"{name} failed to load: {component.error}")
+
+    def status(self) -> dict:
+        return {
+            "ready": self.is_ready(),
+            "components": {name: c.to_status() for name, c in self.components.items()},
+            "timeline": {point: round(t, 3) for point, t in self.timeline.items()},
+        }
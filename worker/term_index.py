@@ -0,0 +1,64 @@
+import re
+from typing import Dict, List
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class TermIndex:
+    """
+    Token-level index over a document's text blocks, built in one pass.
+
+    Holds the vocabulary and per-term document frequency, so TF-IDF scores
+    for every block come out of one vectorized pass. Matching is on whole
+    lowercase tokens.
+    """
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.vocab: Dict[str, int] = {}
+
+        token_ids: List[int] = []
+        lengths = np.zeros(len(texts), dtype=np.int64)
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[i] = len(tokens)
+            for token in tokens:
+                term_id = self.vocab.get(token)
+                if term_id is None:
+                    term_id = self.vocab[token] = len(self.vocab)
+                token_ids.append(term_id)
+
+        self.lengths = lengths
+        self.token_terms = np.asarray(token_ids, dtype=np.int64)
+        self.token_blocks = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+
+        # Distinct (term, block) pairs give document frequency
+        vocab_size = max(len(self.vocab), 1)
+        pairs = np.unique(self.token_terms * len(texts) + self.token_blocks) if len(texts) else np.empty(0, np.int64)
+        self.df = np.bincount(pairs // max(len(texts), 1), minlength=vocab_size)[:len(self.vocab)]
+
+        n = len(texts)
+        self.idf = (np.log((n + 1) / (self.df + 1)) + 1).astype(np.float64)
+
+    @classmethod
+    def from_pages(cls, pages: List[Dict]) -> "TermIndex":
+        return cls([b["text"] for p in pages for b in p["blocks"]])
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def tfidf_scores(self) -> np.ndarray:
+        """
+        TF-IDF score of every block: sum over its terms of (count / length) * idf,
+        i.e. the mean idf of its tokens.
+        """
+        if not len(self.texts):
+            return np.zeros(0)
+        totals = np.bincount(self.token_blocks, weights=self.idf[self.token_terms], minlength=len(self.texts))
+        return np.divide(totals, self.lengths, out=np.zeros(len(self.texts)), where=self.lengths > 0)
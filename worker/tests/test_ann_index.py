@@ -0,0 +1,114 @@
+"""
+AnnIndex: IVF recall against brute force, delta-log inserts and removals,
+compaction, and size() across both.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WORKER_DIR)
+
+import ann_index  # noqa: E402
+from ann_index import AnnIndex  # noqa: E402
+from vector_index import normalize_rows  # noqa: E402
+
+DIM = 32
+
+
+def _clustered(rng, n, clusters=40):
+    centers = rng.normal(size=(clusters, DIM))
+    return (centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, DIM))).astype(np.float32)
+
+
+def _docs(vectors, per_doc):
+    docs = {}
+    for start in range(0, len(vectors), per_doc):
+        rows = vectors[start:start + per_doc]
+        docs[f"doc{start // per_doc}"] = (
+            rows, [f"text {start + i}" for i in range(len(rows))], np.arange(len(rows)) + 1
+        )
+    return docs
+
+
+def _brute_force(docs, query, k, exclude=()):
+    q = normalize_rows(query.reshape(1, -1))[0]
+    scored = []
+    for doc, (vectors, texts, _) in docs.items():
+        if doc in exclude:
+            continue
+        for score, text in zip(normalize_rows(vectors) @ q, texts):
+            scored.append((float(score), text))
+    scored.sort(key=lambda s: -s[0])
+    return [text for _, text in scored[:k]]
+
+
+@pytest.fixture
+def corpus():
+    rng = np.random.default_rng(0)
+    vectors = _clustered(rng, 4000)
+    queries = vectors[rng.choice(len(vectors), 50, replace=False)] + 0.1 * rng.normal(size=(50, DIM))
+    return _docs(vectors, 100), queries.astype(np.float32)
+
+
+def test_probed_search_recall(tmp_path, corpus, monkeypatch):
+    docs, queries = corpus
+    monkeypatch.setattr(ann_index, "ANN_MIN_VECTORS", 0)  # probe lists even for a small index
+    index = AnnIndex(str(tmp_path))
+    index.build(docs)
+
+    k, hits = 10, 0
+    for query in queries:
+        found = [r["text"] for r in index.search(query, k, nprobe=16)]
+        hits += len(set(found) & set(_brute_force(docs, query, k)))
+    assert hits / (k * len(queries)) >= 0.9
+
+
+def test_small_index_is_exact(tmp_path, corpus):
+    docs, queries = corpus
+    index = AnnIndex(str(tmp_path))
+    index.build(docs)
+    for query in queries[:10]:
+        assert [r["text"] for r in index.search(query, 5)] == _brute_force(docs, query, 5)
+
+
+def test_insert_remove_compact_and_size(tmp_path, corpus, monkeypatch):
+    docs, queries = corpus
+    monkeypatch.setattr(ann_index, "ANN_DELTA_MAX_FRACTION", 1.0)  # keep inserts in the delta log
+    index = AnnIndex(str(tmp_path))
+    index.build(docs)
+    assert index.size() == 4000
+
+    rng = np.random.default_rng(1)
+    replacement = rng.normal(size=(3, DIM)).astype(np.float32)
+    index.insert("doc0", replacement, ["new a", "new b", "new c"], np.array([1, 1, 2]))
+    index.insert("extra", replacement[:1], ["extra a"], np.array([7]))
+    index.remove("doc1")
+    assert index.size() == 4000 - 100 + 3 - 100 + 1
+    assert "doc1" not in index.document_ids() and "extra" in index.document_ids()
+
+    # A replaced document only matches its new rows; a removed one never matches
+    hit = index.search(replacement[1], 1)[0]
+    assert (hit["documentId"], hit["text"]) == ("doc0", "new b")
+    assert all(r["documentId"] != "doc1" for r in index.search(queries[0], 50, document_ids=["doc1", "doc2"]))
+    before = [r["text"] for r in index.search(queries[0], 10)]
+
+    size = index.size()
+    index.compact()
+    assert not os.listdir(os.path.join(str(tmp_path), ann_index.DELTA))
+    assert index.size() == size
+    assert [r["text"] for r in index.search(queries[0], 10)] == before
+
+    # Other readers of the directory see the compacted segment
+    assert AnnIndex(str(tmp_path)).size() == size
+
+
+def test_search_filters_by_document(tmp_path, corpus):
+    docs, queries = corpus
+    index = AnnIndex(str(tmp_path))
+    index.build(docs)
+    results = index.search(queries[0], 5, document_ids=["doc3"])
+    assert results and all(r["documentId"] == "doc3" for r in results)
+    assert [r["text"] for r in results] == _brute_force({"doc3": docs["doc3"]}, queries[0], 5)
@@ -0,0 +1,125 @@
+"""
+MicroBatcher: concurrent submits share batches, each caller gets its own
+result back, and a failed batch fails every caller in it. length_buckets:
+encoder batches of similar length within the item and padded-token caps.
+"""
+import asyncio
+import os
+import sys
+
+import numpy as np
+import pytest
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WORKER_DIR)
+
+from batching import MicroBatcher, length_buckets  # noqa: E402
+
+
+async def _run(batcher, coro):
+    batcher.start()
+    try:
+        return await coro
+    finally:
+        await batcher.stop()
+
+
+def test_concurrent_submits_are_batched_and_answered_in_order():
+    batches = []
+
+    def double(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(double, max_batch_size=4, max_wait_ms=50)
+
+    async def main():
+        return await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+
+    results = asyncio.run(_run(batcher, main()))
+
+    assert results == [i * 2 for i in range(10)]
+    assert [len(b) for b in batches] == [4, 4, 2]
+    assert [item for b in batches for item in b] == list(range(10))
+    assert batcher.stats()["batches"] == 3 and batcher.stats()["items"] == 10
+
+
+def test_batch_closes_after_max_wait():
+    batcher = MicroBatcher(lambda items: items, max_batch_size=100, max_wait_ms=10)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await batcher.submit("x")
+        return result, loop.time() - start
+
+    result, elapsed = asyncio.run(_run(batcher, main()))
+    assert result == "x"
+    assert elapsed < 1.0
+
+
+def test_batch_error_fails_every_caller_and_later_batches_still_run():
+    def fail_on_bad(items):
+        if "bad" in items:
+            raise ValueError("bad input")
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(fail_on_bad, max_batch_size=3, max_wait_ms=50)
+
+    async def main():
+        failed = await asyncio.gather(
+            *(batcher.submit(item) for item in ("a", "bad", "c")), return_exceptions=True
+        )
+        ok = await asyncio.gather(batcher.submit("d"), batcher.submit("e"))
+        return failed, ok
+
+    failed, ok = asyncio.run(_run(batcher, main()))
+    assert len(failed) == 3
+    for error in failed:
+        assert isinstance(error, ValueError)
+    assert ok == ["D", "E"]
+
+
+def test_cancelled_callers_are_skipped():
+    seen = []
+
+    def record(items):
+        seen.extend(items)
+        return items
+
+    batcher = MicroBatcher(record, max_batch_size=10, max_wait_ms=50)
+
+    async def main():
+        gone = asyncio.create_task(batcher.submit("gone"))
+        kept = asyncio.create_task(batcher.submit("kept"))
+        await asyncio.sleep(0.01)
+        gone.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+        return await kept
+
+    assert asyncio.run(_run(batcher, main())) == "kept"
+    assert seen == ["kept"]
+
+
+def test_length_buckets_respect_item_and_padded_token_caps():
+    rng = np.random.default_rng(0)
+    lengths = [int(n) for n in rng.integers(1, 300, size=500)]
+    buckets = length_buckets(lengths, max_items=32, max_tokens=2048)
+
+    assert sorted(i for bucket in buckets for i in bucket) == list(range(len(lengths)))
+    for bucket in buckets:
+        assert len(bucket) <= 32
+        assert len(bucket) * max(lengths[i] for i in bucket) <= 2048
+    # Ascending lengths: short items travel in larger batches
+    widths = [max(lengths[i] for i in bucket) for bucket in buckets]
+    assert widths == sorted(widths)
+    assert len(buckets[0]) == 32 and len(buckets[-1]) < 32
+
+
+def test_length_buckets_edge_cases():
+    # An item wider than max_tokens still gets a batch of its own
+    assert length_buckets([5, 5000, 5], max_items=8, max_tokens=100) == [[0, 2], [1]]
+    # max_tokens=0 only caps the item count
+    assert length_buckets([300] * 5, max_items=2) == [[0, 1], [2, 3], [4]]
+    assert length_buckets([], max_items=4, max_tokens=100) == []
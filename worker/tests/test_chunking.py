@@ -0,0 +1,98 @@
+"""
+chunk_pages: chunks fit the token limit as measured by the given tokenizer,
+stay on their page, overlap by whole sentences and lose no text.
+"""
+import math
+import os
+import re
+import sys
+
+import numpy as np
+import pytest
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WORKER_DIR)
+
+import pdf_processor  # noqa: E402
+from pdf_processor import DEFAULT_CHUNK_TOKENS, chunk_pages, chunk_token_limit  # noqa: E402
+
+
+def subword_tokens(text: str) -> int:
+    """Stand-in for a WordPiece tokenizer: long words and punctuation cost extra tokens."""
+    return sum(math.ceil(len(w) / 4) for w in re.findall(r"\w+|[^\w\s]", text))
+
+
+def _sentences(rng, count, words=(4, 30)):
+    out = []
+    for _ in range(count):
+        n = int(rng.integers(*words))
+        out.append(" ".join("w" * int(rng.integers(1, 14)) for _ in range(n)).capitalize() + ".")
+    return out
+
+
+@pytest.fixture
+def pages():
+    rng = np.random.default_rng(0)
+    pages = []
+    for page_num in range(1, 6):
+        blocks = [{"text": " ".join(_sentences(rng, int(rng.integers(1, 8))))} for _ in range(4)]
+        pages.append({"pageNumber": page_num, "blocks": blocks})
+    # One sentence far over any limit
+    pages[2]["blocks"].append({"text": " ".join(["supercalifragilistic"] * 400) + "."})
+    return pages
+
+
+@pytest.mark.parametrize("limit", [16, 64, 254])
+def test_chunks_fit_the_token_limit(pages, limit):
+    chunks = chunk_pages(pages, subword_tokens, limit)
+    assert chunks
+    for chunk in chunks:
+        assert chunk["tokens"] == subword_tokens(chunk["text"])
+        assert chunk["tokens"] <= limit
+
+
+def test_chunks_stay_on_their_page_and_cover_every_word(pages, monkeypatch):
+    monkeypatch.setattr(pdf_processor, "CHUNK_OVERLAP_TOKENS", 0)
+    chunks = chunk_pages(pages, subword_tokens, 64)
+    for page in pages:
+        page_chunks = [c for c in chunks if c["pageNumber"] == page["pageNumber"]]
+        page_words = " ".join(b["text"] for b in page["blocks"]).split()
+        # Without overlap the page's chunks are its text, in order
+        assert " ".join(c["text"] for c in page_chunks).split() == page_words
+        for chunk in page_chunks:
+            block_words = {w for i in chunk["blockIds"] for w in page["blocks"][i]["text"].split()}
+            assert set(chunk["text"].split()) <= block_words
+
+
+def test_overlap_repeats_trailing_whole_sentences(monkeypatch):
+    monkeypatch.setattr(pdf_processor, "CHUNK_OVERLAP_TOKENS", 12)
+    text = " ".join(f"Item{i} has {'many ' * (i % 4)}words." for i in range(60))
+    chunks = chunk_pages([{"pageNumber": 1, "blocks": [{"text": text}]}], subword_tokens, 40)
+    assert len(chunks) > 2
+    overlapped = 0
+    for prev, chunk in zip(chunks, chunks[1:]):
+        prev_sentences = re.split(r"(?<=\.)\s+", prev["text"])
+        first = re.split(r"(?<=\.)\s+", chunk["text"])
+        shared = [s for s in first if s in prev_sentences]
+        if shared:
+            overlapped += 1
+            assert first[:len(shared)] == shared  # carried sentences lead the next chunk
+            assert prev_sentences[-len(shared):] == shared  # and trail the previous one
+            assert sum(subword_tokens(s) for s in shared) <= 12
+    assert overlapped
+
+
+def test_chunk_token_limit(monkeypatch):
+    assert chunk_token_limit() == DEFAULT_CHUNK_TOKENS
+    assert chunk_token_limit(128) == 128
+    monkeypatch.setattr(pdf_processor, "CHUNK_TOKEN_TARGET", 200)
+    assert chunk_token_limit() == 200
+    assert chunk_token_limit(128) == 128
+    assert chunk_token_limit(512) == 200
+
+
+def test_default_counts_whitespace_words():
+    pages = [{"pageNumber": 1, "blocks": [{"text": "One two three. Four five."}]}]
+    assert chunk_pages(pages) == [
+        {"text": "One two three. Four five.", "pageNumber": 1, "tokens": 5, "blockIds": [0]}
+    ]
@@ -0,0 +1,61 @@
+"""
+The ONNX exports (fp32 and dynamically quantized int8) must reproduce the
+PyTorch embeddings within benchmarks/check_embedding_parity.py's bounds.
+
+The graphs are exported afresh into a temporary directory, so this also
+covers the exporter. Skipped when the model or the runtimes are not
+available (the model is read from the local Hugging Face cache; set
+MIRAGE_TEST_EMBEDDING_MODEL to use another name or a local directory).
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WORKER_DIR)
+sys.path.insert(0, os.path.join(WORKER_DIR, "benchmarks"))
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+
+from bench_embeddings import synthetic_corpus  # noqa: E402
+from check_embedding_parity import MIN_COSINE, _normalize  # noqa: E402
+from embedding_backends import MODEL_NAME, OnnxBackend, TorchBackend, export_onnx  # noqa: E402
+
+MODEL = os.getenv("MIRAGE_TEST_EMBEDDING_MODEL", MODEL_NAME)
+
+
+@pytest.fixture(scope="module")
+def texts():
+    return synthetic_corpus(128)
+
+
+@pytest.fixture(scope="module")
+def reference(texts):
+    try:
+        backend = TorchBackend(MODEL)
+    except Exception as e:  # not downloaded and no network, etc.
+        pytest.skip(f"embedding model {MODEL} is not available: {e}")
+    return _normalize(backend.encode(texts))
+
+
+@pytest.fixture(scope="module")
+def model_dir(reference, tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("onnx"))
+    export_onnx(MODEL, directory)
+    return directory
+
+
+@pytest.mark.parametrize("name", ["onnx", "onnx-int8"])
+def test_onnx_matches_torch(name, texts, reference, model_dir):
+    backend = OnnxBackend(MODEL, quantized=(name == "onnx-int8"), model_dir=model_dir)
+    vectors = _normalize(backend.encode(texts))
+
+    assert vectors.shape == reference.shape
+    cosines = np.sum(reference * vectors, axis=1)
+    assert cosines.min() >= MIN_COSINE[name], (
+        f"{name}: min cosine to torch {cosines.min():.5f} < {MIN_COSINE[name]}"
+    )
@@ -0,0 +1,211 @@
+"""
+JobScheduler: deduplication by key, backpressure (QueueFullError, which
+the API answers with 429) and job outcomes. JobStore (multi-process mode):
+key claims across schedulers, orphaned jobs, pruning and upload state.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+from pydantic import BaseModel
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WORKER_DIR)
+
+import jobs  # noqa: E402
+from jobs import DONE, ERROR, ORPHANED, QUEUED, RUNNING, Job, JobScheduler, JobStore, QueueFullError  # noqa: E402
+
+
+def _scheduler(runner, max_concurrent=1, max_queued=1, **kwargs):
+    return JobScheduler(runner, max_concurrent=max_concurrent, max_queued=max_queued,
+                        result_ttl=60, **kwargs)
+
+
+def test_same_key_attaches_to_the_active_job():
+    calls = []
+
+    async def runner(payload, emit):
+        calls.append(payload)
+        await asyncio.sleep(0.05)
+        return {"payload": payload}
+
+    async def main():
+        scheduler = _scheduler(runner)
+        scheduler.start()
+        try:
+            first = await scheduler.submit("doc", "a")
+            retry = await scheduler.submit("doc", "b")
+            assert retry is first
+            job = await scheduler.wait(first)
+            # A finished job frees its key
+            again = await scheduler.submit("doc", "c")
+            assert again is not first
+            await scheduler.wait(again)
+            return job
+        finally:
+            await scheduler.stop()
+
+    job = asyncio.run(main())
+    assert job.status == DONE
+    assert job.result == {"payload": "a"}
+    assert calls == ["a", "c"]
+
+
+def test_submit_raises_queue_full_beyond_running_plus_queued():
+    release = None
+
+    async def runner(payload, emit):
+        await release.wait()
+        return {}
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        scheduler = _scheduler(runner, max_concurrent=1, max_queued=1)
+        scheduler.start()
+        try:
+            running = await scheduler.submit("a", None)
+            await asyncio.sleep(0)  # let the worker pick it up
+            queued = await scheduler.submit("b", None)
+            with pytest.raises(QueueFullError):
+                await scheduler.submit("c", None)
+            # Duplicates of accepted jobs are never rejected
+            assert await scheduler.submit("b", None) is queued
+            assert scheduler.stats()["queued"] == 1 and scheduler.stats()["running"] == 1
+
+            release.set()
+            await scheduler.wait(running)
+            await scheduler.wait(queued)
+            assert (await scheduler.submit("c", None)).key == "c"
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
+
+
+def test_runner_errors_and_events_reach_the_job():
+    async def runner(payload, emit):
+        emit({"type": "progress"})
+        raise RuntimeError("boom")
+
+    async def main():
+        scheduler = _scheduler(runner)
+        scheduler.start()
+        try:
+            job = await scheduler.submit("doc", None)
+            queue = job.subscribe()
+            job = await scheduler.wait(job)
+            events = []
+            while (event := queue.get_nowait()) is not None:
+                events.append(event)
+            return job, events
+        finally:
+            await scheduler.stop()
+
+    job, events = asyncio.run(main())
+    assert job.status == ERROR
+    assert job.error == "boom"
+    assert events == [{"type": "progress"}]
+
+
+class Payload(BaseModel):
+    documentId: str
+
+
+def _dead_owner():
+    # A pid that cannot exist, on this boot
+    return {"pid": 2 ** 22 + 1, "bootId": jobs.BOOT_ID, "started": 1}
+
+
+def test_schedulers_sharing_a_store_run_a_key_once(tmp_path):
+    calls = []
+
+    async def runner(payload, emit):
+        calls.append(payload.documentId)
+        await asyncio.sleep(0.1)
+        return {"ok": payload.documentId}
+
+    async def main():
+        # Two processes' schedulers over one directory
+        first = _scheduler(runner, store=JobStore(str(tmp_path), Payload))
+        second = _scheduler(runner, store=JobStore(str(tmp_path), Payload))
+        first.start()
+        second.start()
+        try:
+            job = await first.submit("doc", Payload(documentId="doc"))
+            attached = await second.submit("doc", Payload(documentId="doc"))
+            assert attached.id == job.id and not second.owns(attached)
+            assert (await second.get(job.id)).status in (QUEUED, RUNNING)
+            finished = await second.wait(attached, poll_interval=0.02)
+            # The key is free again once the job finished
+            again = await second.submit("doc", Payload(documentId="doc"))
+            assert second.owns(again)
+            await second.wait(again)
+            return finished
+        finally:
+            await first.stop()
+            await second.stop()
+
+    finished = asyncio.run(main())
+    assert finished.status == DONE
+    assert finished.result == {"ok": "doc"}
+    assert calls == ["doc", "doc"]
+
+
+def test_orphaned_jobs_fail_and_free_their_key(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path), Payload)
+    monkeypatch.setattr(jobs, "_owner", _dead_owner)
+    orphan = Job(id="a" * 32, key="doc", payload=Payload(documentId="doc"), status=RUNNING)
+    assert store.create(orphan) is None
+    monkeypatch.undo()
+
+    loaded = store.load(orphan.id)
+    assert loaded.status == ERROR and loaded.error == ORPHANED and loaded.finished_at
+    # The record on disk is updated too
+    assert store.load(orphan.id).status == ERROR
+
+    fresh = Job(id="b" * 32, key="doc", payload=Payload(documentId="doc"))
+    assert store.create(fresh) is None
+
+
+def test_live_claims_are_not_taken_over(tmp_path):
+    store = JobStore(str(tmp_path), Payload)
+    running = Job(id="a" * 32, key="doc", payload=Payload(documentId="doc"), status=RUNNING)
+    assert store.create(running) is None
+    duplicate = Job(id="b" * 32, key="doc", payload=Payload(documentId="doc"))
+    assert store.create(duplicate).id == running.id
+    assert store.load(duplicate.id) is None  # the duplicate's record is dropped
+
+    running.status, running.finished_at = DONE, 1.0
+    store.save(running)
+    store.release(running)
+    assert store.create(duplicate) is None
+
+
+def test_prune_drops_expired_records_and_fails_orphans(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path), Payload)
+    old = Job(id="a" * 32, key="old", payload=Payload(documentId="old"), status=DONE,
+              result={"big": "result"}, finished_at=1.0)
+    store.save(old)
+    monkeypatch.setattr(jobs, "_owner", _dead_owner)
+    orphan = Job(id="b" * 32, key="orphan", payload=Payload(documentId="orphan"))
+    store.save(orphan)
+    monkeypatch.undo()
+    store.save_upload("old", {"status": "DONE", "createdAt": 1.0, "finishedAt": 2.0})
+
+    store.prune(ttl=60)
+    assert store.load(old.id) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), f"{old.id}.result.json"))
+    assert store.load(orphan.id).error == ORPHANED
+    assert store.load_upload("old") is None
+
+
+def test_upload_state_keeps_the_newest_upload(tmp_path):
+    store = JobStore(str(tmp_path), Payload)
+    store.save_upload("doc/1", {"status": "UPLOADING", "createdAt": 20.0, "finishedAt": None})
+    store.save_upload("doc/1", {"status": "FAILED", "createdAt": 10.0, "finishedAt": 11.0})
+    assert store.load_upload("doc/1")["status"] == "UPLOADING"
+    store.save_upload("doc/1", {"status": "DONE", "createdAt": 20.0, "finishedAt": 25.0})
+    assert store.load_upload("doc/1")["status"] == "DONE"
+    assert store.load_upload("missing") is None
@@ -0,0 +1,89 @@
+"""
+Batched insight requests: how paragraphs are packed into requests, and how
+one batched answer is mapped back (or partly retried) per paragraph.
+"""
+import asyncio
+import json
+import os
+import sys
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WORKER_DIR)
+
+import llm  # noqa: E402
+from llm import FALLBACK_INSIGHT, _estimate_tokens, plan_batches  # noqa: E402
+
+
+def test_plan_batches_caps_items_and_keeps_order():
+    paragraphs = ["short paragraph"] * 13
+    batches = plan_batches(paragraphs, max_items=5, max_tokens=10_000)
+    assert batches == [list(range(0, 5)), list(range(5, 10)), list(range(10, 13))]
+
+
+def test_plan_batches_caps_tokens():
+    paragraphs = ["x" * 400] * 6  # 101 estimated tokens each
+    assert _estimate_tokens(paragraphs[0]) == 101
+    batches = plan_batches(paragraphs, max_items=10, max_tokens=250)
+    assert batches == [[0, 1], [2, 3], [4, 5]]
+    for batch in batches:
+        assert sum(_estimate_tokens(paragraphs[i]) for i in batch) <= 250
+
+
+def test_plan_batches_gives_oversized_paragraphs_their_own_batch():
+    paragraphs = ["a", "x" * 4000, "b", "c"]
+    assert plan_batches(paragraphs, max_items=10, max_tokens=100) == [[0], [1], [2, 3]]
+    assert plan_batches([], max_items=10, max_tokens=100) == []
+
+
+def _fake_completion(monkeypatch, answer, calls):
+    async def chat_completion(system, user):
+        calls.append(user)
+        if user.startswith("Paragraph:\n"):  # single-paragraph retry
+            return json.dumps({"insight": "retried " + user.split("\n", 1)[1], "highlights": []})
+        return answer(json.loads(user.split("\n", 1)[1]))
+    monkeypatch.setattr(llm, "chat_completion", chat_completion)
+
+
+def test_batched_answer_is_mapped_by_id(monkeypatch):
+    calls = []
+
+    def answer(items):
+        # Out of order and wrapped in an object, as some models do
+        return json.dumps({"results": [
+            {"id": item["id"], "insight": "about " + item["paragraph"], "highlights": [item["paragraph"]]}
+            for item in reversed(items)
+        ]})
+
+    _fake_completion(monkeypatch, answer, calls)
+    results = asyncio.run(llm._generate_insights_uncached(["one", "two", "three"]))
+    assert [r["insight"] for r in results] == ["about one", "about two", "about three"]
+    assert [r["highlights"] for r in results] == [["one"], ["two"], ["three"]]
+    assert len(calls) == 1
+
+
+def test_missing_or_malformed_items_are_retried_alone(monkeypatch):
+    calls = []
+
+    def answer(items):
+        return "```json\n" + json.dumps([
+            {"id": "p0", "insight": "fine", "highlights": ["one"]},
+            {"id": "p1", "insight": "", "highlights": []},
+        ]) + "\n```"
+
+    _fake_completion(monkeypatch, answer, calls)
+    results = asyncio.run(llm._generate_insights_uncached(["one", "two", "three"]))
+    assert [r["insight"] for r in results] == ["fine", "retried two", "retried three"]
+    assert len(calls) == 3
+
+
+def test_unparseable_batch_falls_back_per_paragraph(monkeypatch):
+    calls = []
+    _fake_completion(monkeypatch, lambda items: "not json", calls)
+    results = asyncio.run(llm._generate_insights_uncached(["one", "two"]))
+    assert [r["insight"] for r in results] == ["retried one", "retried two"]
+
+    async def failing(system, user):
+        raise RuntimeError("provider down")
+    monkeypatch.setattr(llm, "chat_completion", failing)
+    results = asyncio.run(llm._generate_insights_uncached(["one", "two"]))
+    assert results == [{"insight": FALLBACK_INSIGHT, "highlights": []}] * 2
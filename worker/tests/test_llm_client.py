@@ -0,0 +1,116 @@
+"""
+AdaptiveLimiter: additive increase per success, multiplicative decrease on
+overload or latency spikes (once per round trip), bounds, and slot().
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WORKER_DIR)
+
+import llm_client  # noqa: E402
+from llm_client import AdaptiveLimiter  # noqa: E402
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Only for tests that don't run an event loop (it reads the same clock)
+    clock = _Clock()
+    monkeypatch.setattr(llm_client.time, "monotonic", clock)
+    return clock
+
+
+def test_successes_grow_the_limit_by_about_one_per_round():
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=32)
+    for _ in range(4):
+        limiter.on_success(0.1)
+    assert 4.9 < limiter.limit < 5.0
+    for _ in range(1000):
+        limiter.on_success(0.1)
+    assert limiter.limit == 32
+
+
+def test_overload_halves_once_per_round_trip(clock):
+    limiter = AdaptiveLimiter(initial=16, minimum=1, maximum=32)
+    limiter.on_success(0.5)  # baseline latency: 0.5s
+    limiter.on_overload()
+    assert limiter.limit == pytest.approx(16.0625 / 2)
+    # Calls that were in flight at the same time report the same overload
+    limiter.on_overload()
+    limiter.on_overload()
+    assert limiter.limit == pytest.approx(16.0625 / 2)
+    clock.now += 0.6
+    limiter.on_overload()
+    assert limiter.limit == pytest.approx(16.0625 / 4)
+    assert limiter.overloads == 4
+
+
+def test_limit_never_drops_below_minimum(clock):
+    limiter = AdaptiveLimiter(initial=4, minimum=2, maximum=8)
+    for _ in range(10):
+        clock.now += 10
+        limiter.on_overload()
+    assert limiter.limit == 2
+
+
+def test_latency_spike_shrinks_by_a_tenth(clock):
+    limiter = AdaptiveLimiter(initial=10, minimum=1, maximum=32, spike_factor=3)
+    limiter.on_success(0.2)
+    base = limiter.limit
+    clock.now += 1
+    limiter.on_success(0.5)  # under 3x the baseline: normal
+    assert limiter.limit > base
+    grown = limiter.limit
+    clock.now += 1
+    limiter.on_success(2.0)
+    assert limiter.limit == pytest.approx(grown * 0.9)
+    assert limiter.spikes == 1
+    # A spike does not move the baseline
+    assert limiter.baseline_latency == pytest.approx(0.9 * 0.2 + 0.1 * 0.5)
+
+
+def test_initial_limit_is_clamped():
+    assert AdaptiveLimiter(initial=100, minimum=1, maximum=8).limit == 8
+    assert AdaptiveLimiter(initial=0, minimum=3, maximum=8).limit == 3
+
+
+def test_slot_caps_in_flight_calls():
+    limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=8)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(10)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.in_flight == 0
+
+
+def test_retry_after_pauses_new_calls():
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=8)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        limiter.on_overload(retry_after=0.2)
+        start = loop.time()
+        async with limiter.slot():
+            return loop.time() - start
+
+    assert asyncio.run(main()) >= 0.15
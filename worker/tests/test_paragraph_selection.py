@@ -0,0 +1,125 @@
+"""
+Embedding-based paragraph selection: MMR ordering, the per-document
+budget, streamed (per page batch) selection and the TF-IDF fallback.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WORKER_DIR)
+
+from pdf_processor import (  # noqa: E402
+    EmbeddingParagraphSelector,
+    _mmr_order,
+    select_important_paragraphs,
+    select_paragraphs_by_embedding,
+)
+from vector_index import normalize_rows  # noqa: E402
+
+
+def _unit(*rows):
+    return normalize_rows(np.array(rows, dtype=np.float32))
+
+
+def test_mmr_pure_relevance_ranks_by_centroid_similarity():
+    vectors = _unit([1, 0], [0.8, 0.6], [0.6, 0.8], [0, 1])
+    assert _mmr_order(vectors, 4, lam=1.0, centroid=np.array([1.0, 0.0])) == [0, 1, 2, 3]
+
+
+def test_mmr_skips_near_duplicates():
+    # Two copies of the most central row: relevance alone would take both
+    vectors = _unit([1, 0.1], [1, 0.1], [0.2, 1], [1, -0.3])
+    assert _mmr_order(vectors, 2, lam=1.0)[:2] == [0, 1]
+    picked = _mmr_order(vectors, 2, lam=0.5)
+    assert picked[0] in (0, 1) and not {0, 1} <= set(picked)
+
+
+def test_mmr_counts_redundancy_against_chosen_rows():
+    vectors = _unit([1, 0], [0, 1])
+    centroid = np.array([1.0, 0.2])
+    assert _mmr_order(vectors, 1, lam=0.5, centroid=centroid) == [0]
+    assert _mmr_order(vectors, 1, lam=0.5, centroid=centroid, chosen=_unit([1, 0])) == [1]
+
+
+def test_mmr_budget_larger_than_candidates():
+    vectors = _unit([1, 0], [0, 1])
+    assert sorted(_mmr_order(vectors, 5, lam=0.7)) == [0, 1]
+
+
+def _document(page_count=12, blocks_per_page=3, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    pages, chunks = [], []
+    for page_num in range(1, page_count + 1):
+        blocks = []
+        for b in range(blocks_per_page):
+            words = [f"w{int(w)}" for w in rng.integers(0, 400, size=30)]
+            blocks.append({"text": f"page{page_num} block{b} " + " ".join(words)})
+        blocks.append({"text": "Short caption."})  # below MIN_PARAGRAPH_WORDS
+        pages.append({"pageNumber": page_num, "blocks": blocks})
+        for b in range(len(blocks)):
+            chunks.append({
+                "text": blocks[b]["text"],
+                "pageNumber": page_num,
+                "blockIds": [b],
+                "embedding": rng.normal(size=dim).tolist(),
+            })
+    return pages, chunks
+
+
+def test_selection_respects_budget_and_reading_order():
+    pages, chunks = _document()
+    selected = select_paragraphs_by_embedding(pages, chunks, budget=7)
+    assert len(selected) == 7
+    keys = [(p["pageNumber"], p["text"]) for p in selected]
+    assert len(set(keys)) == 7
+    assert [p["pageNumber"] for p in selected] == sorted(p["pageNumber"] for p in selected)
+    assert all(p["text"] != "Short caption." for p in selected)
+    assert all(p["blocks"] is pages[p["pageNumber"] - 1]["blocks"] for p in selected)
+
+
+def test_overlapping_chunks_yield_each_block_once():
+    pages, chunks = _document(page_count=2, blocks_per_page=2)
+    # Every chunk repeated, as sentence overlap can produce
+    selected = select_paragraphs_by_embedding(pages, chunks + chunks, budget=10)
+    assert len(selected) == 4
+    assert len({(p["pageNumber"], p["text"]) for p in selected}) == 4
+
+
+def test_streamed_selection_spends_budget_pro_rata():
+    pages, chunks = _document(page_count=12)
+    selector = EmbeddingParagraphSelector(pages, budget=6)
+    picked = []
+    for first in range(1, 13, 4):
+        batch = [c for c in chunks if first <= c["pageNumber"] < first + 4]
+        picked.append(selector.add(batch))
+    picked.append(selector.finish())
+
+    assert [len(p) for p in picked] == [2, 2, 2, 0]
+    # Each batch only picks from the pages read so far
+    assert all(p["pageNumber"] <= 4 for p in picked[0])
+    texts = [p["text"] for batch in picked for p in batch]
+    assert len(set(texts)) == 6
+
+
+def test_chunks_without_block_ids_fall_back_to_tfidf():
+    pages, chunks = _document(page_count=3)
+    legacy = [{k: v for k, v in c.items() if k != "blockIds"} for c in chunks]
+    selector = EmbeddingParagraphSelector(pages, budget=4)
+    assert selector.add(legacy) == []
+    assert selector.finish() == select_important_paragraphs(pages)
+
+
+@pytest.mark.parametrize("budget", [1, 5, 40])
+def test_whole_document_selection_matches_streamed_total(budget):
+    pages, chunks = _document(page_count=6)
+    selector = EmbeddingParagraphSelector(pages, budget=budget)
+    streamed = []
+    for page_num in range(1, 7):
+        streamed += selector.add([c for c in chunks if c["pageNumber"] == page_num])
+    streamed += selector.finish()
+    candidates = 6 * 3
+    assert len(streamed) == min(budget, candidates)
+    assert len(select_paragraphs_by_embedding(pages, chunks, budget=budget)) == min(budget, candidates)
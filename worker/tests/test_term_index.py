@@ -0,0 +1,83 @@
+"""
+TermIndex.tfidf_scores must agree with the per-block scorer it replaced
+(kept below as the reference) wherever that scorer's substring matching
+and whole-token matching coincide.
+"""
+import math
+import os
+import re
+import sys
+from collections import Counter
+from typing import List
+
+import numpy as np
+import pytest
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WORKER_DIR)
+
+from term_index import TermIndex  # noqa: E402
+
+
+def _tfidf_score(text: str, all_texts: List[str]) -> float:
+    """The original pdf_processor scorer: df by substring scan of every block."""
+    words = re.findall(r'\w+', text.lower())
+    if not words:
+        return 0.0
+    tf = Counter(words)
+    N = len(all_texts)
+    score = 0.0
+    for word, count in tf.items():
+        tf_val = count / len(words)
+        df = sum(1 for t in all_texts if word in t.lower())
+        idf = math.log((N + 1) / (df + 1)) + 1
+        score += tf_val * idf
+    return score
+
+
+@pytest.fixture
+def texts():
+    # Equal-length words: one can only be a substring of another block if it
+    # occurs there as a whole token, so both definitions of df agree
+    rng = np.random.default_rng(0)
+    vocab = ["".join(rng.choice(list("abcdefghij"), 5)) for _ in range(300)]
+    zipf = 1 / np.arange(1, len(vocab) + 1)
+    blocks = []
+    for _ in range(200):
+        words = rng.choice(vocab, size=int(rng.integers(5, 60)), p=zipf / zipf.sum())
+        words = [w.capitalize() if rng.random() < 0.2 else w for w in words]
+        blocks.append(" ".join(words) + ".")
+    blocks += ["", "...", "Abcde abcde ABCDE"]
+    return blocks
+
+
+def test_scores_match_reference(texts):
+    scores = TermIndex(texts).tfidf_scores()
+    expected = [_tfidf_score(text, texts) for text in texts]
+    np.testing.assert_allclose(scores, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_ranking_matches_reference(texts):
+    scores = TermIndex(texts).tfidf_scores()
+    expected = np.array([_tfidf_score(text, texts) for text in texts])
+    assert list(np.argsort(-scores, kind="stable")) == list(np.argsort(-expected, kind="stable"))
+
+
+def test_from_pages_flattens_blocks_in_order():
+    pages = [
+        {"pageNumber": 1, "blocks": [{"text": "alpha beta"}, {"text": "gamma"}]},
+        {"pageNumber": 2, "blocks": [{"text": "beta beta"}]},
+    ]
+    index = TermIndex.from_pages(pages)
+    assert len(index) == 3
+    np.testing.assert_allclose(
+        index.tfidf_scores(), [_tfidf_score(t, index.texts) for t in index.texts]
+    )
+
+
+def test_document_frequency_counts_whole_tokens():
+    # The reference counts "cat" as occurring in "concatenate"; the index does not
+    texts = ["cat", "concatenate", "dog"]
+    idf_cat = math.log(4 / 2) + 1
+    assert TermIndex(texts).tfidf_scores()[0] == pytest.approx(idf_cat)
+    assert _tfidf_score("cat", texts) == pytest.approx(math.log(4 / 3) + 1)
@@ -0,0 +1,264 @@
+import os
+import time
+import random
+import shutil
+import asyncio
+import logging
+import tempfile
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger('worker.uploads')
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:5000")
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "5"))
+UPLOAD_BACKOFF_BASE = float(os.getenv("UPLOAD_BACKOFF_BASE", "1"))   # seconds, doubled per attempt
+UPLOAD_BACKOFF_MAX = float(os.getenv("UPLOAD_BACKOFF_MAX", "60"))
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", "120"))
+UPLOAD_RESULT_TTL = float(os.getenv("UPLOAD_RESULT_TTL", "3600"))     # seconds finished uploads stay queryable
+UPLOAD_SPOOL_DIR = os.getenv(
+    "UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "mirage-uploads")
+)
+
+PENDING = "PENDING"
+UPLOADING = "UPLOADING"
+DONE = "DONE"
+FAILED = "FAILED"
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter, so uploads that failed together don't retry together
+    return random.uniform(0, min(UPLOAD_BACKOFF_MAX, UPLOAD_BACKOFF_BASE * 2 ** attempt))
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+@dataclass
+class Upload:
+    document_id: str
+    path: str
+    filename: str
+    status: str = PENDING
+    url: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    on_done: Optional[Callable[[str], None]] = field(default=None, repr=False)
+
+    def to_status(self) -> dict:
+        return {
+            "status": self.status,
+            "annotatedFileUrl": self.url,
+            "error": self.error,
+            "attempts": self.attempts,
+            "createdAt": self.created_at,
+            "finishedAt": self.finished_at,
+        }
+
+
+class AnnotatedUploader:
+    """
+    Uploads annotated PDFs in the background so the pipeline can return
+    without waiting on the backend.
+
+    Files are moved into a spool directory (the job's checkpoint is cleared
+    right after), streamed to /api/uploadthing-upload as multipart over one
+    keep-alive httpx client, and retried on 429/5xx/connection errors with
+    jittered exponential backoff. The outcome is kept per documentId for
+    status queries and reported to the backend at
+    POST /api/documents/:documentId/annotated. With a `store` (a
+    jobs.JobStore shared by the worker processes) every state change is
+    also written there, so any process can answer status queries.
+    """
+
+    def __init__(self, backend_url: str = BACKEND_URL, concurrency: int = UPLOAD_CONCURRENCY,
+                 spool_dir: str = UPLOAD_SPOOL_DIR, store=None):
+        self.backend_url = backend_url.rstrip("/")
+        self.concurrency = max(1, concurrency)
+        self.spool_dir = spool_dir
+        self.store = store
+        self._uploads: Dict[str, Upload] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.uploaded = 0
+        self.failed = 0
+        self.retries = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=UPLOAD_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=self.concurrency,
+                    max_keepalive_connections=self.concurrency,
+                ),
+            )
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._client
+
+    async def submit(self, document_id: str, path: str, filename: str,
+                     on_done: Optional[Callable[[str], None]] = None, copy: bool = False) -> Upload:
+        """
+        Queue `path` for upload and return once it is spooled. The file is
+        moved into the spool (copied with copy=True, e.g. for document cache
+        entries) in a worker thread. `on_done(url)` runs after a successful upload.
+        """
+        self._prune()
+        spooled = await asyncio.to_thread(self._spool, document_id, path, copy)
+
+        upload = Upload(document_id=document_id, path=spooled, filename=filename, on_done=on_done)
+        previous = self._tasks.pop(document_id, None)
+        if previous is not None:
+            previous.cancel()  # a newer annotated PDF supersedes the one in flight
+        self._uploads[document_id] = upload
+        self._tasks[document_id] = asyncio.create_task(self._run(upload))
+        await self._save(upload)
+        return upload
+
+    def _spool(self, document_id: str, path: str, copy: bool) -> str:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        fd, spooled = tempfile.mkstemp(dir=self.spool_dir, prefix=f"{document_id[:64]}-", suffix=".pdf")
+        os.close(fd)
+        if copy:
+            shutil.copyfile(path, spooled)
+        else:
+            os.replace(path, spooled)
+        return spooled
+
+    async def status(self, document_id: str) -> Optional[dict]:
+        """Upload state for a document; uploads run by another process are read from the store."""
+        upload = self._uploads.get(document_id)
+        if upload is not None:
+            return upload.to_status()
+        if self.store is not None:
+            return await asyncio.to_thread(self.store.load_upload, document_id)
+        return None
+
+    async def _save(self, upload: Upload):
+        # A superseded upload must not overwrite the state of its successor
+        if self.store is None or self._uploads.get(upload.document_id) is not upload:
+            return
+        try:
+            await asyncio.to_thread(self.store.save_upload, upload.document_id, upload.to_status())
+        except Exception as e:
+            logger.warning('[%s] could not store upload state: %s', upload.document_id, e)
+
+    async def _run(self, upload: Upload):
+        client = self._get_client()
+        try:
+            async with self._slots:
+                upload.status = UPLOADING
+                await self._save(upload)
+                upload.url = await self._with_retries(
+                    upload.document_id, lambda: self._post_file(client, upload), upload
+                )
+            upload.status = DONE
+            self.uploaded += 1
+            logger.info('[%s] annotated PDF uploaded after %d attempt(s)', upload.document_id, upload.attempts)
+            if upload.on_done is not None:
+                try:
+                    await asyncio.to_thread(upload.on_done, upload.url)
+                except Exception as e:
+                    logger.warning('[%s] upload callback failed: %s', upload.document_id, e)
+        except asyncio.CancelledError:
+            upload.status = FAILED
+            upload.error = "cancelled"
+            raise
+        except Exception as e:
+            upload.status = FAILED
+            upload.error = str(e)
+            self.failed += 1
+            logger.warning('[%s] annotated PDF upload failed, keeping the original URL: %s',
+                           upload.document_id, e)
+        finally:
+            upload.finished_at = time.time()
+            if self._tasks.get(upload.document_id) is asyncio.current_task():
+                self._tasks.pop(upload.document_id, None)
+            try:
+                os.remove(upload.path)
+            except OSError:
+                pass
+            await self._save(upload)
+
+        await self._notify_backend(client, upload)
+
+    async def _with_retries(self, document_id: str, attempt_fn, upload: Optional[Upload] = None):
+        for attempt in range(UPLOAD_MAX_RETRIES + 1):
+            if upload is not None:
+                upload.attempts += 1
+            try:
+                return await attempt_fn()
+            except Exception as e:
+                if attempt == UPLOAD_MAX_RETRIES or not _retryable(e):
+                    raise
+                delay = _backoff(attempt)
+                self.retries += 1
+                logger.info('[%s] upload request failed (%s), retrying in %.1fs', document_id, e, delay)
+                await asyncio.sleep(delay)
+
+    async def _post_file(self, client: httpx.AsyncClient, upload: Upload) -> str:
+        # httpx streams file objects in chunks, so the PDF is never read into memory whole
+        with open(upload.path, "rb") as f:
+            response = await client.post(
+                f"{self.backend_url}/api/uploadthing-upload",
+                files={"file": (upload.filename, f, "application/pdf")},
+            )
+        response.raise_for_status()
+        return response.json()["fileUrl"]
+
+    async def _notify_backend(self, client: httpx.AsyncClient, upload: Upload):
+        """Tell the backend the outcome, so the stored document picks up the annotated URL."""
+        body = {"annotatedFileUrl": upload.url} if upload.status == DONE else {"error": upload.error}
+        url = f"{self.backend_url}/api/documents/{upload.document_id}/annotated"
+
+        async def post():
+            response = await client.post(url, json=body)
+            response.raise_for_status()
+
+        try:
+            await self._with_retries(upload.document_id, post)
+        except Exception as e:
+            logger.warning('[%s] could not report annotated upload to backend: %s', upload.document_id, e)
+
+    def _prune(self):
+        now = time.time()
+        expired = [
+            document_id for document_id, upload in self._uploads.items()
+            if upload.finished_at and now - upload.finished_at > UPLOAD_RESULT_TTL
+        ]
+        for document_id in expired:
+            self._uploads.pop(document_id, None)
+
+    async def aclose(self, grace: float = 30.0):
+        """Give in-flight uploads `grace` seconds to finish, then cancel them."""
+        tasks = list(self._tasks.values())
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=grace)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+    def stats(self) -> dict:
+        return {
+            "inFlight": len(self._tasks),
+            "uploaded": self.uploaded,
+            "failed": self.failed,
+            "retries": self.retries,
+        }
@@ -0,0 +1,289 @@
+import os
+import time
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger('worker.vector_index')
+
+# Total vectors held across all projects before least-recently-used projects are dropped
+VECTOR_INDEX_MAX_VECTORS = int(os.getenv("VECTOR_INDEX_MAX_VECTORS", "2000000"))
+# Keep every project in the on-disk ANN index, whatever its size, so all worker
+# processes search the same data (serve.py sets this with WORKER_PROCESSES>1)
+VECTOR_INDEX_SHARED = os.getenv("VECTOR_INDEX_SHARED", "false").lower() in ("1", "true", "yes")
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, via partial selection."""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class _DocumentBlock:
+    __slots__ = ("vectors", "texts", "pages")
+
+    def __init__(self, vectors: np.ndarray, texts: List[str], pages: np.ndarray):
+        self.vectors = vectors
+        self.texts = texts
+        self.pages = pages
+
+
+class ProjectIndex:
+    """
+    Brute-force cosine index for one project.
+
+    Vectors are stored L2-normalised per document; a contiguous matrix over
+    all documents is rebuilt lazily after adds/removes, so each document
+    owns one row range and a documentId filter is a slice, not a mask.
+    """
+
+    def __init__(self):
+        self._docs: "OrderedDict[str, _DocumentBlock]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._ranges: Dict[str, tuple] = {}
+        self._texts: List[str] = []
+        self._pages: Optional[np.ndarray] = None
+        self._owners: List[str] = []
+        self._starts: Optional[np.ndarray] = None  # first row of each of _owners
+        self._dirty = True
+
+    @property
+    def size(self) -> int:
+        return sum(len(block.texts) for block in self._docs.values())
+
+    def document_ids(self) -> List[str]:
+        return list(self._docs.keys())
+
+    def upsert_document(self, document_id: str, chunks: List[Dict]):
+        if not chunks:
+            self.remove_document(document_id)
+            return
+        vectors = normalize_rows(np.stack([np.asarray(c["embedding"], dtype=np.float32) for c in chunks]))
+        texts = [c.get("text", "") for c in chunks]
+        pages = np.asarray([c.get("pageNumber", 0) for c in chunks], dtype=np.int32)
+        self._docs[document_id] = _DocumentBlock(vectors, texts, pages)
+        self._dirty = True
+
+    def remove_document(self, document_id: str):
+        if self._docs.pop(document_id, None) is not None:
+            self._dirty = True
+
+    def _rebuild(self):
+        if not self._dirty:
+            return
+        ranges, texts, pages, owners, starts, blocks = {}, [], [], [], [], []
+        offset = 0
+        for document_id, block in self._docs.items():
+            n = len(block.texts)
+            ranges[document_id] = (offset, offset + n)
+            starts.append(offset)
+            blocks.append(block.vectors)
+            texts.extend(block.texts)
+            pages.append(block.pages)
+            owners.append(document_id)
+            offset += n
+        self._matrix = np.concatenate(blocks) if blocks else None
+        self._pages = np.concatenate(pages) if pages else None
+        self._ranges = ranges
+        self._texts = texts
+        self._owners = owners
+        self._starts = np.asarray(starts, dtype=np.int64)
+        self._dirty = False
+
+    def search(self, query: np.ndarray, k: int, document_ids: Optional[Iterable[str]] = None) -> List[Dict]:
+        self._rebuild()
+        if self._matrix is None:
+            return []
+
+        q = normalize_rows(query.reshape(1, -1))[0]
+        if document_ids is None:
+            row_ranges = list(self._ranges.values())
+        else:
+            row_ranges = [self._ranges[d] for d in document_ids if d in self._ranges]
+        if not row_ranges:
+            return []
+
+        if len(row_ranges) == len(self._ranges):
+            rows = None
+            scores = self._matrix @ q
+        else:
+            rows = np.concatenate([np.arange(start, end) for start, end in row_ranges])
+            scores = self._matrix[rows] @ q
+
+        results = []
+        for i in top_k(scores, k):
+            row = int(rows[i]) if rows is not None else int(i)
+            results.append({
+                "documentId": self._owner_of(row),
+                "pageNumber": int(self._pages[row]),
+                "text": self._texts[row],
+                "score": float(scores[i]),
+            })
+        return results
+
+    def _owner_of(self, row: int) -> str:
+        # Documents are never empty, so the starts are strictly increasing
+        return self._owners[int(np.searchsorted(self._starts, row, side="right")) - 1]
+
+
+class VectorIndex:
+    """
+    Per-project index registry with a global in-memory vector budget (LRU by project).
+
+    Projects start as in-memory ProjectIndex brute-force matrices. Once a
+    project reaches ANN_MIN_VECTORS it is migrated to an on-disk IVF index
+    (ann_index.AnnIndex) that every worker process mmaps and shares, and all
+    later inserts for it go through the ANN delta log. With
+    VECTOR_INDEX_SHARED every project lives in the ANN index from its first
+    document, since a memory index is only visible to its own process.
+    """
+
+    def __init__(self, max_vectors: int = VECTOR_INDEX_MAX_VECTORS):
+        self.max_vectors = max_vectors
+        self._projects: "OrderedDict[str, ProjectIndex]" = OrderedDict()
+        self._ann: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.search_seconds = 0.0
+
+    def _project(self, project_id: str, create: bool = False) -> Optional[ProjectIndex]:
+        index = self._projects.get(project_id)
+        if index is None and create:
+            index = self._projects[project_id] = ProjectIndex()
+        if index is not None:
+            self._projects.move_to_end(project_id)
+        return index
+
+    def _ann_index(self, project_id: str, create: bool = False):
+        """
+        The project's on-disk ANN index if one has been built (by any
+        process); with `create`, also one not built yet (the first insert
+        builds it).
+        """
+        from ann_index import ANN_INDEX_DIR, AnnIndex
+
+        if not ANN_INDEX_DIR:
+            return None
+        ann = self._ann.get(project_id)
+        if ann is None:
+            ann = self._ann[project_id] = AnnIndex.for_project(project_id)
+        if not create and not ann.exists():
+            return None
+        # Another process may have migrated the project; drop our memory copy
+        self._projects.pop(project_id, None)
+        return ann
+
+    def upsert(self, project_id: str, document_id: str, chunks: List[Dict]):
+        from ann_index import ANN_INDEX_DIR, ANN_MIN_VECTORS
+
+        with self._lock:
+            ann = self._ann_index(project_id, create=VECTOR_INDEX_SHARED and bool(chunks))
+            if ann is not None:
+                if chunks:
+                    vectors = np.stack([np.asarray(c["embedding"], dtype=np.float32) for c in chunks])
+                    ann.insert(
+                        document_id,
+                        vectors,
+                        [c.get("text", "") for c in chunks],
+                        np.asarray([c.get("pageNumber", 0) for c in chunks], dtype=np.int32),
+                    )
+                else:
+                    ann.remove(document_id)
+                return
+
+            index = self._project(project_id, create=True)
+            index.upsert_document(document_id, chunks)
+            if ANN_INDEX_DIR and index.size >= ANN_MIN_VECTORS:
+                self._migrate_to_ann(project_id, index)
+            else:
+                self._enforce_budget(keep=project_id)
+
+    def _migrate_to_ann(self, project_id: str, index: ProjectIndex):
+        from ann_index import AnnIndex
+
+        logger.info('building ANN index for project %s (%d vectors)', project_id, index.size)
+        docs = {
+            document_id: (block.vectors, block.texts, block.pages)
+            for document_id, block in index._docs.items()
+        }
+        ann = self._ann[project_id] = AnnIndex.for_project(project_id)
+        ann.build(docs)
+        self._projects.pop(project_id, None)
+
+    def remove(self, project_id: str, document_id: Optional[str] = None):
+        with self._lock:
+            ann = self._ann_index(project_id)
+            if document_id is None:
+                self._projects.pop(project_id, None)
+                if ann is not None:
+                    shutil.rmtree(ann.directory, ignore_errors=True)
+                    self._ann.pop(project_id, None)
+                return
+            if ann is not None:
+                ann.remove(document_id)
+            index = self._project(project_id)
+            if index is not None:
+                index.remove_document(document_id)
+
+    def document_ids(self, project_id: str) -> List[str]:
+        with self._lock:
+            ann = self._ann_index(project_id)
+            if ann is not None:
+                return ann.document_ids()
+            index = self._project(project_id)
+            return index.document_ids() if index else []
+
+    def search(self, project_id: str, query: np.ndarray, k: int,
+               document_ids: Optional[Iterable[str]] = None,
+               nprobe: Optional[int] = None) -> List[Dict]:
+        started = time.perf_counter()
+        with self._lock:
+            ann = self._ann_index(project_id)
+            if ann is not None:
+                results = ann.search(query, k, document_ids, nprobe=nprobe)
+            else:
+                index = self._project(project_id)
+                results = index.search(query, k, document_ids) if index else []
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+        return results
+
+    def _enforce_budget(self, keep: str):
+        total = sum(index.size for index in self._projects.values())
+        while total > self.max_vectors and len(self._projects) > 1:
+            project_id, index = next(iter(self._projects.items()))
+            if project_id == keep:
+                self._projects.move_to_end(project_id)
+                continue
+            total -= index.size
+            del self._projects[project_id]
+            logger.info('evicted vector index for project %s', project_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            vectors = sum(index.size for index in self._projects.values())
+            projects = len(self._projects)
+            ann_projects = sum(1 for ann in self._ann.values() if ann.exists())
+        return {
+            "projects": projects,
+            "vectors": vectors,
+            "annProjects": ann_projects,
+            "searches": self.searches,
+            "avgSearchMs": round(1000 * self.search_seconds / self.searches, 3) if self.searches else 0.0,
+        }
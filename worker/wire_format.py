@@ -0,0 +1,162 @@
+import json
+import base64
+from typing import Dict, Iterator, List, Sequence
+
+import numpy as np
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+    from fastapi.responses import JSONResponse as FastJSONResponse
+
+# "json" keeps embeddings as plain float lists (the default, for old clients).
+# The others carry each vector as base64 of little-endian values.
+EMBEDDING_ENCODINGS = ("json", "float32", "float16", "int8")
+# Lossless for the model's float32 output
+RETAINED_ENCODING = "float32"
+
+
+def encode_embedding(vector: Sequence[float], encoding: str) -> Dict:
+    """
+    Encode one vector for the wire.
+    Returns {"embedding": [...]} for "json", otherwise {"embeddingB64": "..."}
+    plus "embeddingScale" for int8 (value = int8 * scale, symmetric per vector).
+    """
+    if encoding == "json":
+        return {"embedding": list(vector)}
+
+    arr = np.asarray(vector, dtype=np.float32)
+    if encoding == "float32":
+        raw = arr.astype("<f4").tobytes()
+        return {"embeddingB64": base64.b64encode(raw).decode("ascii")}
+    if encoding == "float16":
+        raw = arr.astype("<f2").tobytes()
+        return {"embeddingB64": base64.b64encode(raw).decode("ascii")}
+    if encoding == "int8":
+        peak = float(np.max(np.abs(arr))) if arr.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        raw = np.clip(np.rint(arr / scale), -127, 127).astype(np.int8).tobytes()
+        return {"embeddingB64": base64.b64encode(raw).decode("ascii"), "embeddingScale": scale}
+    raise ValueError(f"unknown embedding encoding: {encoding}")
+
+
+def decode_embedding(item: Dict, encoding: str) -> np.ndarray:
+    """Inverse of encode_embedding for a chunk/item dict."""
+    if item.get("embedding") is not None:
+        return np.asarray(item["embedding"], dtype=np.float32)
+    raw = base64.b64decode(item["embeddingB64"])
+    if encoding == "float32":
+        return np.frombuffer(raw, dtype="<f4").astype(np.float32)
+    if encoding == "float16":
+        return np.frombuffer(raw, dtype="<f2").astype(np.float32)
+    if encoding == "int8":
+        return np.frombuffer(raw, dtype=np.int8).astype(np.float32) * float(item.get("embeddingScale", 1.0))
+    raise ValueError(f"unknown embedding encoding: {encoding}")
+
+
+def encoding_header(encoding: str, dim: int) -> Dict:
+    return {"dtype": encoding, "dim": dim, "byteOrder": "little"}
+
+
+def compact_result(result: Dict) -> Dict:
+    """
+    The form a finished job keeps its result in: chunk embeddings packed as
+    float32 (RETAINED_ENCODING) instead of float lists, several times smaller
+    in memory and in the job store. The encoders below accept either form.
+    """
+    chunks = result.get("chunks")
+    if not chunks or "embedding" not in chunks[0]:
+        return result
+    return {**result, "chunks": encode_chunks(chunks, RETAINED_ENCODING)}
+
+
+def _embedding_dim(chunk: Dict) -> int:
+    if "embedding" in chunk:
+        return len(chunk["embedding"])
+    return len(base64.b64decode(chunk["embeddingB64"])) // 4  # packed by compact_result
+
+
+def encode_chunks(chunks: List[Dict], encoding: str) -> List[Dict]:
+    encoded = []
+    for chunk in chunks:
+        if "embedding" in chunk:
+            if encoding == "json":
+                encoded.append(chunk)
+                continue
+            vector = chunk["embedding"]
+        else:
+            if encoding == RETAINED_ENCODING:
+                encoded.append(chunk)
+                continue
+            vector = decode_embedding(chunk, RETAINED_ENCODING).tolist()
+        item = {k: v for k, v in chunk.items() if k not in ("embedding", "embeddingB64")}
+        item.update(encode_embedding(vector, encoding))
+        encoded.append(item)
+    return encoded
+
+
+def _encode_chunk_list(record: Dict, encoding: str) -> Dict:
+    chunks = record.get("chunks") or []
+    encoded = {**record, "chunks": encode_chunks(chunks, encoding)}
+    if encoding != "json":
+        encoded["embeddingEncoding"] = encoding_header(encoding, _embedding_dim(chunks[0]) if chunks else 0)
+    return encoded
+
+
+def encode_result(result: Dict, encoding: str) -> Dict:
+    """Re-encode a /process result's chunk embeddings; other fields pass through."""
+    return _encode_chunk_list(result, encoding)
+
+
+# ── Streaming ─────────────────────────────────────────────────────────────────
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def encode_event(event: Dict, encoding: str) -> Dict:
+    """Re-encode the embeddings of a "chunks" stream event; other events pass through."""
+    if event.get("type") != "chunks":
+        return event
+    return _encode_chunk_list(event, encoding)
+
+
+def format_event(event: Dict, fmt: str) -> bytes:
+    """One NDJSON line, or one SSE message named after the event type."""
+    data = dumps(event)
+    if fmt == "sse":
+        return b"event: " + event["type"].encode("ascii") + b"\ndata: " + data + b"\n\n"
+    return data + b"\n"
+
+
+def result_events(result: Dict) -> Iterator[Dict]:
+    """Replay a finished /process result as stream events (per-page chunks, insights, summary)."""
+    page_chunks: List[Dict] = []
+    for chunk in result.get("chunks") or []:
+        if page_chunks and chunk["pageNumber"] != page_chunks[0]["pageNumber"]:
+            yield {"type": "chunks", "chunks": page_chunks}
+            page_chunks = []
+        page_chunks.append(chunk)
+    if page_chunks:
+        yield {"type": "chunks", "chunks": page_chunks}
+    for insight in result.get("insights") or []:
+        yield {"type": "insight", "insight": insight}
+    yield summary_event(result)
+
+
+def summary_event(result: Dict) -> Dict:
+    event = {
+        "type": "summary",
+        "pageCount": result["pageCount"],
+        "annotatedFileUrl": result["annotatedFileUrl"],
+        "chunkCount": len(result.get("chunks") or []),
+        "insightCount": len(result.get("insights") or []),
+    }
+    for key in ("annotatedUploadStatus", "annotationOverlay"):
+        if key in result:
+            event[key] = result[key]
+    return event